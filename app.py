@@ -1,11 +1,31 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, send_file, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import sqlite3
 import os
 import urllib.parse, urllib.request, json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import time
+import threading
+import tempfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import xml.etree.ElementTree as ET
+import queue
+from contextlib import contextmanager
+from collections import deque
+
+from ride_stats import accumulate_progress, progress_stats
+from track_store import load_ride_track, store_ride_track, encode_polyline
+from track_filter import clean_ride_track, MAX_ACCURACY_M
+from gpx_import import iter_gpx_points, read_gpx_track
+from ride_import import archive_members, parse_archive_member, prepare_ride, save_imported_rides
+from ride_export import EXPORT_FORMATS, export_ride, coalesce, gzip_chunks, slugify, account_export_version, write_account_export
+from track_simplify import load_simplified_track, load_simplified_tracks, snap_tolerance, tolerance_for_zoom
+from migrations import apply_migrations
+import queries as sql
+from query_runner import query_stats, execute_query, run_query
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'dev_secret')
@@ -41,38 +61,498 @@ EVENT_STATUSES = {
     'cancelled': '❌ Cancelled'
 }
 
+# ======== DATABASE CONNECTIONS ========
+
+DATABASE = 'moto_log.db'
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = 10.0  # seconds to wait for a free connection before giving up
+# Prepared statements kept per connection (sqlite3's LRU keyed on the SQL text). Every
+# query lives in queries.py, so sizing it past the registry means a pooled connection
+# prepares each statement once and reuses it for as long as the connection lives
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', len(sql.QUERIES) + 64))
+
+class Connection(sqlite3.Connection):
+    """
+    Pooled connection with a unit of work for handlers that write several statements:
+
+        db = get_db()
+        with db.transaction():
+            query_db(...)
+            execute_query(db, ..., rows, many=True)
+
+    The block runs between BEGIN IMMEDIATE and a single COMMIT, or is rolled back as a
+    whole if it raises. Inside it, query_db and helpers that commit on their own
+    (`with conn:`, conn.commit()) join the unit instead of committing part of it, and so
+    do nested transaction() blocks.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.unit_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        if self.unit_depth:
+            self.unit_depth += 1
+            try:
+                yield self
+            finally:
+                self.unit_depth -= 1
+            return
+
+        self.execute('BEGIN IMMEDIATE')  # take the write lock up front, not halfway through
+        self.unit_depth = 1
+        try:
+            yield self
+        except BaseException:
+            self.unit_depth = 0
+            super().rollback()
+            raise
+        self.unit_depth = 0
+        self.commit()
+
+    def commit(self):
+        if self.unit_depth or not self.in_transaction:
+            return
+        start = time.perf_counter()
+        super().commit()
+        query_stats.record_commit(time.perf_counter() - start)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.unit_depth:
+            return False  # the enclosing transaction() commits or rolls back
+        if exc_type is None:
+            self.commit()
+            return False
+        return super().__exit__(exc_type, exc, tb)
+
+class ConnectionPool:
+    """
+    Bounded per-process pool of SQLite connections.
+    Connections are created lazily up to max_size, configured once (PRAGMAs, row factory)
+    and then reused across requests instead of reconnecting on every query.
+    """
+
+    def __init__(self, database, max_size=8, timeout=DB_POOL_TIMEOUT):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=10.0, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE, factory=Connection)
+        conn.row_factory = sqlite3.Row
+        # Set per-connection PRAGMAs once, when the connection is opened
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA foreign_keys = ON')
+        except sqlite3.Error:
+            pass
+        return conn
+
+    def acquire(self):
+        """Return an idle connection, open a new one if under the limit, or wait for one to be released"""
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._hits += 1
+                self._in_use += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+                self._misses += 1
+                self._in_use += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                    self._in_use -= 1
+                raise
+
+        # Pool exhausted: block until another request releases a connection
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f'Timed out after {self.timeout}s waiting for a database connection')
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._hits += 1
+            self._waits += 1
+            self._in_use += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back anything left uncommitted"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection: drop it so a fresh one is opened next time
+            with self._lock:
+                self._created -= 1
+                self._in_use -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def stats(self):
+        """Snapshot of pool usage counters (wait times in milliseconds)"""
+        with self._lock:
+            requests_total = self._hits + self._misses
+            return {
+                'max_size': self.max_size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / requests_total, 4) if requests_total else 0.0,
+                'waits': self._waits,
+                'total_wait_ms': round(self._total_wait * 1000, 2),
+                'avg_wait_ms': round(self._total_wait * 1000 / self._waits, 2) if self._waits else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 2),
+            }
+
+# Bring the schema up to date once per process, before any connection is handed out;
+# request handlers never run DDL (see migrations.py)
+for version, name in apply_migrations(DATABASE):
+    print(f"✅ Applied schema migration {version:03d} {name}")
+
+db_pool = ConnectionPool(DATABASE, max_size=DB_POOL_SIZE)
+
+def get_db():
+    """Return the connection bound to the current app context, checking one out of the pool on first use"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
 def query_db(query, args=(), one=False):
-    # Use WAL mode for better concurrency, increase timeout, enable foreign keys, and retry on lock
-    import time
+    # Runs on the request's pooled connection; retry with backoff if the database is locked
     max_retries = 3
     retry_delay = 0.5
-    last_error = None
-    
+    conn = get_db()
+    if conn.unit_depth:
+        # Part of a db.transaction(): it holds the write lock and commits or rolls back as a whole
+        return run_query(conn, query, args, one)
+
     for attempt in range(max_retries):
         try:
-            conn = sqlite3.connect('moto_log.db', timeout=10.0)
-            conn.row_factory = sqlite3.Row
-            # Enable WAL mode for better concurrency
-            try:
-                conn.execute('PRAGMA journal_mode=WAL')
-                conn.execute('PRAGMA foreign_keys = ON')
-            except Exception:
-                pass
-            cur = conn.cursor()
-            cur.execute(query, args)
-            rv = cur.fetchall()
+            rv = run_query(conn, query, args, one)
             conn.commit()
-            conn.close()
-            return (rv[0] if rv else None) if one else rv
+            return rv
         except sqlite3.OperationalError as e:
-            last_error = e
+            if conn.in_transaction:
+                conn.rollback()
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
                 retry_delay *= 2  # exponential backoff
             else:
-                raise last_error
-        except Exception as e:
-            raise e
+                raise e
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+# ======== BACKGROUND JOBS ========
+
+# Work handed off by request handlers, persisted in the jobs table (migrate_add_job_queue.py)
+# so it survives restarts. Every serving process runs one worker thread, started by
+# start_job_worker() and never on import (scripts and the import pool's spawn children
+# import this module too); a job is claimed under the write lock, so several processes
+# can share the queue.
+JOB_WORKER_ENABLED = os.environ.get('JOB_WORKER', '1') != '0'
+JOB_POLL_INTERVAL = 5.0     # seconds between checks for jobs queued by other processes
+JOB_LEASE = 300             # seconds without progress before a running job is taken over
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 30        # seconds, times the number of attempts so far
+JOB_KEEP_DONE = 7 * 24 * 3600
+JOB_PURGE_INTERVAL = 3600
+
+# kind -> handler(conn, job); job has id, kind, payload (decoded) and cursor
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    """Register a function as the handler of a job kind"""
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return register
+
+def enqueue_job(kind, payload):
+    """
+    Queue a job on the request's connection (part of any open db.transaction()) and wake
+    the worker, starting it if this serving process has not yet
+    """
+    db = get_db()
+    job_id = execute_query(db, sql.JOB_INSERT, (kind, json.dumps(payload))).lastrowid
+    db.commit()
+    start_job_worker()
+    job_worker.wake()
+    return job_id
+
+def advance_job(conn, job, cursor):
+    """Record a handler's resume position; call inside the transaction that did the work"""
+    execute_query(conn, sql.JOB_ADVANCE, (cursor, job['id']))
+    job['cursor'] = cursor
+
+class JobWorker:
+    """Daemon thread running queued jobs one at a time on a pooled connection"""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_purge = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='job-worker', daemon=True)
+                self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def wake(self):
+        self._wake.set()
+
+    def _claim(self, conn):
+        with conn.transaction():
+            row = run_query(conn, sql.JOB_NEXT, (f'-{JOB_LEASE} seconds',), one=True)
+            if row:
+                execute_query(conn, sql.JOB_START, (row['id'],))
+        return row
+
+    def run_next(self):
+        """Run the next due job, if any; returns whether there was one"""
+        conn = db_pool.acquire()
+        try:
+            row = self._claim(conn)
+            if not row:
+                if time.monotonic() - self._last_purge > JOB_PURGE_INTERVAL:
+                    self._last_purge = time.monotonic()
+                    with conn.transaction():
+                        execute_query(conn, sql.JOB_PURGE_DONE, (f'-{JOB_KEEP_DONE} seconds',))
+                return False
+            job = dict(row, payload=json.loads(row['payload']))
+            try:
+                handler = self.handlers[job['kind']]
+                handler(conn, job)
+            except Exception as e:
+                print(f"Job {job['id']} ({job['kind']}) failed: {e}")
+                with conn.transaction():
+                    if row['attempts'] + 1 < JOB_MAX_ATTEMPTS:
+                        delay = JOB_RETRY_DELAY * (row['attempts'] + 1)
+                        execute_query(conn, sql.JOB_RETRY, (str(e), f'+{delay} seconds', job['id']))
+                    else:
+                        execute_query(conn, sql.JOB_FAIL, (str(e), job['id']))
+                return True
+            with conn.transaction():
+                execute_query(conn, sql.JOB_DONE, (job['id'],))
+            return True
+        finally:
+            db_pool.release(conn)
+
+    def _run(self):
+        while True:
+            try:
+                if self.run_next():
+                    continue
+            except Exception as e:
+                print(f"Job worker error: {e}")
+            self._wake.wait(JOB_POLL_INTERVAL)
+            self._wake.clear()
+
+job_worker = JobWorker(JOB_HANDLERS)
+
+def start_job_worker():
+    """
+    Start this process's job worker (a no-op with JOB_WORKER=0 or once running). Called
+    from __main__ and by enqueue_job(); under a WSGI server call it once per serving
+    process (e.g. gunicorn's post_worker_init hook) so jobs left queued are picked up
+    without waiting for a new one.
+    """
+    if JOB_WORKER_ENABLED:
+        job_worker.start()
+
+# ======== CHAT PUSH (SSE) ========
+
+CHAT_STREAM_KEEPALIVE = 15  # seconds between heartbeats; also how often a stream re-checks the DB unprompted
+CHAT_STREAM_MAX_AGE = 300   # streams are closed after this long; EventSource reconnects with Last-Event-ID
+CHAT_STREAM_RETRY_MS = 3000
+
+class ChatNotifier:
+    """
+    In-process wake-up signal for chat streams.
+    Each conversation channel has a version counter; senders bump it after inserting a message
+    and every stream waiting on that channel wakes up and fetches only the rows it has not sent yet.
+    Messages written by another process are still picked up on the next keepalive re-check.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._conditions = {}
+        self._waiters = {}
+
+    def version(self, channel):
+        with self._lock:
+            return self._versions.get(channel, 0)
+
+    def notify(self, channel):
+        with self._lock:
+            self._versions[channel] = self._versions.get(channel, 0) + 1
+            cond = self._conditions.get(channel)
+            if cond is not None:
+                cond.notify_all()
+
+    def wait(self, channel, seen, timeout):
+        """Block until the channel version moves past `seen` or the timeout expires; returns the current version"""
+        with self._lock:
+            cond = self._conditions.get(channel)
+            if cond is None:
+                cond = self._conditions[channel] = threading.Condition(self._lock)
+            self._waiters[channel] = self._waiters.get(channel, 0) + 1
+            try:
+                cond.wait_for(lambda: self._versions.get(channel, 0) != seen, timeout)
+                return self._versions.get(channel, 0)
+            finally:
+                self._waiters[channel] -= 1
+                if not self._waiters[channel]:
+                    del self._waiters[channel]
+                    del self._conditions[channel]
+
+chat_notifier = ChatNotifier()
+
+def dm_channel(user_a, user_b):
+    return ('dm', min(user_a, user_b), max(user_a, user_b))
+
+def group_channel(group_id):
+    return ('group', group_id)
+
+def notify_chat(channel):
+    chat_notifier.notify(channel)
+
+def chat_event_stream(channel, fetch_new, last_id):
+    """
+    Generator of SSE frames for one conversation.
+    fetch_new(conn, last_id) returns message dicts with id > last_id, or None to end the stream.
+    It runs on a connection checked out of the pool only for that query, so an open stream
+    does not pin a pooled connection.
+    """
+    started = time.monotonic()
+    yield f'retry: {CHAT_STREAM_RETRY_MS}\n\n'
+    while time.monotonic() - started < CHAT_STREAM_MAX_AGE:
+        # Read the version before querying so a message inserted in between still wakes us up
+        seen = chat_notifier.version(channel)
+        conn = db_pool.acquire()
+        try:
+            messages = fetch_new(conn, last_id)
+        finally:
+            db_pool.release(conn)
+        if messages is None:
+            return  # access revoked while the stream was open
+        for msg in messages:
+            last_id = msg['id']
+            yield f'id: {msg["id"]}\nevent: message\ndata: {json.dumps(msg)}\n\n'
+        if not messages:
+            yield ': keepalive\n\n'
+        if len(messages) < CHAT_PAGE_MAX:  # a full page means more are waiting: fetch again straight away
+            chat_notifier.wait(channel, seen, CHAT_STREAM_KEEPALIVE)
+
+def stream_start_id():
+    """Resume point for a chat stream: Last-Event-ID on reconnect, otherwise ?since_id from the page"""
+    for value in (request.headers.get('Last-Event-ID'), request.args.get('since_id')):
+        try:
+            return max(0, int(value))
+        except (TypeError, ValueError):
+            continue
+    return 0
+
+def sse_response(stream):
+    return app.response_class(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # keep reverse proxies from buffering the stream
+    })
+
+# ---- Cursor-based paging for chat history and polling ----
+
+CHAT_PAGE_SIZE = 50
+CHAT_PAGE_MAX = 200
+
+def chat_page_args():
+    """Parse since_id / before_id / limit from the query string; returns None if any of them is not an integer"""
+    args = {}
+    for name in ('since_id', 'before_id', 'limit'):
+        value = request.args.get(name, '')
+        if value == '':
+            args[name] = None
+            continue
+        try:
+            args[name] = int(value)
+        except ValueError:
+            return None
+    args['limit'] = max(1, min(args['limit'] or CHAT_PAGE_SIZE, CHAT_PAGE_MAX))
+    return args
+
+def chat_page(pages, params, since_id=None, before_id=None, limit=CHAT_PAGE_SIZE):
+    """
+    One page of a conversation, oldest message first, plus whether more rows lie past it.
+    `pages` is sql.DM_PAGE or sql.GROUP_PAGE.
+      since_id  -> the next `limit` messages after the cursor (polling for new messages)
+      before_id -> the `limit` messages just before the cursor (scrolling back through history)
+      neither   -> the latest `limit` messages
+    """
+    if since_id is not None:
+        rows = query_db(pages['after'], (*params, since_id, limit + 1))
+        return rows[:limit], len(rows) > limit
+
+    if before_id is not None:
+        rows = query_db(pages['before'], (*params, before_id, limit + 1))
+    else:
+        rows = query_db(pages['latest'], (*params, limit + 1))
+    return rows[:limit][::-1], len(rows) > limit
+
+def chat_message_json(msg):
+    return {
+        'id': msg['id'],
+        'sender_id': msg['sender_id'],
+        'username': msg['username'],
+        'content': msg['content'],
+        'created_at': msg['created_at']
+    }
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.',1)[1].lower() in ALLOWED_EXT
@@ -105,20 +585,54 @@ def categorize_tags(tags_str):
     flat = groups['weather'] + groups['terrain'] + groups['style'] + groups['other']
     return groups, flat
 
-# Make query_db available in all templates
-app.jinja_env.globals.update(query_db=query_db)
+# Make query_db and the named queries available in all templates
+app.jinja_env.globals.update(query_db=query_db, queries=sql)
 
 def create_notification(user_id, notif_type, actor_id=None, event_id=None, message=None):
     """Create a notification for a user"""
     try:
         now = datetime.now().isoformat()
-        query_db('''
-            INSERT INTO notifications (user_id, type, actor_id, event_id, message, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, notif_type, actor_id, event_id, message, now))
+        query_db(sql.NOTIFICATION_INSERT, (user_id, notif_type, actor_id, event_id, message, now))
     except Exception as e:
         print(f"Notification creation error: {e}")
 
+def publish_broadcast(notif_type, actor_id=None, event_id=None, message=None):
+    """
+    Notify every current user but the actor with one broadcasts row, merged into each
+    user's notifications when they are read (migrate_add_broadcasts.py)
+    """
+    now = datetime.now().isoformat()
+    db = get_db()
+    with db.transaction():
+        broadcast_id = execute_query(db, sql.BROADCAST_INSERT, (notif_type, actor_id, event_id, message, now)).lastrowid
+        if actor_id:
+            # The actor's own broadcast starts out read for them
+            execute_query(db, sql.BROADCAST_MARK_READ, (actor_id, broadcast_id))
+    return broadcast_id
+
+EVENT_FANOUT_BATCH = 500  # notifications written per transaction
+
+@job_handler('event_notifications')
+def fan_out_event_notifications(conn, job):
+    """
+    Notify the users in the city of a new local event (payload 'city'); global events are
+    broadcasts (publish_broadcast). Users are paged by id, each page inserted with one
+    executemany in its own transaction together with the job's cursor, so a restarted job
+    resumes after the last page written.
+    """
+    payload = job['payload']
+    actor_id = payload['actor_id']
+    while True:
+        users = run_query(conn, sql.USERS_IN_CITY_AFTER, (payload['city'], actor_id, job['cursor'], EVENT_FANOUT_BATCH))
+        if not users:
+            return
+        now = datetime.now().isoformat()
+        with conn.transaction():
+            execute_query(conn, sql.NOTIFICATION_INSERT,
+                          [(u['id'], 'event_created', actor_id, payload['event_id'], payload['message'], now) for u in users],
+                          many=True)
+            advance_job(conn, job, users[-1]['id'])
+
 
 @app.route('/api/countries')
 def api_countries():
@@ -386,7 +900,7 @@ def register():
 
         try:
             query_db(
-                'INSERT INTO users (username, email, password, country, city) VALUES (?, ?, ?, ?, ?)',
+                sql.USER_INSERT,
                 (username, email, hashed_password, country, city)
             )
             flash('Account created successfully! Please log in.', 'success')
@@ -402,7 +916,7 @@ def login():
         email = request.form['email']
         password = request.form['password']
 
-        user = query_db('SELECT * FROM users WHERE email = ?', (email,), one=True)
+        user = query_db(sql.USER_BY_EMAIL, (email,), one=True)
         if user is None:
             flash("User doesn't exist. Please register first.", 'error')
         elif not check_password_hash(user['password'], password):
@@ -424,7 +938,7 @@ def dashboard():
         return redirect(url_for('login'))
 
     user_id = session['user_id']
-    raw_rides = query_db('SELECT * FROM rides WHERE user_id = ? ORDER BY date DESC', (user_id,))
+    raw_rides = query_db(sql.USER_RIDES, (user_id,))
 
     rides = []
     for r in raw_rides:
@@ -455,11 +969,11 @@ def profile():
 
         # check username availability (allow same if unchanged)
         if new_username:
-            existing = query_db('SELECT id FROM users WHERE username = ? AND id != ?', (new_username, user_id), one=True)
+            existing = query_db(sql.USERNAME_TAKEN, (new_username, user_id), one=True)
             if existing:
                 flash('Username already taken.', 'error')
                 return redirect(url_for('profile'))
-            query_db('UPDATE users SET username = ? WHERE id = ?', (new_username, user_id))
+            query_db(sql.USER_SET_USERNAME, (new_username, user_id))
 
         # handle profile picture
         file = request.files.get('profile_pic')
@@ -469,36 +983,24 @@ def profile():
             file.save(dest)
             rel = os.path.relpath(dest, start='static').replace('\\','/')
             rel = f"/static/{rel}"
-            query_db('UPDATE users SET profile_pic = ? WHERE id = ?', (rel, user_id))
+            query_db(sql.USER_SET_PROFILE_PIC, (rel, user_id))
 
         if bio is not None:
-            query_db('UPDATE users SET bio = ? WHERE id = ?', (bio, user_id))
+            query_db(sql.USER_SET_BIO, (bio, user_id))
 
         flash('Profile updated.', 'success')
         return redirect(url_for('profile'))
 
-    user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    user = query_db(sql.USER_BY_ID, (user_id,), one=True)
     
     # Stats
-    total_rides = query_db('SELECT COUNT(*) as c FROM rides WHERE user_id = ?', (user_id,), one=True)['c']
-    total_distance = query_db('SELECT COALESCE(SUM(distance), 0) as d FROM rides WHERE user_id = ?', (user_id,), one=True)['d']
+    total_rides = query_db(sql.USER_RIDE_COUNT, (user_id,), one=True)['c']
+    total_distance = query_db(sql.USER_RIDE_DISTANCE, (user_id,), one=True)['d']
     
     # Followers / Following
-    followers = query_db('''
-        SELECT u.id, u.username, u.profile_pic 
-        FROM users u 
-        JOIN follows f ON u.id = f.follower_id 
-        WHERE f.followed_id = ? 
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
-    
-    following = query_db('''
-        SELECT u.id, u.username, u.profile_pic 
-        FROM users u 
-        JOIN follows f ON u.id = f.followed_id 
-        WHERE f.follower_id = ? 
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
+    followers = query_db(sql.USER_FOLLOWERS, (user_id,))
+    
+    following = query_db(sql.USER_FOLLOWING, (user_id,))
 
     return render_template('profile.html', user=user, total_rides=total_rides, 
                            total_distance=total_distance, followers=followers, 
@@ -507,40 +1009,28 @@ def profile():
 # View other user's public profile
 @app.route('/user/<int:user_id>')
 def user_profile(user_id):
-    user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    user = query_db(sql.USER_BY_ID, (user_id,), one=True)
     if not user:
         flash('User not found.', 'error')
         return redirect(url_for('leaderboard'))
     
     # Stats
-    total_rides = query_db('SELECT COUNT(*) as c FROM rides WHERE user_id = ? AND public = 1', (user_id,), one=True)['c']
-    total_distance = query_db('SELECT COALESCE(SUM(distance), 0) as d FROM rides WHERE user_id = ? AND public = 1', (user_id,), one=True)['d']
+    total_rides = query_db(sql.USER_PUBLIC_RIDE_COUNT, (user_id,), one=True)['c']
+    total_distance = query_db(sql.USER_PUBLIC_RIDE_DISTANCE, (user_id,), one=True)['d']
     
     # Followers / Following
-    followers = query_db('''
-        SELECT u.id, u.username, u.profile_pic 
-        FROM users u 
-        JOIN follows f ON u.id = f.follower_id 
-        WHERE f.followed_id = ? 
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
-    
-    following = query_db('''
-        SELECT u.id, u.username, u.profile_pic 
-        FROM users u 
-        JOIN follows f ON u.id = f.followed_id 
-        WHERE f.follower_id = ? 
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
+    followers = query_db(sql.USER_FOLLOWERS, (user_id,))
+    
+    following = query_db(sql.USER_FOLLOWING, (user_id,))
     
     # Public rides - show all rides for own profile, only public for others
     current_user_id = session.get('user_id')
     if current_user_id and current_user_id == user_id:
         # Own profile - show all rides
-        raw_rides = query_db('SELECT * FROM rides WHERE user_id = ? ORDER BY date DESC LIMIT 10', (user_id,))
+        raw_rides = query_db(sql.USER_RECENT_RIDES, (user_id,))
     else:
         # Other user's profile - show only public rides
-        raw_rides = query_db('SELECT * FROM rides WHERE user_id = ? AND public = 1 ORDER BY date DESC LIMIT 10', (user_id,))
+        raw_rides = query_db(sql.USER_RECENT_PUBLIC_RIDES, (user_id,))
     rides = []
     for r in raw_rides:
         groups, flat = categorize_tags(r['tags'])
@@ -567,7 +1057,7 @@ def user_profile(user_id):
     # Check if current user follows this user
     is_following = False
     if 'user_id' in session:
-        is_following = query_db('SELECT id FROM follows WHERE follower_id = ? AND followed_id = ?', 
+        is_following = query_db(sql.FOLLOW_ID, 
                                 (session['user_id'], user_id), one=True) is not None
 
     return render_template('user_profile.html', user=user, total_rides=total_rides,
@@ -580,7 +1070,7 @@ def bikes():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     user_id = session['user_id']
-    bikes = query_db('SELECT * FROM bikes WHERE user_id = ?', (user_id,))
+    bikes = query_db(sql.USER_BIKES, (user_id,))
     return render_template('bikes.html', bikes=bikes)
 
 @app.route('/add-bike', methods=['GET','POST'])
@@ -609,7 +1099,7 @@ def add_bike():
         if not name:
             flash('Bike name required.', 'error')
         else:
-            query_db('INSERT INTO bikes (user_id,name,make_model,year,odo,image,notes,is_private) VALUES (?,?,?,?,?,?,?,?)',
+            query_db(sql.BIKE_INSERT,
                      (user_id, name, make_model, year, odo, image_path, notes, is_private))
             flash('Bike added.', 'success')
             return redirect(url_for('bikes'))
@@ -619,7 +1109,7 @@ def add_bike():
 def edit_bike(bike_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    bike = query_db('SELECT * FROM bikes WHERE id = ? AND user_id = ?', (bike_id, session['user_id']), one=True)
+    bike = query_db(sql.BIKE_BY_ID_AND_USER, (bike_id, session['user_id']), one=True)
     if not bike:
         flash('Bike not found.', 'error'); return redirect(url_for('bikes'))
     if request.method == 'POST':
@@ -655,27 +1145,35 @@ def edit_bike(bike_id):
         import json
         additional_photos_json = json.dumps(additional_photos) if additional_photos else bike.get('additional_photos', '[]')
 
-        query_db('UPDATE bikes SET name=?, make_model=?, year=?, odo=?, image=?, notes=?, is_private=?, additional_photos=? WHERE id=?',
+        query_db(sql.BIKE_UPDATE,
                  (name, make_model, year, odo, image_path, notes, is_private, additional_photos_json, bike_id))
         flash('Bike updated.', 'success')
         return redirect(url_for('bikes'))
     return render_template('edit_bike.html', bike=dict(bike))
 
+BIKE_RIDES_PER_PAGE = 12
+
 @app.route('/bike/<int:bike_id>')
 def view_bike(bike_id):
-    bike = query_db('SELECT * FROM bikes WHERE id = ?', (bike_id,), one=True)
+    bike = query_db(sql.BIKE_BY_ID, (bike_id,), one=True)
     if not bike:
         flash('Bike not found.', 'error')
         return redirect(url_for('leaderboard'))
     
     # Get the bike owner
-    user = query_db('SELECT * FROM users WHERE id = ?', (bike['user_id'],), one=True)
+    user = query_db(sql.USER_BY_ID, (bike['user_id'],), one=True)
     if not user:
         flash('User not found.', 'error')
         return redirect(url_for('leaderboard'))
     
-    # Get rides for this bike
-    rides = query_db('SELECT * FROM rides WHERE bike_id = ? ORDER BY date DESC', (bike_id,))
+    # Get one page of rides for this bike
+    ride_count = query_db(sql.BIKE_RIDE_COUNT, (bike_id,), one=True)['c']
+    pages = max(1, -(-ride_count // BIKE_RIDES_PER_PAGE))
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    rides = query_db(sql.BIKE_RIDES_PAGE,
+                     (bike_id, BIKE_RIDES_PER_PAGE, (page - 1) * BIKE_RIDES_PER_PAGE))
+    # Simplified preview tracks for the whole page in a couple of batched queries
+    previews = load_map_tracks([ride['id'] for ride in rides], TRACK_PREVIEW_TOLERANCE_M)
     rides_list = []
     for ride in rides:
         ride_dict = dict(ride)
@@ -693,17 +1191,15 @@ def view_bike(bike_id):
         else:
             ride_dict['formatted_date'] = 'Unknown'
         
-        # Get GPS points for map preview
-        gps_points = query_db(
-            'SELECT latitude, longitude, timestamp FROM gps_points WHERE ride_id = ? ORDER BY timestamp',
-            (ride_dict['id'],)
-        )
-        ride_dict['gps_points'] = [dict(point) for point in gps_points] if gps_points else []
+        # Map preview as an encoded polyline
+        preview = previews.get(ride_dict['id'])
+        ride_dict['preview'] = (encode_polyline(preview['latitude'], preview['longitude'])
+                                if preview and len(preview['latitude']) > 1 else None)
         
         rides_list.append(ride_dict)
     
     # Get maintenance records
-    maintenance = query_db('SELECT * FROM bike_maintenance WHERE bike_id = ? ORDER BY date DESC', (bike_id,))
+    maintenance = query_db(sql.BIKE_MAINTENANCE, (bike_id,))
     
     # Get bike photos
     photos = []
@@ -719,18 +1215,19 @@ def view_bike(bike_id):
     except:
         pass
     
-    return render_template('view_bike.html', bike=bike, user=user, rides=rides_list, maintenance=maintenance, photos=photos)
+    return render_template('view_bike.html', bike=bike, user=user, rides=rides_list, maintenance=maintenance, photos=photos,
+                           ride_count=ride_count, page=page, pages=pages)
 
 # View user's public garage
 @app.route('/user/<int:user_id>/garage')
 def user_garage(user_id):
-    user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    user = query_db(sql.USER_BY_ID, (user_id,), one=True)
     if not user:
         flash('User not found.', 'error')
         return redirect(url_for('leaderboard'))
     
     # Get all bikes for this user (no private filtering for now)
-    bikes = query_db('SELECT * FROM bikes WHERE user_id = ? ORDER BY name', (user_id,))
+    bikes = query_db(sql.GARAGE_BIKES, (user_id,))
     
     return render_template('user_garage.html', user=user, bikes=bikes)
 
@@ -757,37 +1254,27 @@ def create_group():
             rel = os.path.relpath(dest, start='static').replace('\\','/')
             pic_path = f"/static/{rel}"
 
-        # create group
-        query_db('INSERT INTO groups (name, owner_id, profile_pic) VALUES (?, ?, ?)', (name, session['user_id'], pic_path))
-        group = query_db('SELECT id FROM groups ORDER BY id DESC LIMIT 1', (), one=True)
-        group_id = group['id']
-
-        # add owner as member
-        query_db('INSERT INTO group_members (group_id, user_id) VALUES (?, ?)', (group_id, session['user_id']))
-        # add other selected members
+        # owner first, then the other selected members (each once)
+        members = [session['user_id']]
         for uid in member_ids:
             try:
                 uid_int = int(uid)
-                if uid_int == session['user_id']:
-                    continue
-                exists = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, uid_int), one=True)
-                if not exists:
-                    query_db('INSERT INTO group_members (group_id, user_id) VALUES (?, ?)', (group_id, uid_int))
             except ValueError:
                 continue
+            if uid_int not in members:
+                members.append(uid_int)
+
+        # create the group and its memberships in one transaction
+        db = get_db()
+        with db.transaction():
+            group_id = execute_query(db, sql.GROUP_INSERT, (name, session['user_id'], pic_path)).lastrowid
+            execute_query(db, sql.GROUP_MEMBER_INSERT, [(group_id, uid) for uid in members], many=True)
 
         flash('Group created.', 'success')
         return redirect(url_for('group_chat', group_id=group_id))
 
     # GET: show only friends (mutual follows)
-    friends = query_db('''
-        SELECT DISTINCT u.id, u.username, u.profile_pic
-        FROM users u
-        WHERE u.id != ? 
-        AND EXISTS (SELECT 1 FROM follows WHERE follower_id = ? AND followed_id = u.id)
-        AND EXISTS (SELECT 1 FROM follows WHERE follower_id = u.id AND followed_id = ?)
-        ORDER BY u.username
-    ''', (session['user_id'], session['user_id'], session['user_id']))
+    friends = query_db(sql.MUTUAL_FOLLOWS, (session['user_id'], session['user_id'], session['user_id']))
     
     return render_template('create_group.html', users=friends)
 
@@ -798,37 +1285,27 @@ def group_chat(group_id):
         return redirect(url_for('login'))
 
     # ensure group exists
-    group = query_db('SELECT * FROM groups WHERE id = ?', (group_id,), one=True)
+    group = query_db(sql.GROUP_BY_ID, (group_id,), one=True)
     if not group:
         flash('Group not found.', 'error')
         return redirect(url_for('messages'))
 
     # check membership
-    member = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, session['user_id']), one=True)
+    member = query_db(sql.GROUP_MEMBERSHIP, (group_id, session['user_id']), one=True)
     if not member:
         flash('You are not a member of this group.', 'error')
         return redirect(url_for('messages'))
 
     # Mark all group messages as read for this user by updating last_read timestamp
-    query_db('UPDATE group_members SET last_read = datetime("now") WHERE group_id = ? AND user_id = ?', (group_id, session['user_id']))
+    query_db(sql.GROUP_MEMBER_MARK_READ, (group_id, session['user_id']))
 
-    # fetch messages with special handling for system messages (sender_id = 0)
-    msgs = query_db('''
-        SELECT gm.*, u.username, u.profile_pic FROM group_messages gm
-        LEFT JOIN users u ON gm.sender_id = u.id
-        WHERE gm.group_id = ?
-        ORDER BY gm.created_at ASC
-    ''', (group_id,))
+    # latest page of messages (system messages have sender_id = 0); older ones load on scroll
+    msgs, has_more = chat_page(sql.GROUP_PAGE, (group_id,))
 
     # fetch members
-    members = query_db('''
-        SELECT u.id, u.username, u.profile_pic FROM users u
-        JOIN group_members gm ON u.id = gm.user_id
-        WHERE gm.group_id = ?
-        ORDER BY u.username
-    ''', (group_id,))
+    members = query_db(sql.GROUP_MEMBERS, (group_id,))
 
-    return render_template('group_chat.html', group=group, messages=msgs, members=members)
+    return render_template('group_chat.html', group=group, messages=msgs, members=members, has_more=has_more)
 
 
 @app.route('/groups/<int:group_id>/send', methods=['POST'])
@@ -842,13 +1319,14 @@ def send_group_message(group_id):
         return redirect(url_for('group_chat', group_id=group_id))
 
     # check membership
-    member = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, session['user_id']), one=True)
+    member = query_db(sql.GROUP_MEMBERSHIP, (group_id, session['user_id']), one=True)
     if not member:
         flash('You are not a member of this group.', 'error')
         return redirect(url_for('messages'))
 
-    query_db('INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
+    query_db(sql.GROUP_MESSAGE_INSERT,
              (group_id, session['user_id'], content))
+    notify_chat(group_channel(group_id))
     return redirect(url_for('group_chat', group_id=group_id) + '#bottom')
 
 
@@ -857,23 +1335,18 @@ def group_members_view(group_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    group = query_db('SELECT * FROM groups WHERE id = ?', (group_id,), one=True)
+    group = query_db(sql.GROUP_BY_ID, (group_id,), one=True)
     if not group:
         flash('Group not found.', 'error')
         return redirect(url_for('messages'))
 
     # ensure requesting user is member (members can view)
-    member = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, session['user_id']), one=True)
+    member = query_db(sql.GROUP_MEMBERSHIP, (group_id, session['user_id']), one=True)
     if not member:
         flash('You are not a member of this group.', 'error')
         return redirect(url_for('messages'))
 
-    members = query_db('''
-        SELECT u.id, u.username, u.profile_pic FROM users u
-        JOIN group_members gm ON u.id = gm.user_id
-        WHERE gm.group_id = ?
-        ORDER BY u.username
-    ''', (group_id,))
+    members = query_db(sql.GROUP_MEMBERS, (group_id,))
 
     return render_template('group_members.html', group=group, members=members)
 
@@ -883,13 +1356,13 @@ def group_edit(group_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    group = query_db('SELECT * FROM groups WHERE id = ?', (group_id,), one=True)
+    group = query_db(sql.GROUP_BY_ID, (group_id,), one=True)
     if not group:
         flash('Group not found.', 'error')
         return redirect(url_for('messages'))
 
     # membership check: only members can access edit page
-    member_row = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, session['user_id']), one=True)
+    member_row = query_db(sql.GROUP_MEMBERSHIP, (group_id, session['user_id']), one=True)
     if not member_row:
         flash('You are not a member of this group.', 'error')
         return redirect(url_for('messages'))
@@ -897,17 +1370,11 @@ def group_edit(group_id):
     is_owner = (group['owner_id'] == session['user_id'])
 
     if request.method == 'POST':
-        # NAME: any member may change the name
-        name = request.form.get('name', '').strip()
-        if name and name != (group['name'] or ''):
-            query_db('UPDATE groups SET name = ? WHERE id = ?', (name, group_id))
-            # log to group messages (sender_id = 0 marks as system message)
-            actor = session.get('username') or f'User {session["user_id"]}'
-            content = f"{actor} changed the group name to \"{name}\""
-            query_db('INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
-                     (group_id, 0, content))
-
-        # PHOTO: any member may change the picture
+        actor = session.get('username') or f'User {session["user_id"]}'
+        log = []  # chat lines describing the changes
+
+        # Save an uploaded picture before taking the write lock
+        pic_path = None
         file = request.files.get('group_pic')
         if file and file.filename and allowed_file(file.filename):
             fn = secure_filename(file.filename)
@@ -915,178 +1382,138 @@ def group_edit(group_id):
             file.save(dest)
             rel = os.path.relpath(dest, start='static').replace('\\','/')
             pic_path = f"/static/{rel}"
-            query_db('UPDATE groups SET profile_pic = ? WHERE id = ?', (pic_path, group_id))
-            actor = session.get('username') or f'User {session["user_id"]}'
-            content = f"{actor} changed the group photo."
-            query_db('INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
-                     (group_id, 0, content))
-
-        # ANY MEMBER: add members (only mutual friends of the current user)
-        add_ids = request.form.getlist('add_members')
-        for uid in add_ids:
-            try:
-                uid_int = int(uid)
-            except ValueError:
-                continue
 
-            # skip if already member or adding self
-            if uid_int == session['user_id']:
-                continue
-            exists = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, uid_int), one=True)
-            if exists:
-                continue
+        # All changes of one form submit are committed together
+        db = get_db()
+        with db.transaction():
+            # NAME: any member may change the name
+            name = request.form.get('name', '').strip()
+            if name and name != (group['name'] or ''):
+                query_db(sql.GROUP_SET_NAME, (name, group_id))
+                log.append(f"{actor} changed the group name to \"{name}\"")
+
+            # PHOTO: any member may change the picture
+            if pic_path:
+                query_db(sql.GROUP_SET_PROFILE_PIC, (pic_path, group_id))
+                log.append(f"{actor} changed the group photo.")
+
+            # ANY MEMBER: add members (only mutual friends of the current user)
+            add_ids = request.form.getlist('add_members')
+            for uid in add_ids:
+                try:
+                    uid_int = int(uid)
+                except ValueError:
+                    continue
 
-            # mutual friendship check: current user follows uid AND uid follows current user
-            a = query_db('SELECT id FROM follows WHERE follower_id = ? AND followed_id = ?', (session['user_id'], uid_int), one=True)
-            b = query_db('SELECT id FROM follows WHERE follower_id = ? AND followed_id = ?', (uid_int, session['user_id']), one=True)
-            if a and b:
-                query_db('INSERT INTO group_members (group_id, user_id) VALUES (?, ?)', (group_id, uid_int))
-                added_user = query_db('SELECT username FROM users WHERE id = ?', (uid_int,), one=True)
-                actor = session.get('username') or f'User {session["user_id"]}'
-                added_name = added_user['username'] if added_user else f'User {uid_int}'
-                content = f"{actor} added {added_name} to the group."
-                query_db('INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
-                         (group_id, 0, content))
-            else:
-                flash(f'Cannot add user {uid_int}: not a mutual friend.', 'error')
+                # skip if already member or adding self
+                if uid_int == session['user_id']:
+                    continue
+                exists = query_db(sql.GROUP_MEMBERSHIP, (group_id, uid_int), one=True)
+                if exists:
+                    continue
 
-        # OWNER-only: remove member
-        remove_id = request.form.get('remove_member')
-        if remove_id:
-            try:
-                rid = int(remove_id)
-            except ValueError:
-                rid = None
-            if rid:
-                if not is_owner:
-                    flash('Only the owner can remove members.', 'error')
+                # mutual friendship check: current user follows uid AND uid follows current user
+                a = query_db(sql.FOLLOW_ID, (session['user_id'], uid_int), one=True)
+                b = query_db(sql.FOLLOW_ID, (uid_int, session['user_id']), one=True)
+                if a and b:
+                    query_db(sql.GROUP_MEMBER_INSERT, (group_id, uid_int))
+                    added_user = query_db(sql.USERNAME_BY_ID, (uid_int,), one=True)
+                    added_name = added_user['username'] if added_user else f'User {uid_int}'
+                    log.append(f"{actor} added {added_name} to the group.")
                 else:
-                    if rid == group['owner_id']:
-                        flash("Cannot remove the owner.", 'error')
+                    flash(f'Cannot add user {uid_int}: not a mutual friend.', 'error')
+
+            # OWNER-only: remove member
+            remove_id = request.form.get('remove_member')
+            if remove_id:
+                try:
+                    rid = int(remove_id)
+                except ValueError:
+                    rid = None
+                if rid:
+                    if not is_owner:
+                        flash('Only the owner can remove members.', 'error')
                     else:
-                        # get username for logging
-                        removed_user = query_db('SELECT username FROM users WHERE id = ?', (rid,), one=True)
-                        removed_name = removed_user['username'] if removed_user else f'User {rid}'
-                        query_db('DELETE FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, rid))
-                        actor = session.get('username') or f'User {session["user_id"]}'
-                        content = f"{actor} removed {removed_name} from the group."
-                        query_db('INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
-                                 (group_id, 0, content))
+                        if rid == group['owner_id']:
+                            flash("Cannot remove the owner.", 'error')
+                        else:
+                            # get username for logging
+                            removed_user = query_db(sql.USERNAME_BY_ID, (rid,), one=True)
+                            removed_name = removed_user['username'] if removed_user else f'User {rid}'
+                            query_db(sql.GROUP_MEMBER_DELETE, (group_id, rid))
+                            log.append(f"{actor} removed {removed_name} from the group.")
+
+        # Log to group messages once the changes are committed, in a transaction of their
+        # own so a failed log line never undoes the edit (sender_id = 0 marks a system message)
+        if log:
+            with db.transaction():
+                execute_query(db, sql.GROUP_MESSAGE_INSERT, [(group_id, 0, content) for content in log], many=True)
+            notify_chat(group_channel(group_id))
 
         flash('Group updated.', 'success')
         return redirect(url_for('group_edit', group_id=group_id))
 
     # GET: compute current members
-    members = query_db('SELECT u.id, u.username, u.profile_pic FROM users u JOIN group_members gm ON u.id = gm.user_id WHERE gm.group_id = ? ORDER BY u.username', (group_id,))
+    members = query_db(sql.GROUP_MEMBERS, (group_id,))
 
     # compute addable friends for the current user: mutual followers who are NOT already members
-    current_member_rows = query_db('SELECT user_id FROM group_members WHERE group_id = ?', (group_id,))
+    current_member_rows = query_db(sql.GROUP_MEMBER_IDS, (group_id,))
     current_ids = set([r['user_id'] for r in current_member_rows]) if current_member_rows else set()
 
-    friends = query_db('''
-        SELECT DISTINCT u.id, u.username, u.profile_pic
-        FROM users u
-        WHERE u.id != ?
-          AND EXISTS (SELECT 1 FROM follows WHERE follower_id = ? AND followed_id = u.id)
-          AND EXISTS (SELECT 1 FROM follows WHERE follower_id = u.id AND followed_id = ?)
-        ORDER BY u.username
-    ''', (session['user_id'], session['user_id'], session['user_id']))
+    friends = query_db(sql.MUTUAL_FOLLOWS, (session['user_id'], session['user_id'], session['user_id']))
 
     add_available_friends = [f for f in friends if f['id'] not in current_ids]
 
     # owner info for template
-    owner = query_db('SELECT id, username FROM users WHERE id = ?', (group['owner_id'],), one=True)
+    owner = query_db(sql.USER_ID_AND_NAME, (group['owner_id'],), one=True)
     return render_template('group_edit.html', group=group, add_available_friends=add_available_friends, members=members, owner=owner)
 
 
 # Messages routes
-@app.route('/messages')
-def messages():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    uid = session['user_id']
-
-    # user-to-user conversations (existing)
-    conversations = query_db('''
-        SELECT DISTINCT 
-            CASE WHEN sender_id = ? THEN recipient_id ELSE sender_id END as other_user_id,
-            MAX(created_at) as last_msg_time
-        FROM messages
-        WHERE sender_id = ? OR recipient_id = ?
-        GROUP BY other_user_id
-        ORDER BY last_msg_time DESC
-    ''', (uid, uid, uid))
-
-    # Enrich with user info
-    conv_list = []
-    for conv in conversations:
-        other_id = conv['other_user_id']
-        other_user = query_db('SELECT id, username, profile_pic FROM users WHERE id = ?', (other_id,), one=True)
-        # Only count messages FROM the other user TO you that are unread
-        unread = query_db('SELECT COUNT(*) as c FROM messages WHERE sender_id = ? AND recipient_id = ? AND is_read = 0', 
-                         (other_id, uid), one=True)['c']
-        conv_list.append({
-            'type': 'user',
-            'user': other_user,
-            'unread': unread,
-            'last_time': conv['last_msg_time']
-        })
+def inbox_conversations(uid):
+    """
+    Conversation list for the /messages inbox: one row per direct-message partner and per group,
+    newest first. Built from two set-based queries, so the cost does not grow with a query per conversation.
+    """
+    # user-to-user conversations: partner, last message time and unread count in one aggregate
+    conversations = query_db(sql.INBOX_CONVERSATIONS, (uid, uid, uid, uid))
 
-    # group conversations: groups user is member of + last message time
-    groups = query_db('''
-        SELECT g.id, g.name, g.profile_pic, MAX(gm.created_at) AS last_msg_time
-        FROM groups g
-        JOIN group_members gmbr ON g.id = gmbr.group_id
-        LEFT JOIN group_messages gm ON g.id = gm.group_id
-        WHERE gmbr.user_id = ?
-        GROUP BY g.id
-        ORDER BY last_msg_time DESC
-    ''', (uid,))
-
-    group_list = []
-    for g in groups:
-        # Count unread: messages created AFTER user's last_read time, excluding system messages (sender_id != 0) and excluding messages sent by current user
-        last_read = query_db('SELECT last_read FROM group_members WHERE group_id = ? AND user_id = ?', (g['id'], uid), one=True)
-        last_read_time = last_read['last_read'] if last_read and last_read['last_read'] else '1900-01-01'
-        unread = query_db('SELECT COUNT(*) as c FROM group_messages WHERE group_id = ? AND sender_id != 0 AND sender_id != ? AND created_at > ?', 
-                          (g['id'], uid, last_read_time), one=True)['c']
-        group_list.append({
-            'type': 'group',
-            'group': g,
-            'unread': unread,
-            'last_time': g['last_msg_time']
-        })
+    # group conversations: unread comes from the per-membership counter kept by triggers;
+    # last message time is an index seek per group
+    groups = query_db(sql.INBOX_GROUPS, (uid,))
 
     # Combine both conversation types with type indicator
     all_convs = []
-    for conv in conv_list:
+    for conv in conversations:
         all_convs.append({
             'type': 'user',
             'unread': conv['unread'],
-            'last_time': conv['last_time'],
-            'id': conv['user']['id'],
-            'name': conv['user']['username'],
-            'profile_pic': conv['user']['profile_pic'],
+            'last_time': conv['last_msg_time'],
+            'id': conv['id'],
+            'name': conv['username'],
+            'profile_pic': conv['profile_pic'],
         })
-    
-    for g in group_list:
+
+    for grp in groups:
         all_convs.append({
             'type': 'group',
-            'unread': g['unread'],
-            'last_time': g['last_time'],
-            'id': g['group']['id'],
-            'name': g['group']['name'],
-            'profile_pic': g['group']['profile_pic'],
+            'unread': grp['unread'],
+            'last_time': grp['last_msg_time'],
+            'id': grp['id'],
+            'name': grp['name'],
+            'profile_pic': grp['profile_pic'],
         })
-    
+
     # Sort by most recent time (descending)
-    def sort_key(c):
-        time_str = c['last_time'] or '1900-01-01'
-        return time_str
-    
-    all_convs.sort(key=sort_key, reverse=True)
+    all_convs.sort(key=lambda c: c['last_time'] or '1900-01-01', reverse=True)
+    return all_convs
 
-    return render_template('messages.html', conversations=all_convs)
+@app.route('/messages')
+def messages():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    return render_template('messages.html', conversations=inbox_conversations(session['user_id']))
 
 @app.route('/messages/with/<int:user_id>')
 def chat_with(user_id):
@@ -1094,23 +1521,18 @@ def chat_with(user_id):
         return redirect(url_for('login'))
     
     current_uid = session['user_id']
-    other_user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    other_user = query_db(sql.USER_BY_ID, (user_id,), one=True)
     if not other_user:
         flash('User not found.', 'error')
         return redirect(url_for('messages'))
     
-    # Get all messages between these two users
-    msgs = query_db('''
-        SELECT m.*, u.username, u.profile_pic FROM messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE (m.sender_id = ? AND m.recipient_id = ?) OR (m.sender_id = ? AND m.recipient_id = ?)
-        ORDER BY m.created_at ASC
-    ''', (current_uid, user_id, user_id, current_uid))
+    # Latest page of messages between these two users; older ones load on scroll
+    msgs, has_more = chat_page(sql.DM_PAGE, (current_uid, user_id, user_id, current_uid))
     
     # Mark messages as read
-    query_db('UPDATE messages SET is_read = 1 WHERE sender_id = ? AND recipient_id = ?', (user_id, current_uid))
+    query_db(sql.MESSAGES_MARK_READ, (user_id, current_uid))
     
-    return render_template('chat.html', other_user=other_user, messages=msgs)
+    return render_template('chat.html', other_user=other_user, messages=msgs, has_more=has_more)
 
 @app.route('/messages/send/<int:recipient_id>', methods=['POST'])
 def send_message_to(recipient_id):
@@ -1119,8 +1541,9 @@ def send_message_to(recipient_id):
     
     content = request.form.get('message', '').strip()
     if content:
-        query_db('INSERT INTO messages (sender_id, recipient_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
+        query_db(sql.MESSAGE_INSERT,
                  (session['user_id'], recipient_id, content))
+        notify_chat(dm_channel(session['user_id'], recipient_id))
         flash('Message sent.', 'success')
     
     return redirect(url_for('chat_with', user_id=recipient_id))
@@ -1138,48 +1561,38 @@ def send_group_message_ajax(group_id):
         return {'success': False, 'error': 'Empty message'}, 400
 
     # check membership
-    member = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, session['user_id']), one=True)
+    member = query_db(sql.GROUP_MEMBERSHIP, (group_id, session['user_id']), one=True)
     if not member:
         return {'success': False, 'error': 'Not a member'}, 403
 
-    query_db('INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
+    query_db(sql.GROUP_MESSAGE_INSERT,
              (group_id, session['user_id'], content))
+    notify_chat(group_channel(group_id))
     return {'success': True}
 
-# AJAX: Get group messages
+# AJAX: Get group messages (?since_id= for new ones, ?before_id= for history, ?limit= page size)
 @app.route('/groups/<int:group_id>/messages-ajax')
 def get_group_messages_ajax(group_id):
     if 'user_id' not in session:
         return {'messages': []}, 401
 
     current_uid = session['user_id']
-    
+    page = chat_page_args()
+    if page is None:
+        return {'messages': [], 'error': 'since_id, before_id and limit must be integers'}, 400
+
     # check membership
-    member = query_db('SELECT id FROM group_members WHERE group_id = ? AND user_id = ?', (group_id, current_uid), one=True)
+    member = query_db(sql.GROUP_MEMBERSHIP, (group_id, current_uid), one=True)
     if not member:
         return {'messages': []}, 403
 
-    # Update last_read to now to mark all previous messages as read
-    query_db('UPDATE group_members SET last_read = datetime("now") WHERE group_id = ? AND user_id = ?', (group_id, current_uid))
-
-    msgs = query_db('''
-        SELECT gm.*, u.username, u.profile_pic FROM group_messages gm
-        LEFT JOIN users u ON gm.sender_id = u.id
-        WHERE gm.group_id = ?
-        ORDER BY gm.created_at ASC
-    ''', (group_id,))
-
-    messages = []
-    for msg in msgs:
-        messages.append({
-            'id': msg['id'],
-            'sender_id': msg['sender_id'],
-            'username': msg['username'],
-            'content': msg['content'],
-            'created_at': msg['created_at']
-        })
-    
-    return {'messages': messages}
+    msgs, has_more = chat_page(sql.GROUP_PAGE, (group_id,), **page)
+
+    # Only move the read marker when this poll actually delivered newer messages
+    if msgs and page['before_id'] is None:
+        query_db(sql.GROUP_MEMBER_MARK_READ, (group_id, current_uid))
+
+    return {'messages': [chat_message_json(msg) for msg in msgs], 'has_more': has_more}
 
 # AJAX: Send user message
 @app.route('/messages/send-ajax/<int:recipient_id>', methods=['POST'])
@@ -1193,39 +1606,72 @@ def send_message_ajax(recipient_id):
     if not content:
         return {'success': False, 'error': 'Empty message'}, 400
 
-    query_db('INSERT INTO messages (sender_id, recipient_id, content, is_read, created_at) VALUES (?, ?, ?, 1, datetime("now"))',
+    query_db(sql.MESSAGE_INSERT_UNREAD,
              (session['user_id'], recipient_id, content))
+    notify_chat(dm_channel(session['user_id'], recipient_id))
     return {'success': True}
 
-# AJAX: Poll user messages
+# AJAX: Poll user messages (?since_id= for new ones, ?before_id= for history, ?limit= page size)
 @app.route('/messages/poll/<int:other_user_id>')
 def poll_messages(other_user_id):
     if 'user_id' not in session:
         return {'messages': []}, 401
 
     current_uid = session['user_id']
-    
-    # Mark messages as read
-    query_db('UPDATE messages SET is_read = 1 WHERE sender_id = ? AND recipient_id = ?', (other_user_id, current_uid))
-
-    msgs = query_db('''
-        SELECT m.*, u.username, u.profile_pic FROM messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE (m.sender_id = ? AND m.recipient_id = ?) OR (m.sender_id = ? AND m.recipient_id = ?)
-        ORDER BY m.created_at ASC
-    ''', (current_uid, other_user_id, other_user_id, current_uid))
-
-    messages = []
-    for msg in msgs:
-        messages.append({
-            'id': msg['id'],
-            'sender_id': msg['sender_id'],
-            'username': msg['username'],
-            'content': msg['content'],
-            'created_at': msg['created_at']
-        })
-    
-    return {'messages': messages}
+    page = chat_page_args()
+    if page is None:
+        return {'messages': [], 'error': 'since_id, before_id and limit must be integers'}, 400
+
+    msgs, has_more = chat_page(sql.DM_PAGE, (current_uid, other_user_id, other_user_id, current_uid), **page)
+
+    # Mark messages as read, but only when this poll actually delivered new ones from the other user
+    if page['before_id'] is None and any(msg['sender_id'] == other_user_id for msg in msgs):
+        query_db(sql.MESSAGES_MARK_READ_UPTO,
+                 (other_user_id, current_uid, msgs[-1]['id']))
+
+    return {'messages': [chat_message_json(msg) for msg in msgs], 'has_more': has_more}
+
+# SSE: Push new user messages as they are sent
+@app.route('/messages/stream/<int:other_user_id>')
+def stream_messages(other_user_id):
+    if 'user_id' not in session:
+        return {'error': 'Not logged in'}, 401
+
+    current_uid = session['user_id']
+
+    def fetch_new(conn, last_id):
+        rows = run_query(conn, sql.DM_STREAM_AFTER, (last_id, current_uid, other_user_id, other_user_id, current_uid, CHAT_PAGE_MAX))
+        # Only touch read flags when something from the other side was actually delivered
+        if any(r['sender_id'] == other_user_id for r in rows):
+            with conn:
+                execute_query(conn, sql.MESSAGES_MARK_READ_UPTO,
+                              (other_user_id, current_uid, rows[-1]['id']))
+        return [dict(r) for r in rows]
+
+    return sse_response(chat_event_stream(dm_channel(current_uid, other_user_id), fetch_new, stream_start_id()))
+
+# SSE: Push new group messages as they are sent
+@app.route('/groups/<int:group_id>/messages-stream')
+def stream_group_messages(group_id):
+    if 'user_id' not in session:
+        return {'error': 'Not logged in'}, 401
+
+    current_uid = session['user_id']
+    member = query_db(sql.GROUP_MEMBERSHIP, (group_id, current_uid), one=True)
+    if not member:
+        return {'error': 'Not a member'}, 403
+
+    def fetch_new(conn, last_id):
+        if not run_query(conn, sql.GROUP_MEMBERSHIP, (group_id, current_uid), one=True):
+            return None
+        rows = run_query(conn, sql.GROUP_STREAM_AFTER, (group_id, last_id, CHAT_PAGE_MAX))
+        if rows:
+            with conn:
+                execute_query(conn, sql.GROUP_MEMBER_MARK_READ,
+                              (group_id, current_uid))
+        return [dict(r) for r in rows]
+
+    return sse_response(chat_event_stream(group_channel(group_id), fetch_new, stream_start_id()))
 
 @app.route('/logout')
 def logout():
@@ -1240,16 +1686,10 @@ def get_notifications():
         return redirect(url_for('login'))
     
     user_id = session['user_id']
-    notifications = query_db('''
-        SELECT n.*, u.username as actor_username, u.id as actor_id,
-               e.title as event_title, e.id as event_id
-        FROM notifications n
-        LEFT JOIN users u ON n.actor_id = u.id
-        LEFT JOIN events e ON n.event_id = e.id
-        WHERE n.user_id = ? AND n.is_read = 0
-        ORDER BY n.created_at DESC
-        LIMIT 20
-    ''', (user_id,))
+    # Targeted notifications and broadcasts (stored once for everyone), newest first
+    notifications = query_db(sql.NOTIFICATIONS_UNREAD, (user_id,))
+    broadcasts = query_db(sql.BROADCASTS_UNREAD, {'user_id': user_id})
+    notifications = sorted(notifications + broadcasts, key=lambda n: n['created_at'], reverse=True)[:20]
     
     return render_template('notifications.html', notifications=notifications)
 
@@ -1259,10 +1699,11 @@ def notification_count():
     if 'user_id' not in session:
         return jsonify({'count': 0})
     
-    user_id = session['user_id']
-    result = query_db('SELECT COUNT(*) as cnt FROM notifications WHERE user_id = ? AND is_read = 0', 
-                      (user_id,), one=True)
-    return jsonify({'count': result['cnt']})
+    # Maintained by triggers on notifications (migrate_add_unread_counters.py)
+    counters = query_db(sql.NOTIFICATION_UNREAD_COUNT, (session['user_id'],), one=True)
+    # Unread broadcasts are counted from the user's watermark, not row by row
+    broadcasts = query_db(sql.BROADCAST_UNREAD_COUNT, (session['user_id'],), one=True)
+    return jsonify({'count': (counters['notifications'] if counters else 0) + (broadcasts['count'] if broadcasts else 0)})
 
 @app.route('/api/notifications/mark-read/<int:notif_id>', methods=['POST'])
 def mark_notification_read(notif_id):
@@ -1272,12 +1713,25 @@ def mark_notification_read(notif_id):
     
     user_id = session['user_id']
     # Verify the notification belongs to this user
-    notif = query_db('SELECT * FROM notifications WHERE id = ? AND user_id = ?', 
+    notif = query_db(sql.NOTIFICATION_BY_ID_AND_USER, 
                      (notif_id, user_id), one=True)
     if not notif:
         return jsonify({'error': 'Notification not found'}), 404
     
-    query_db('UPDATE notifications SET is_read = 1 WHERE id = ?', (notif_id,))
+    query_db(sql.NOTIFICATION_MARK_READ, (notif_id,))
+    return jsonify({'success': True})
+
+@app.route('/api/notifications/mark-read/broadcast/<int:broadcast_id>', methods=['POST'])
+def mark_broadcast_read(broadcast_id):
+    """Mark a broadcast notification as read for the current user"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    if not query_db(sql.BROADCAST_BY_ID, (broadcast_id,), one=True):
+        return jsonify({'error': 'Notification not found'}), 404
+    
+    query_db(sql.BROADCAST_MARK_READ, (user_id, broadcast_id))
     return jsonify({'success': True})
 
 @app.route('/api/notifications/mark-all-read', methods=['POST'])
@@ -1287,7 +1741,11 @@ def mark_all_read():
         return jsonify({'error': 'Unauthorized'}), 401
     
     user_id = session['user_id']
-    query_db('UPDATE notifications SET is_read = 1 WHERE user_id = ?', (user_id,))
+    # Broadcasts: move the user's watermark to the latest one, dropping the single reads below it
+    with get_db().transaction():
+        query_db(sql.NOTIFICATIONS_MARK_ALL_READ, (user_id,))
+        query_db(sql.BROADCASTS_MARK_ALL_READ, (user_id,))
+        query_db(sql.BROADCAST_READS_PRUNE, (user_id, user_id))
     return jsonify({'success': True})
 
 @app.route('/tools', methods=['GET', 'POST'])
@@ -1324,7 +1782,7 @@ def tools():
     if request.method == 'POST' and request.form.get('action') == 'emergency':
         name = request.form.get('em_name', '').strip()
         phone = request.form.get('em_phone', '').strip()
-        query_db('UPDATE users SET emergency_name = ?, emergency_phone = ? WHERE id = ?', (name, phone, user_id))
+        query_db(sql.USER_SET_EMERGENCY_CONTACT, (name, phone, user_id))
         flash('Emergency info updated.', 'success')
 
     # Maintenance CRUD - add
@@ -1336,7 +1794,7 @@ def tools():
         if not item:
             flash('Maintenance item is required.', 'error')
         else:
-            query_db('INSERT INTO maintenance (user_id, item, due_date, last_changed, notes) VALUES (?, ?, ?, ?, ?)',
+            query_db(sql.MAINTENANCE_INSERT,
                      (user_id, item, due or None, last or None, notes))
             flash('Maintenance reminder added.', 'success')
         return redirect(url_for('tools'))
@@ -1344,58 +1802,142 @@ def tools():
     # Handle delete maintenance via query param
     delete_id = request.args.get('delete_maint')
     if delete_id:
-        query_db('DELETE FROM maintenance WHERE id = ? AND user_id = ?', (delete_id, user_id))
+        query_db(sql.MAINTENANCE_DELETE, (delete_id, user_id))
         flash('Maintenance reminder deleted.', 'success')
         return redirect(url_for('tools'))
 
-    maint = query_db('SELECT * FROM maintenance WHERE user_id = ? ORDER BY due_date IS NULL, due_date', (user_id,))
-    user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    maint = query_db(sql.USER_MAINTENANCE, (user_id,))
+    user = query_db(sql.USER_BY_ID, (user_id,), one=True)
 
     return render_template('tools.html', maintenance=maint, user=user, weather=weather_data)
 
+# ======== LEADERBOARDS ========
+
+LEADERBOARD_PERIODS = {
+    'all': 'All time',
+    'week': 'This week',
+    'month': 'This month',
+    'year': 'This year',
+}
+LEADERBOARD_SIZE = 50
+
+def leaderboard_bucket(period, day=None):
+    """Bucket key of `day` (default today) for a period; must match BUCKET_SQL in migrate_add_leaderboard_buckets.py"""
+    day = day or datetime.now().date()
+    if period == 'week':
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if period == 'month':
+        return day.strftime('%Y-%m')
+    if period == 'year':
+        return day.strftime('%Y')
+    return None
+
+def leaderboard_top(period, country=None, limit=LEADERBOARD_SIZE):
+    """
+    Top riders by public distance for a period ('all' or a key of LEADERBOARD_PERIODS), optionally
+    within one country. All-time totals come from user_stats, windowed ones from the current
+    leaderboard_buckets bucket; both are kept current by triggers on rides, so this is a
+    top-N walk of a (distance) index either way.
+    """
+    if period == 'all':
+        if country is None:
+            return query_db(sql.LEADERBOARD_ALL_TIME, (limit,))
+        return query_db(sql.LEADERBOARD_ALL_TIME_COUNTRY, (country, limit))
+
+    bucket = leaderboard_bucket(period)
+    if country is None:
+        return query_db(sql.LEADERBOARD_PERIOD, (period, bucket, limit))
+    return query_db(sql.LEADERBOARD_PERIOD_COUNTRY, (period, bucket, country, limit))
+
+RANK_NEIGHBOURS = 5
+
+def leaderboard_rank(user_id, period='all', country=None, radius=RANK_NEIGHBOURS):
+    """
+    A rider's position on a leaderboard plus up to `radius` riders on either side, without ranking everyone.
+
+    Boards are ordered by (distance DESC, user_id), which is exactly the order of the distance indexes
+    on user_stats / leaderboard_buckets. The neighbours are four short index seeks from the rider's own
+    key, and the rank is an index-only count of the entries ahead of that key (no sort, no table reads).
+    Returns None if the rider has no entry on that board (e.g. no public rides this week).
+    """
+    board = 'all' if period == 'all' else 'bucket'
+    params = () if period == 'all' else (period, leaderboard_bucket(period))
+    if country is not None:
+        board += '_country'
+        params += (country,)
+    queries = sql.RANK_QUERIES[board]
+
+    me = query_db(queries['me'], (*params, user_id), one=True)
+    if not me:
+        return None
+    distance = me['distance']
+
+    ahead = query_db(queries['ahead'], (*params, distance, *params, distance, user_id), one=True)['c']
+
+    def neighbours(side, args):
+        return query_db(queries[side], (*params, *args, radius))
+
+    # Riders just ahead: same distance with a lower id, then the next larger distances
+    above = neighbours('above_tied', (distance, user_id)) + neighbours('above', (distance,))
+    # Riders just behind: same distance with a higher id, then the next smaller distances
+    below = neighbours('below_tied', (distance, user_id)) + neighbours('below', (distance,))
+
+    rank = ahead + 1
+    above = [dict(r, rank=rank - i) for i, r in enumerate(above[:radius], start=1)][::-1]
+    below = [dict(r, rank=rank + i) for i, r in enumerate(below[:radius], start=1)]
+    for row in above + below:
+        del row['sort_distance']
+    return {'rank': rank, 'total_distance': round(distance, 2), 'above': above, 'below': below}
+
+def my_ranks(user, period='all'):
+    """Global and country position for the leaderboard page and /api/leaderboard/rank"""
+    return {
+        'global': leaderboard_rank(user['id'], period),
+        'country': leaderboard_rank(user['id'], period, country=user['country']),
+    }
+
+@app.route('/api/leaderboard/rank')
+def api_leaderboard_rank():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    period = request.args.get('period', 'all')
+    if period not in LEADERBOARD_PERIODS:
+        return jsonify({'error': f"period must be one of: {', '.join(LEADERBOARD_PERIODS)}"}), 400
+    user = query_db(sql.RANK_USER, (session['user_id'],), one=True)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify({'user_id': user['id'], 'country': user['country'], 'period': period, **my_ranks(user, period)})
+
 @app.route('/leaderboard')
 def leaderboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = query_db('SELECT * FROM users WHERE id = ?', (session['user_id'],), one=True)
+    user = query_db(sql.USER_BY_ID, (session['user_id'],), one=True)
     user_country = user['country'] if user else 'Unknown'
-    global_leaderboard = query_db('''
-        SELECT u.id, u.username, u.country, u.profile_pic,
-               COALESCE(SUM(r.distance), 0) AS total_distance
-        FROM users u
-        LEFT JOIN rides r ON r.user_id = u.id AND r.public = 1
-        GROUP BY u.id
-        ORDER BY total_distance DESC
-        LIMIT 50
-    ''')
-    local_leaderboard = query_db('''
-        SELECT u.id, u.username, u.country, u.profile_pic,
-               COALESCE(SUM(r.distance), 0) AS total_distance
-        FROM users u
-        LEFT JOIN rides r ON r.user_id = u.id AND r.public = 1
-        WHERE u.country = ?
-        GROUP BY u.id
-        ORDER BY total_distance DESC
-        LIMIT 50
-    ''', (user_country,))
+    period = request.args.get('period', 'all')
+    if period not in LEADERBOARD_PERIODS:
+        period = 'all'
     return render_template('leaderboard.html',
-                           global_leaderboard=global_leaderboard,
-                           local_leaderboard=local_leaderboard,
-                           user_country=user_country)
+                           global_leaderboard=leaderboard_top(period),
+                           local_leaderboard=leaderboard_top(period, country=user_country),
+                           user_country=user_country,
+                           period=period,
+                           periods=LEADERBOARD_PERIODS,
+                           my_rank=my_ranks(user, period) if user else None)
 
 @app.route('/edit-ride/<int:ride_id>', methods=['GET', 'POST'])
 def edit_ride(ride_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     user_id = session['user_id']
-    ride = query_db('SELECT * FROM rides WHERE id = ? AND user_id = ?', (ride_id, user_id), one=True)
+    ride = query_db(sql.RIDE_BY_ID_AND_USER, (ride_id, user_id), one=True)
     if not ride:
         flash('Ride not found.', 'error')
         return redirect(url_for('dashboard'))
 
    
 
-    bikes = query_db('SELECT * FROM bikes WHERE user_id = ?', (user_id,))
+    bikes = query_db(sql.USER_BIKES, (user_id,))
 
     if request.method == 'POST':
         bike_id = request.form.get('bike_id') or None
@@ -1415,10 +1957,7 @@ def edit_ride(ride_id):
         
         is_private = 1 if request.form.get('is_private') == 'on' else 0
 
-        query_db('''
-            UPDATE rides SET bike_id = ?, date = ?, distance = ?, time = ?, description = ?, tags = ?, is_private = ?
-            WHERE id = ? AND user_id = ?
-        ''', (bike_id, date, distance, time_val, description, tags, is_private, ride_id, user_id))
+        query_db(sql.RIDE_UPDATE, (bike_id, date, distance, time_val, description, tags, is_private, ride_id, user_id))
 
         flash('Ride updated.', 'success')
         return redirect(url_for('dashboard'))
@@ -1438,7 +1977,7 @@ def add_comment(ride_id):
         return redirect(request.referrer or url_for('dashboard'))
 
     # Ensure ride exists and is commentable
-    ride = query_db('SELECT * FROM rides WHERE id = ?', (ride_id,), one=True)
+    ride = query_db(sql.RIDE_BY_ID, (ride_id,), one=True)
     if not ride:
         flash('Ride not found.', 'error')
         return redirect(request.referrer or url_for('dashboard'))
@@ -1452,7 +1991,7 @@ def add_comment(ride_id):
         return redirect(request.referrer or url_for('dashboard'))
 
     try:
-        query_db('INSERT INTO comments (ride_id, user_id, content, created_at) VALUES (?, ?, ?, datetime("now"))',
+        query_db(sql.COMMENT_INSERT,
                  (ride_id, session['user_id'], content))
         flash('Comment posted.', 'success')
     except Exception as e:
@@ -1469,18 +2008,18 @@ def like_ride(ride_id):
         return redirect(url_for('login'))
     uid = session['user_id']
 
-    ride = query_db('SELECT * FROM rides WHERE id = ?', (ride_id,), one=True)
+    ride = query_db(sql.RIDE_BY_ID, (ride_id,), one=True)
     if not ride:
         flash('Ride not found.', 'error')
         return redirect(request.referrer or url_for('dashboard'))
 
     try:
-        existing = query_db('SELECT id FROM likes WHERE user_id = ? AND ride_id = ?', (uid, ride_id), one=True)
+        existing = query_db(sql.LIKE_ID, (uid, ride_id), one=True)
         if existing:
-            query_db('DELETE FROM likes WHERE id = ?', (existing['id'],))
+            query_db(sql.LIKE_DELETE, (existing['id'],))
             flash('Removed like.', 'success')
         else:
-            query_db('INSERT INTO likes (user_id, ride_id, created_at) VALUES (?, ?, datetime("now"))', (uid, ride_id))
+            query_db(sql.LIKE_INSERT, (uid, ride_id))
             flash('Liked!', 'success')
     except Exception as e:
         flash('Failed to update like: ' + str(e), 'error')
@@ -1491,7 +2030,7 @@ def like_ride(ride_id):
 # Bike maintenance view for a specific bike
 @app.route('/bike/<int:bike_id>/maintenance', methods=['GET', 'POST'])
 def bike_maintenance_view(bike_id):
-    bike = query_db('SELECT * FROM bikes WHERE id = ?', (bike_id,), one=True)
+    bike = query_db(sql.BIKE_BY_ID, (bike_id,), one=True)
     if not bike:
         flash('Bike not found.', 'error')
         return redirect(url_for('bikes') if 'user_id' in session else url_for('leaderboard'))
@@ -1506,7 +2045,7 @@ def bike_maintenance_view(bike_id):
         flash('This bike is private.', 'error')
         return redirect(url_for('user_garage', user_id=bike['user_id']))
 
-    owner = query_db('SELECT id, username, profile_pic FROM users WHERE id = ?', (bike['user_id'],), one=True)
+    owner = query_db(sql.USER_CARD, (bike['user_id'],), one=True)
 
     # Handle add / delete via POST
     if request.method == 'POST':
@@ -1522,7 +2061,7 @@ def bike_maintenance_view(bike_id):
             if not item:
                 flash('Maintenance item required.', 'error')
             else:
-                query_db('INSERT INTO bike_maintenance (bike_id, item, date, notes) VALUES (?, ?, ?, ?)',
+                query_db(sql.BIKE_MAINTENANCE_INSERT,
                          (bike_id, item, date, notes))
                 flash('Maintenance entry added.', 'success')
             return redirect(url_for('bike_maintenance_view', bike_id=bike_id))
@@ -1534,64 +2073,40 @@ def bike_maintenance_view(bike_id):
                 return redirect(request.referrer or url_for('bike_maintenance_view', bike_id=bike_id))
             entry_id = request.form.get('entry_id')
             if entry_id:
-                query_db('DELETE FROM bike_maintenance WHERE id = ? AND bike_id = ?', (entry_id, bike_id))
+                query_db(sql.BIKE_MAINTENANCE_DELETE, (entry_id, bike_id))
                 flash('Maintenance entry removed.', 'success')
             return redirect(url_for('bike_maintenance_view', bike_id=bike_id))
 
     # GET: show entries
-    entries = query_db('SELECT * FROM bike_maintenance WHERE bike_id = ? ORDER BY date DESC', (bike_id,))
+    entries = query_db(sql.BIKE_MAINTENANCE, (bike_id,))
     return render_template('bike_maintenance.html', bike=bike, entries=entries, owner=owner)
 
 
 # Followers / Following listing pages (tabs above)
 @app.route('/user/<int:user_id>/followers')
 def user_followers(user_id):
-    user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    user = query_db(sql.USER_BY_ID, (user_id,), one=True)
     if not user:
         flash('User not found.', 'error')
         return redirect(url_for('leaderboard'))
 
-    followers = query_db('''
-        SELECT u.id, u.username, u.profile_pic
-        FROM users u
-        JOIN follows f ON u.id = f.follower_id
-        WHERE f.followed_id = ?
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
-
-    following = query_db('''
-        SELECT u.id, u.username, u.profile_pic
-        FROM users u
-        JOIN follows f ON u.id = f.followed_id
-        WHERE f.follower_id = ?
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
+    followers = query_db(sql.USER_FOLLOWERS, (user_id,))
+
+    following = query_db(sql.USER_FOLLOWING, (user_id,))
 
     return render_template('user_connections.html', user=user, active_tab='followers', followers=followers, following=following)
 
 
 @app.route('/user/<int:user_id>/following')
 def user_following(user_id):
-    user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    user = query_db(sql.USER_BY_ID, (user_id,), one=True)
     if not user:
         flash('User not found.', 'error')
         return redirect(url_for('leaderboard'))
 
-    followers = query_db('''
-        SELECT u.id, u.username, u.profile_pic
-        FROM users u
-        JOIN follows f ON u.id = f.follower_id
-        WHERE f.followed_id = ?
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
-
-    following = query_db('''
-        SELECT u.id, u.username, u.profile_pic
-        FROM users u
-        JOIN follows f ON u.id = f.followed_id
-        WHERE f.follower_id = ?
-        ORDER BY f.created_at DESC
-    ''', (user_id,))
+    followers = query_db(sql.USER_FOLLOWERS, (user_id,))
+
+    following = query_db(sql.USER_FOLLOWING, (user_id,))
 
     return render_template('user_connections.html', user=user, active_tab='following', followers=followers, following=following)
 
@@ -1604,12 +2119,12 @@ def follow_toggle(target_id):
         flash("Can't follow yourself.", 'error')
         return redirect(request.referrer or url_for('leaderboard'))
 
-    existing = query_db('SELECT id FROM follows WHERE follower_id=? AND followed_id=?', (uid, target_id), one=True)
+    existing = query_db(sql.FOLLOW_ID, (uid, target_id), one=True)
     if existing:
-        query_db('DELETE FROM follows WHERE id = ?', (existing['id'],))
+        query_db(sql.FOLLOW_DELETE, (existing['id'],))
         flash('Unfollowed user.', 'success')
     else:
-        query_db('INSERT INTO follows (follower_id, followed_id, created_at) VALUES (?, ?, datetime("now"))', (uid, target_id))
+        query_db(sql.FOLLOW_INSERT, (uid, target_id))
         flash('Now following user.', 'success')
 
         # Create follow notification
@@ -1638,11 +2153,11 @@ def profile_edit():
 
         # check username availability (allow same if unchanged)
         if new_username:
-            existing = query_db('SELECT id FROM users WHERE username = ? AND id != ?', (new_username, user_id), one=True)
+            existing = query_db(sql.USERNAME_TAKEN, (new_username, user_id), one=True)
             if existing:
                 flash('Username already taken.', 'error')
                 return redirect(url_for('profile_edit'))
-            query_db('UPDATE users SET username = ? WHERE id = ?', (new_username, user_id))
+            query_db(sql.USER_SET_USERNAME, (new_username, user_id))
             session['username'] = new_username
 
         # handle profile picture
@@ -1653,24 +2168,24 @@ def profile_edit():
             file.save(dest)
             rel = os.path.relpath(dest, start='static').replace('\\','/')
             rel = f"/static/{rel}"
-            query_db('UPDATE users SET profile_pic = ? WHERE id = ?', (rel, user_id))
+            query_db(sql.USER_SET_PROFILE_PIC, (rel, user_id))
 
         if bio is not None:
-            query_db('UPDATE users SET bio = ? WHERE id = ?', (bio, user_id))
+            query_db(sql.USER_SET_BIO, (bio, user_id))
 
         # Update country and city
         if country:
-            query_db('UPDATE users SET country = ? WHERE id = ?', (country, user_id))
+            query_db(sql.USER_SET_COUNTRY, (country, user_id))
             session['country'] = country
         
         if city:
-            query_db('UPDATE users SET city = ? WHERE id = ?', (city, user_id))
+            query_db(sql.USER_SET_CITY, (city, user_id))
             session['city'] = city
 
         flash('Profile updated.', 'success')
         return redirect(url_for('profile'))
 
-    user = query_db('SELECT * FROM users WHERE id = ?', (user_id,), one=True)
+    user = query_db(sql.USER_BY_ID, (user_id,), one=True)
     return render_template('edit_profile.html', user=user)
 
 # AJAX: Get total unread count
@@ -1679,23 +2194,9 @@ def unread_count():
     if 'user_id' not in session:
         return {'unread_count': 0}, 401
     
-    uid = session['user_id']
-    
-    # Count unread user messages FROM others TO you (exclude messages you sent)
-    user_unread = query_db('SELECT COUNT(*) as c FROM messages WHERE recipient_id = ? AND is_read = 0 AND sender_id != ?', (uid, uid), one=True)['c']
-    
-    # Count unread group messages FROM others (exclude system messages and messages you sent)
-    groups = query_db('SELECT g.id FROM groups g JOIN group_members gm ON g.id = gm.group_id WHERE gm.user_id = ?', (uid,))
-    group_unread = 0
-    for g in groups:
-        last_read = query_db('SELECT last_read FROM group_members WHERE group_id = ? AND user_id = ?', (g['id'], uid), one=True)
-        last_read_time = last_read['last_read'] if last_read and last_read['last_read'] else '1900-01-01'
-        # Exclude system messages (sender_id != 0) and exclude messages sent by current user (sender_id != uid)
-        count = query_db('SELECT COUNT(*) as c FROM group_messages WHERE group_id = ? AND sender_id != 0 AND sender_id != ? AND created_at > ?', 
-                          (g['id'], uid, last_read_time), one=True)['c']
-        group_unread += count
-    
-    return {'unread_count': user_unread + group_unread}
+    # Unread direct + group messages, maintained by triggers on write (migrate_add_unread_counters.py)
+    counters = query_db(sql.CHAT_UNREAD_COUNT, (session['user_id'],), one=True)
+    return {'unread_count': counters['c'] if counters else 0}
 
 # Add ride (GET shows form, POST creates record)
 @app.route('/add-ride', methods=['GET', 'POST'])
@@ -1705,7 +2206,7 @@ def add_ride():
     user_id = session['user_id']
 
     # Provide user's bikes for the select box
-    bikes = query_db('SELECT * FROM bikes WHERE user_id = ?', (user_id,))
+    bikes = query_db(sql.USER_BIKES, (user_id,))
 
     if request.method == 'POST':
         bike_id = request.form.get('bike_id') or None
@@ -1734,11 +2235,7 @@ def add_ride():
 
         try:
             # NOTE: no created_at column in your schema, so do not insert it
-            query_db('''
-                INSERT INTO rides
-                (user_id, bike_id, date, public)
-                VALUES (?, ?, ?, 1)
-            ''', (user_id, bike_id if bike_id else None, datetime.now().isoformat()))
+            query_db(sql.RIDE_INSERT_MANUAL, (user_id, bike_id if bike_id else None, datetime.now().isoformat()))
             
             flash('Ride saved.', 'success')
         except Exception as e:
@@ -1757,17 +2254,21 @@ def delete_ride(ride_id):
     uid = session['user_id']
 
     # Ensure the ride exists and belongs to the current user
-    ride = query_db('SELECT * FROM rides WHERE id = ? AND user_id = ?', (ride_id, uid), one=True)
+    ride = query_db(sql.RIDE_BY_ID_AND_USER, (ride_id, uid), one=True)
     if not ride:
         flash('Ride not found or permission denied.', 'error')
         return redirect(url_for('dashboard'))
 
     try:
-        # Remove dependent rows first (comments, likes) to avoid FK issues / orphaned rows
-        query_db('DELETE FROM likes WHERE ride_id = ?', (ride_id,))
-        query_db('DELETE FROM comments WHERE ride_id = ?', (ride_id,))
-        # Delete the ride itself
-        query_db('DELETE FROM rides WHERE id = ? AND user_id = ?', (ride_id, uid))
+        # One commit for the whole ride; a failure leaves it untouched
+        with get_db().transaction():
+            # Remove dependent rows first (comments, likes) to avoid FK issues / orphaned rows
+            query_db(sql.RIDE_LIKES_DELETE, (ride_id,))
+            query_db(sql.RIDE_COMMENTS_DELETE, (ride_id,))
+            query_db(sql.RIDE_PROGRESS_DELETE, (ride_id,))
+            query_db(sql.RIDE_TRACK_DELETE, (ride_id,))
+            # Delete the ride itself
+            query_db(sql.RIDE_DELETE_BY_USER, (ride_id, uid))
         flash('Ride deleted.', 'success')
     except Exception as e:
         flash('Failed to delete ride: ' + str(e), 'error')
@@ -1781,7 +2282,7 @@ def search_users():
     if not q:
         return {'users': []}
     pattern = f"%{q}%"
-    rows = query_db('SELECT id, username, profile_pic FROM users WHERE username LIKE ? COLLATE NOCASE LIMIT 30', (pattern,))
+    rows = query_db(sql.USER_SEARCH, (pattern,))
     users = [{'id': r['id'], 'username': r['username'], 'profile_pic': r['profile_pic']} for r in rows]
     return {'users': users}
 
@@ -1792,38 +2293,42 @@ def delete_profile():
     uid = session['user_id']
 
     try:
-        # Delete likes and comments by user
-        query_db('DELETE FROM likes WHERE user_id = ?', (uid,))
-        query_db('DELETE FROM comments WHERE user_id = ?', (uid,))
-
-        # Remove follow relationships (both follower and followed)
-        query_db('DELETE FROM follows WHERE follower_id = ? OR followed_id = ?', (uid, uid))
-
-        # Delete user messages (sent or received)
-        query_db('DELETE FROM messages WHERE sender_id = ? OR recipient_id = ?', (uid, uid))
-
-        # Delete group messages sent by user
-        query_db('DELETE FROM group_messages WHERE sender_id = ?', (uid,))
-
-        # Remove from group_members and delete groups owned by the user
-        # First, find groups owned by the user and delete them and their data
-        owned_groups = query_db('SELECT id FROM groups WHERE owner_id = ?', (uid,))
-        for g in owned_groups:
-            gid = g['id']
-            query_db('DELETE FROM group_messages WHERE group_id = ?', (gid,))
-            query_db('DELETE FROM group_members WHERE group_id = ?', (gid,))
-            query_db('DELETE FROM groups WHERE id = ?', (gid,))
-
-        # Remove any remaining group memberships for this user
-        query_db('DELETE FROM group_members WHERE user_id = ?', (uid,))
-
-        # Delete rides (and their likes/comments)
-        # comments/likes for rides created by this user already deleted above per user_id,
-        # but remove ride rows themselves:
-        query_db('DELETE FROM rides WHERE user_id = ?', (uid,))
-
-        # Finally delete the user row
-        query_db('DELETE FROM users WHERE id = ?', (uid,))
+        # Everything below is one unit of work: the account is either gone entirely or untouched
+        db = get_db()
+        with db.transaction():
+            # Delete likes and comments by user
+            query_db(sql.USER_LIKES_DELETE, (uid,))
+            query_db(sql.USER_COMMENTS_DELETE, (uid,))
+
+            # Remove follow relationships (both follower and followed)
+            query_db(sql.USER_FOLLOWS_DELETE, (uid, uid))
+
+            # Delete user messages (sent or received)
+            query_db(sql.USER_MESSAGES_DELETE, (uid, uid))
+
+            # Delete group messages sent by user
+            query_db(sql.USER_GROUP_MESSAGES_DELETE, (uid,))
+
+            # Remove from group_members and delete groups owned by the user
+            # First, find groups owned by the user and delete them and their data
+            owned_groups = [(g['id'],) for g in query_db(sql.USER_OWNED_GROUPS, (uid,))]
+            if owned_groups:
+                execute_query(db, sql.GROUP_MESSAGES_DELETE, owned_groups, many=True)
+                execute_query(db, sql.GROUP_MEMBERS_DELETE, owned_groups, many=True)
+                execute_query(db, sql.GROUP_DELETE, owned_groups, many=True)
+
+            # Remove any remaining group memberships for this user
+            query_db(sql.USER_GROUP_MEMBERSHIPS_DELETE, (uid,))
+
+            # Delete rides (and their likes/comments)
+            # comments/likes for rides created by this user already deleted above per user_id,
+            # but remove ride rows themselves:
+            query_db(sql.USER_RIDE_PROGRESS_DELETE, (uid,))
+            query_db(sql.USER_RIDE_TRACKS_DELETE, (uid,))
+            query_db(sql.USER_RIDES_DELETE, (uid,))
+
+            # Finally delete the user row
+            query_db(sql.USER_DELETE, (uid,))
 
         # Clear session and log out
         session.clear()
@@ -1870,59 +2375,24 @@ def events_browse():
     # Scope (local/global)
     scope = request.args.get('scope', 'local')
 
-    # Base query: only upcoming and ongoing events (exclude cancelled and past)
-    query = '''
-        SELECT e.*, u.username, u.profile_pic,
-               COUNT(DISTINCT ep.user_id) as participant_count
-        FROM events e
-        JOIN users u ON e.creator_id = u.id
-        LEFT JOIN event_participants ep ON e.id = ep.event_id
-        WHERE e.status IN ('upcoming', 'ongoing')
-    '''
-    args = []
-    
-    # Filter by category
-    if category and category in EVENT_CATEGORIES:
-        query += ' AND e.category = ?'
-        args.append(category)
-
     # Filter by city
     city_filter = request.args.get('city', '').strip()
-    if city_filter:
-        query += ' AND e.city = ?'
-        args.append(city_filter)
-
-    # Filter by scope
-    if scope == 'local':
-        # Show events marked local
-        query += ' AND (e.is_local = 1 OR e.is_local IS NULL)'
-    elif scope == 'global':
-        query += ' AND e.is_local = 0'
-    
-    # Search by title, description, location_name or city
-    if search:
-        query += ' AND (e.title LIKE ? OR e.description LIKE ? OR e.location_name LIKE ? OR e.city LIKE ?)'
-        search_pattern = f'%{search}%'
-        args.extend([search_pattern, search_pattern, search_pattern, search_pattern])
-    
-    query += ' GROUP BY e.id'
-    
-    # Sorting
-    if sort_by == 'popular':
-        query += ' ORDER BY participant_count DESC, e.event_date ASC'
-    elif sort_by == 'nearest':
-        # Nearest requires user location; for now, sort by soonest
-        query += ' ORDER BY e.event_date ASC'
-    else:  # 'soonest' default
-        query += ' ORDER BY e.event_date ASC'
-    
-    events_rows = query_db(query, args)
+
+    # Only upcoming and ongoing events (exclude cancelled and past); unused filters are passed as NULL.
+    # 'nearest' requires user location; for now it sorts by soonest like the default
+    events_rows = query_db(sql.EVENTS_BROWSE, {
+        'category': category if category in EVENT_CATEGORIES else None,
+        'city': city_filter or None,
+        'scope': scope if scope in ('local', 'global') else None,
+        'search': f'%{search}%' if search else None,
+        'popular': sort_by == 'popular',
+    })
 
     # Build list of available cities for the city filter dropdown (scope-aware)
     if scope == 'global':
-        cities_rows = query_db("SELECT DISTINCT city FROM events WHERE city IS NOT NULL AND city <> ? AND is_local = 0 ORDER BY city ASC", ('',))
+        cities_rows = query_db(sql.EVENT_CITIES_GLOBAL, ('',))
     else:
-        cities_rows = query_db("SELECT DISTINCT city FROM events WHERE city IS NOT NULL AND city <> ? AND (is_local = 1 OR is_local IS NULL) ORDER BY city ASC", ('',))
+        cities_rows = query_db(sql.EVENT_CITIES_LOCAL, ('',))
     cities = [r['city'] for r in cities_rows]
     
     # Convert each sqlite3.Row to a mutable dict and enrich with computed fields
@@ -1937,7 +2407,7 @@ def events_browse():
             event['participant_count'] = 0
 
         is_participant = query_db(
-            'SELECT id FROM event_participants WHERE event_id = ? AND user_id = ?',
+            sql.EVENT_PARTICIPATION,
             (event['id'], current_uid),
             one=True
         ) is not None
@@ -1988,10 +2458,10 @@ def create_event():
         user_country = session.get('country')
         allowed_cities = []
         if user_country:
-            rows = query_db('SELECT DISTINCT city FROM users WHERE country = ? AND city IS NOT NULL AND city <> ? ORDER BY city ASC', (user_country, ''))
+            rows = query_db(sql.USER_CITIES_IN_COUNTRY, (user_country, ''))
             allowed_cities = [r['city'] for r in rows]
         if not allowed_cities:
-            rows = query_db("SELECT DISTINCT city FROM events WHERE city IS NOT NULL AND city <> ? ORDER BY city ASC", ('',))
+            rows = query_db(sql.EVENT_CITIES, ('',))
             allowed_cities = [r['city'] for r in rows]
         if not allowed_cities:
             allowed_cities = ['Sofia', 'London', 'Madrid', 'Paris', 'Berlin', 'Rome', 'New York']
@@ -2054,11 +2524,7 @@ def create_event():
         
         now = datetime.now().isoformat()
         try:
-            query_db('''
-                INSERT INTO events
-                (creator_id, title, description, event_date, location_name, city, latitude, longitude, category, max_participants, cover_image, is_local, status, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            query_db(sql.EVENT_INSERT, (
                 session['user_id'],
                 title, description, event_date, location_name, city,
                 lat, lon, category, max_part, cover_image,
@@ -2071,11 +2537,7 @@ def create_event():
                 flash('Database requires coordinates — inserting placeholder coords. Please run the migration to allow optional coordinates.', 'warning')
                 lat = 0.0
                 lon = 0.0
-                query_db('''
-                    INSERT INTO events
-                    (creator_id, title, description, event_date, location_name, city, latitude, longitude, category, max_participants, cover_image, is_local, status, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
+                query_db(sql.EVENT_INSERT, (
                     session['user_id'],
                     title, description, event_date, location_name, city,
                     lat, lon, category, max_part, cover_image,
@@ -2084,57 +2546,25 @@ def create_event():
             else:
                 raise
         
-        # Notify users in the same city about the new event
-        if is_local:
-            try:
-                # Get the event ID that was just created
-                new_event = query_db(
-                    'SELECT id FROM events WHERE creator_id = ? AND title = ? ORDER BY created_at DESC LIMIT 1',
-                    (session['user_id'], title), one=True
-                )
-                if new_event:
-                    event_id = new_event['id']
-                    # Get all users in the same city (except the creator)
-                    city_users = query_db(
-                        'SELECT id FROM users WHERE city = ? AND id != ? LIMIT 100',
-                        (city, session['user_id'])
-                    )
-                    # Create notifications for each user
-                    for user_row in city_users:
-                        create_notification(
-                            user_id=user_row['id'],
-                            notif_type='event_created',
-                            actor_id=session['user_id'],
-                            event_id=event_id,
-                            message=f"New event in {city}: {title}"
-                        )
-            except Exception as e:
-                print(f"Error creating event notifications: {e}")
-        else:
-            # Notify all users when a global event is created
-            try:
-                new_event = query_db(
-                    'SELECT id FROM events WHERE creator_id = ? AND title = ? ORDER BY created_at DESC LIMIT 1',
-                    (session['user_id'], title), one=True
-                )
-                if new_event:
-                    event_id = new_event['id']
-                    # Get all users except the creator (limit to 500)
-                    all_users = query_db(
-                        'SELECT id FROM users WHERE id != ? LIMIT 500',
-                        (session['user_id'],)
-                    )
-                    # Create notifications for each user
-                    for user_row in all_users:
-                        create_notification(
-                            user_id=user_row['id'],
-                            notif_type='event_created',
-                            actor_id=session['user_id'],
-                            event_id=event_id,
-                            message=f"New global event: {title}"
-                        )
-            except Exception as e:
-                print(f"Error creating global event notifications: {e}")
+        # Notify users in the same city about a local event (written by the job worker, not
+        # in this request); a global event is a single broadcast everyone reads
+        try:
+            new_event = query_db(
+                sql.EVENT_LATEST_BY_CREATOR,
+                (session['user_id'], title), one=True
+            )
+            if new_event and is_local:
+                enqueue_job('event_notifications', {
+                    'event_id': new_event['id'],
+                    'actor_id': session['user_id'],
+                    'city': city,
+                    'message': f"New event in {city}: {title}",
+                })
+            elif new_event:
+                publish_broadcast('global_event', actor_id=session['user_id'], event_id=new_event['id'],
+                                  message=f"New global event: {title}")
+        except Exception as e:
+            print(f"Error sending event notifications: {e}")
         
         flash('Event created successfully!', 'success')
         return redirect(url_for('events_browse'))
@@ -2365,15 +2795,7 @@ def event_detail(event_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    event_row = query_db('''
-        SELECT e.*, u.id as creator_id, u.username as creator_username, u.profile_pic as creator_pic,
-               COUNT(DISTINCT ep.user_id) as participant_count
-        FROM events e
-        JOIN users u ON e.creator_id = u.id
-        LEFT JOIN event_participants ep ON e.id = ep.event_id
-        WHERE e.id = ?
-        GROUP BY e.id
-    ''', (event_id,), one=True)
+    event_row = query_db(sql.EVENT_DETAIL, (event_id,), one=True)
     
     if not event_row:
         flash('Event not found.', 'error')
@@ -2383,17 +2805,11 @@ def event_detail(event_id):
     event = dict(event_row)
 
     # Get participants with profile info
-    participants = query_db('''
-        SELECT u.id, u.username, u.profile_pic
-        FROM users u
-        JOIN event_participants ep ON u.id = ep.user_id
-        WHERE ep.event_id = ?
-        ORDER BY ep.joined_at ASC
-    ''', (event_id,))
+    participants = query_db(sql.EVENT_PARTICIPANTS, (event_id,))
     
     current_uid = session['user_id']
     is_participant = query_db(
-        'SELECT id FROM event_participants WHERE event_id = ? AND user_id = ?',
+        sql.EVENT_PARTICIPATION,
         (event['id'], current_uid),
         one=True
     ) is not None
@@ -2432,7 +2848,7 @@ def join_event(event_id):
         return redirect(url_for('login'))
     
     current_uid = session['user_id']
-    event = query_db('SELECT * FROM events WHERE id = ?', (event_id,), one=True)
+    event = query_db(sql.EVENT_BY_ID, (event_id,), one=True)
     
     if not event:
         flash('Event not found.', 'error')
@@ -2440,7 +2856,7 @@ def join_event(event_id):
     
     # Check if already participant
     already_joined = query_db(
-        'SELECT id FROM event_participants WHERE event_id = ? AND user_id = ?',
+        sql.EVENT_PARTICIPATION,
         (event_id, current_uid),
         one=True
     )
@@ -2456,7 +2872,7 @@ def join_event(event_id):
     
     # Check capacity
     participant_count = query_db(
-        'SELECT COUNT(*) as c FROM event_participants WHERE event_id = ?',
+        sql.EVENT_PARTICIPANT_COUNT,
         (event_id,),
         one=True
     )['c']
@@ -2473,7 +2889,7 @@ def join_event(event_id):
     # Add participant
     now = datetime.now().isoformat()
     query_db(
-        'INSERT INTO event_participants (event_id, user_id, joined_at) VALUES (?, ?, ?)',
+        sql.EVENT_PARTICIPANT_INSERT,
         (event_id, current_uid, now)
     )
     
@@ -2487,7 +2903,7 @@ def leave_event(event_id):
         return redirect(url_for('login'))
     
     current_uid = session['user_id']
-    event = query_db('SELECT * FROM events WHERE id = ?', (event_id,), one=True)
+    event = query_db(sql.EVENT_BY_ID, (event_id,), one=True)
     
     if not event:
         flash('Event not found.', 'error')
@@ -2500,7 +2916,7 @@ def leave_event(event_id):
 
     # Check if user is participant
     participant = query_db(
-        'SELECT id FROM event_participants WHERE event_id = ? AND user_id = ?',
+        sql.EVENT_PARTICIPATION,
         (event_id, current_uid),
         one=True
     )
@@ -2516,7 +2932,7 @@ def leave_event(event_id):
     
     # Remove participant
     query_db(
-        'DELETE FROM event_participants WHERE event_id = ? AND user_id = ?',
+        sql.EVENT_PARTICIPANT_DELETE,
         (event_id, current_uid)
     )
     
@@ -2529,7 +2945,7 @@ def edit_event(event_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    event = query_db('SELECT * FROM events WHERE id = ?', (event_id,), one=True)
+    event = query_db(sql.EVENT_BY_ID, (event_id,), one=True)
     
     if not event:
         flash('Event not found.', 'error')
@@ -2587,7 +3003,7 @@ def edit_event(event_id):
                     errors.append('Max participants must be positive.')
                 # Check if new limit is below current participants
                 current_count = query_db(
-                    'SELECT COUNT(*) as c FROM event_participants WHERE event_id = ?',
+                    sql.EVENT_PARTICIPANT_COUNT,
                     (event_id,),
                     one=True
                 )['c']
@@ -2612,12 +3028,7 @@ def edit_event(event_id):
             cover_image = f"/static/{rel}"
         
         now = datetime.now().isoformat()
-        query_db('''
-            UPDATE events
-            SET title = ?, description = ?, event_date = ?, location_name = ?,
-                city = ?, latitude = ?, longitude = ?, max_participants = ?, cover_image = ?, updated_at = ?
-            WHERE id = ?
-        ''', (title, description, event_date, location_name, city, lat, lon, max_part, cover_image, now, event_id))
+        query_db(sql.EVENT_UPDATE, (title, description, event_date, location_name, city, lat, lon, max_part, cover_image, now, event_id))
         
         flash('Event updated successfully!', 'success')
         return redirect(url_for('event_detail', event_id=event_id))
@@ -2630,7 +3041,7 @@ def delete_event(event_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    event = query_db('SELECT * FROM events WHERE id = ?', (event_id,), one=True)
+    event = query_db(sql.EVENT_BY_ID, (event_id,), one=True)
     
     if not event:
         flash('Event not found.', 'error')
@@ -2640,8 +3051,10 @@ def delete_event(event_id):
         flash('Only the creator can delete this event.', 'error')
         return redirect(url_for('event_detail', event_id=event_id))
     
-    # Delete event (cascades to participants due to FK constraint)
-    query_db('DELETE FROM events WHERE id = ?', (event_id,))
+    # Delete event (cascades to participants due to FK constraint) and its broadcast
+    with get_db().transaction():
+        query_db(sql.EVENT_DELETE, (event_id,))
+        query_db(sql.BROADCASTS_DELETE_BY_EVENT, (event_id,))
     
     flash('Event deleted.', 'success')
     return redirect(url_for('events_browse'))
@@ -2657,29 +3070,11 @@ def my_events():
     
     if tab == 'joined':
         # Events user has joined
-        events = query_db('''
-            SELECT e.*, u.username as creator_username, u.profile_pic as creator_pic,
-                   COUNT(DISTINCT ep.user_id) as participant_count
-            FROM events e
-            JOIN users u ON e.creator_id = u.id
-            JOIN event_participants ep_user ON e.id = ep_user.event_id AND ep_user.user_id = ?
-            LEFT JOIN event_participants ep ON e.id = ep.event_id
-            GROUP BY e.id
-            ORDER BY e.event_date ASC
-        ''', (current_uid,))
+        events = query_db(sql.MY_EVENTS_JOINED, (current_uid,))
         event_type = 'joined'
     else:  # 'created'
         # Events user has created
-        events = query_db('''
-            SELECT e.*, u.username as creator_username, u.profile_pic as creator_pic,
-                   COUNT(DISTINCT ep.user_id) as participant_count
-            FROM events e
-            JOIN users u ON e.creator_id = u.id
-            LEFT JOIN event_participants ep ON e.id = ep.event_id
-            WHERE e.creator_id = ?
-            GROUP BY e.id
-            ORDER BY e.event_date ASC
-        ''', (current_uid,))
+        events = query_db(sql.MY_EVENTS_CREATED, (current_uid,))
         event_type = 'created'
     
     for event in events:
@@ -2699,10 +3094,7 @@ def ride_history():
     
     # Get all rides for this user ordered by date descending
     rides = query_db(
-        '''SELECT id, title, description, date, distance, time, avg_speed, top_speed, public, bike_id
-           FROM rides 
-           WHERE user_id = ? 
-           ORDER BY date DESC''',
+        sql.RIDE_HISTORY,
         (user_id,)
     )
     
@@ -2714,7 +3106,7 @@ def ride_history():
     for ride in rides:
         ride_dict = dict(ride)  # Convert sqlite3.Row to dict
         if ride_dict['bike_id']:
-            bike = query_db('SELECT name FROM bikes WHERE id = ?', (ride_dict['bike_id'],), one=True)
+            bike = query_db(sql.BIKE_NAME, (ride_dict['bike_id'],), one=True)
             ride_dict['bike_name'] = bike['name'] if bike else 'Unknown Bike'
         else:
             ride_dict['bike_name'] = 'No Bike'
@@ -2734,9 +3126,7 @@ def view_ride(ride_id):
     
     # Get the ride details - allow viewing public rides from any user
     ride = query_db(
-        '''SELECT id, title, description, date, distance, time, avg_speed, top_speed, public, bike_id, user_id, photos
-           FROM rides 
-           WHERE id = ?''',
+        sql.RIDE_VIEW,
         (ride_id,), one=True
     )
     
@@ -2753,7 +3143,7 @@ def view_ride(ride_id):
     
     # Get bike name if available
     if ride_dict['bike_id']:
-        bike = query_db('SELECT name, make_model FROM bikes WHERE id = ?', (ride_dict['bike_id'],), one=True)
+        bike = query_db(sql.BIKE_NAME_AND_MODEL, (ride_dict['bike_id'],), one=True)
         if bike:
             bike_name = bike['name'] or ''
             make_model = bike['make_model'] or ''
@@ -2770,12 +3160,17 @@ def view_ride(ride_id):
     else:
         ride_dict['bike_display_name'] = 'No Bike'
     
-    # Get GPS points for the map
-    gps_points = query_db(
-        'SELECT latitude, longitude, timestamp FROM gps_points WHERE ride_id = ? ORDER BY timestamp',
-        (ride_id,)
-    )
-    gps_list = [dict(point) for point in gps_points] if gps_points else []
+    # The map fetches its track from /api/ride/<id>/track after the page has painted;
+    # finished rides get a versioned URL the browser can cache for good
+    track = query_db(sql.RIDE_TRACK_INFO, (ride_id,), one=True)
+    track_args = {}
+    tolerance = request.args.get('tolerance', type=float)
+    if tolerance and tolerance > 0:
+        track_args['tolerance'] = tolerance
+    if track['point_count'] is not None:
+        track_args['v'] = track_version(track['point_count'], track['packed_at'])
+    has_track = (track['point_count'] or track['recorded_points'] or 0) > 1
+    track_url = url_for('api_ride_track', ride_id=ride_id, **track_args) if has_track else None
     
     # Format the date properly
     if ride_dict['date']:
@@ -2802,7 +3197,7 @@ def view_ride(ride_id):
     else:
         ride_dict['photos_list'] = []
     
-    return render_template('view_ride.html', ride=ride_dict, gps_points=gps_list)
+    return render_template('view_ride.html', ride=ride_dict, track_url=track_url)
 
 @app.route('/api/ride/toggle-public', methods=['POST'])
 def toggle_ride_public():
@@ -2817,7 +3212,7 @@ def toggle_ride_public():
         return jsonify({'error': 'No ride_id provided'}), 400
     
     # Get current public status
-    ride = query_db('SELECT public, user_id FROM rides WHERE id = ?', (ride_id,), one=True)
+    ride = query_db(sql.RIDE_VISIBILITY, (ride_id,), one=True)
     if not ride:
         return jsonify({'error': 'Ride not found'}), 404
     
@@ -2827,7 +3222,7 @@ def toggle_ride_public():
     
     # Toggle public status
     new_public = 0 if ride['public'] else 1
-    query_db('UPDATE rides SET public = ? WHERE id = ?', (new_public, ride_id))
+    query_db(sql.RIDE_SET_PUBLIC, (new_public, ride_id))
     
     return jsonify({
         'success': True,
@@ -2848,18 +3243,20 @@ def api_delete_ride():
         return jsonify({'error': 'No ride_id provided'}), 400
     
     # Get ride and verify ownership
-    ride = query_db('SELECT user_id FROM rides WHERE id = ?', (ride_id,), one=True)
+    ride = query_db(sql.RIDE_OWNER, (ride_id,), one=True)
     if not ride:
         return jsonify({'error': 'Ride not found'}), 404
     
     if ride['user_id'] != user_id:
         return jsonify({'error': 'You do not own this ride'}), 403
     
-    # Delete GPS points first
-    query_db('DELETE FROM gps_points WHERE ride_id = ?', (ride_id,))
+    # Delete GPS points, the packed track and running stats first
+    query_db(sql.RIDE_GPS_POINTS_DELETE, (ride_id,))
+    query_db(sql.RIDE_TRACK_DELETE, (ride_id,))
+    query_db(sql.RIDE_PROGRESS_DELETE, (ride_id,))
     
     # Delete ride
-    query_db('DELETE FROM rides WHERE id = ?', (ride_id,))
+    query_db(sql.RIDE_DELETE, (ride_id,))
     
     return jsonify({
         'success': True,
@@ -2876,7 +3273,7 @@ def track_ride():
     
     # Get user's bikes for selection (use existing schema columns `name` and `make_model`)
     user_id = session['user_id']
-    bikes = query_db('SELECT id, name, make_model FROM bikes WHERE user_id = ? ORDER BY name, make_model', (user_id,))
+    bikes = query_db(sql.TRACK_RIDE_BIKES, (user_id,))
     
     return render_template('track_ride.html', bikes=bikes, mapbox_key=os.environ.get('MAPBOX_KEY', ''))
 
@@ -2897,72 +3294,24 @@ def api_ride_start():
     print(f"👤 User ID: {user_id}, 🚲 Bike ID: {bike_id}")
     
     try:
-        # Create rides table if needed
-        query_db('''
-            CREATE TABLE IF NOT EXISTS rides (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                bike_id INTEGER,
-                title TEXT,
-                description TEXT,
-                date TEXT,
-                distance REAL,
-                time INTEGER,
-                avg_speed REAL,
-                top_speed REAL,
-                tags TEXT,
-                public BOOLEAN DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (bike_id) REFERENCES bikes(id)
-            )
-        ''')
-        
-        # Create gps_points table if needed
-        query_db('''
-            CREATE TABLE IF NOT EXISTS gps_points (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ride_id INTEGER NOT NULL,
-                latitude REAL,
-                longitude REAL,
-                speed REAL,
-                altitude REAL,
-                timestamp INTEGER,
-                FOREIGN KEY (ride_id) REFERENCES rides(id)
-            )
-        ''')
-        
-        # Insert new ride and get the ID in the same connection
-        import time
+        # Insert new ride and get the ID on the request's connection
         max_retries = 3
         retry_delay = 0.5
         ride_id = None
+        conn = get_db()
         
         for attempt in range(max_retries):
             try:
-                conn = sqlite3.connect('moto_log.db', timeout=10.0)
-                conn.row_factory = sqlite3.Row
-                conn.execute('PRAGMA journal_mode=WAL')
-                conn.execute('PRAGMA foreign_keys = ON')
-                cur = conn.cursor()
-                
-                # Insert and get ID in same connection
-                cur.execute('''
-                    INSERT INTO rides (user_id, bike_id, date, distance, time)
-                    VALUES (?, ?, ?, 0, 0)
-                ''', (user_id, bike_id if bike_id else None, datetime.now().isoformat()))
-                
-                # Get the last inserted ride ID immediately in same connection
-                cur.execute('SELECT last_insert_rowid() as id')
-                result = cur.fetchone()
-                ride_id = result['id'] if result else None
-                
+                cur = execute_query(conn, sql.RIDE_INSERT_STARTED, (user_id, bike_id if bike_id else None, datetime.now().isoformat()))
+                ride_id = cur.lastrowid
                 conn.commit()
-                conn.close()
                 
                 print(f"✅ Ride created with ID: {ride_id} (type: {type(ride_id).__name__})")
                 break
                 
             except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.rollback()
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay)
                     retry_delay *= 2
@@ -2980,6 +3329,44 @@ def api_ride_start():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def load_track(ride_id):
+    """GPS track of a ride as NumPy arrays (packed blob once finished, gps_points while recording)"""
+    return load_ride_track(get_db(), ride_id)
+
+# Douglas-Peucker tolerances (meters) for map payloads; full-resolution tracks come from load_track
+TRACK_MAP_TOLERANCE_M = 2.0
+TRACK_PREVIEW_TOLERANCE_M = 20.0
+
+def load_map_track(ride_id, tolerance_m=TRACK_MAP_TOLERANCE_M):
+    """Simplified GPS track of a ride for drawing on a map (cached once the ride is finished)"""
+    return load_simplified_track(get_db(), ride_id, tolerance_m)
+
+def load_map_tracks(ride_ids, tolerance_m=TRACK_MAP_TOLERANCE_M):
+    """load_map_track for a page of rides in batched queries: {ride_id: track}"""
+    return load_simplified_tracks(get_db(), ride_ids, tolerance_m)
+
+def update_ride_progress(conn, ride_id, rows):
+    """
+    Fold freshly inserted gps_points rows (ride_id, lat, lon, speed, altitude, timestamp)
+    into the ride's running stats. Call inside the same transaction as the INSERT so the
+    write lock is already held and concurrent batches can't lose updates.
+    """
+    current = run_query(conn, sql.RIDE_PROGRESS_BY_RIDE, (ride_id,), one=True)
+    _, lats, lons, speeds, alts, stamps = zip(*rows)
+    progress = accumulate_progress(dict(current) if current else None,
+                                   lats, lons, stamps, speed=speeds, altitude=alts)
+    execute_query(conn, sql.RIDE_PROGRESS_UPSERT,
+                  (ride_id, *[progress[c] for c in sql.PROGRESS_COLUMNS], datetime.now().isoformat()))
+    return progress
+
+def ride_finished(conn, ride_id):
+    """
+    True once the ride's track has been packed (or the ride is gone). Call inside the
+    transaction that writes gps_points, so a stop can't commit between check and insert.
+    """
+    ride = run_query(conn, sql.RIDE_RECORDING_STATE, (ride_id,), one=True)
+    return ride is None or bool(ride['finished'])
+
 @app.route('/api/ride/add-gps-point', methods=['POST'])
 def api_add_gps_point():
     """Add a GPS point to the current ride"""
@@ -2994,17 +3381,100 @@ def api_add_gps_point():
     altitude = data.get('altitude')
     timestamp = data.get('timestamp', int(datetime.now().timestamp()))
     
+    ride = query_db(sql.RIDE_RECORDING_STATE, (ride_id,), one=True)
+    if not ride:
+        return jsonify({'error': 'Ride not found'}), 404
+    if ride['user_id'] != session['user_id']:
+        return jsonify({'error': 'You do not own this ride'}), 403
+    
     try:
-        query_db('''
-            INSERT INTO gps_points (ride_id, latitude, longitude, speed, altitude, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (ride_id, latitude, longitude, speed, altitude, timestamp))
+        conn = get_db()
+        with conn.transaction():
+            # Checked under the write lock: a stop that commits first has already packed the track
+            if ride_finished(conn, ride_id):
+                return jsonify({'error': 'Ride already finished'}), 409
+            
+            # Fixes the device itself reports as imprecise are only counted, never stored
+            accuracy = data.get('accuracy')
+            if isinstance(accuracy, (int, float)) and accuracy > MAX_ACCURACY_M:
+                execute_query(conn, sql.RIDE_REJECT_POINT, (ride_id,))
+                return jsonify({'success': True, 'rejected': 1})
+            
+            row = (ride_id, latitude, longitude, speed, altitude, timestamp)
+            execute_query(conn, sql.GPS_POINT_INSERT, row)
+            update_ride_progress(conn, ride_id, [row])
         
         return jsonify({'success': True})
     except Exception as e:
         print(f"Error adding GPS point: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Upper bound on points per batch so one request can't hold the write lock for long
+GPS_BATCH_MAX_POINTS = 500
+
+@app.route('/api/ride/add-gps-points', methods=['POST'])
+def api_add_gps_points():
+    """Add a batch of GPS points to the current ride in a single transaction"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    ride_id = data.get('ride_id')
+    points = data.get('points')
+    
+    if not ride_id:
+        return jsonify({'error': 'No ride_id provided'}), 400
+    if not isinstance(points, list) or not points:
+        return jsonify({'error': 'No points provided'}), 400
+    if len(points) > GPS_BATCH_MAX_POINTS:
+        return jsonify({'error': f'Too many points in one batch (max {GPS_BATCH_MAX_POINTS})'}), 413
+    
+    # Verify ownership; whether the ride is still recording is checked when the points are written
+    ride = query_db(sql.RIDE_RECORDING_STATE, (ride_id,), one=True)
+    if not ride:
+        return jsonify({'error': 'Ride not found'}), 404
+    if ride['user_id'] != session['user_id']:
+        return jsonify({'error': 'You do not own this ride'}), 403
+    
+    now = int(datetime.now().timestamp())
+    rows = []
+    rejected = 0
+    for point in points:
+        if not isinstance(point, dict):
+            continue
+        latitude = point.get('latitude')
+        longitude = point.get('longitude')
+        if latitude is None or longitude is None:
+            continue
+        # Fixes the device itself reports as imprecise are only counted, never stored
+        accuracy = point.get('accuracy')
+        if isinstance(accuracy, (int, float)) and accuracy > MAX_ACCURACY_M:
+            rejected += 1
+            continue
+        rows.append((ride_id, latitude, longitude, point.get('speed', 0),
+                     point.get('altitude'), point.get('timestamp', now)))
+    
+    if not rows and not rejected:
+        return jsonify({'error': 'No valid points provided'}), 400
+    
+    try:
+        conn = get_db()
+        with conn.transaction():
+            # A stopped ride's track is already packed and can't take more points
+            if ride_finished(conn, ride_id):
+                return jsonify({'error': 'Ride already finished'}), 409
+            if rows:
+                execute_query(conn, sql.GPS_POINT_INSERT, rows, many=True)
+                update_ride_progress(conn, ride_id, rows)
+            if rejected:
+                execute_query(conn, sql.RIDE_REJECT_POINTS,
+                              (rejected, ride_id))
+        
+        return jsonify({'success': True, 'count': len(rows), 'rejected': rejected})
+    except Exception as e:
+        print(f"Error adding GPS points: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/ride/stop', methods=['POST'])
 def api_ride_stop():
     """Stop the current ride and calculate stats"""
@@ -3026,59 +3496,20 @@ def api_ride_stop():
         is_public = data.get('public', 1)
         photos = []
     
+    # Only the owner can stop a ride, and only once: stopping packs (and drops) its
+    # gps_points. Checked here before any upload is written and again under the write lock
+    ride = query_db(sql.RIDE_RECORDING_STATE, (ride_id,), one=True)
+    if not ride or ride['user_id'] != session['user_id']:
+        return jsonify({'error': 'Ride not found'}), 404
+    if ride['finished']:
+        return jsonify({'error': 'Ride already finished'}), 409
+    
     try:
-        # Ensure rides table has all required columns (migration)
-        try:
-            query_db('PRAGMA table_info(rides)', ())
-            # Check if title column exists by trying to query it
-            query_db('SELECT title FROM rides LIMIT 1', ())
-        except:
-            pass
-        
-        # Add missing columns if they don't exist
-        columns_to_add = {
-            'title': 'TEXT DEFAULT "My Ride"',
-            'description': 'TEXT DEFAULT ""',
-            'public': 'INTEGER DEFAULT 1',
-            'photos': 'TEXT DEFAULT "[]"'
-        }
-        
-        for col_name, col_def in columns_to_add.items():
-            try:
-                query_db(f'ALTER TABLE rides ADD COLUMN {col_name} {col_def}', ())
-                print(f'✅ Added column {col_name} to rides table')
-            except Exception as e:
-                # Column likely already exists
-                if 'duplicate column' not in str(e).lower() and 'already exists' not in str(e).lower():
-                    print(f'⚠️ Warning adding column {col_name}: {e}')
-        
-        # Get all GPS points for this ride
-        points = query_db('''
-            SELECT latitude, longitude, speed, timestamp
-            FROM gps_points
-            WHERE ride_id = ?
-            ORDER BY timestamp ASC
-        ''', (ride_id,))
-        
-        if len(points) < 2:
-            return jsonify({'error': 'Not enough GPS points to calculate stats'}), 400
-        
-        # Calculate statistics
-        stats = calculate_ride_stats(points)
-        
-        # Update ride with calculated stats
-        query_db('''
-            UPDATE rides
-            SET title = ?, description = ?, distance = ?, time = ?, 
-                avg_speed = ?, top_speed = ?, public = ?
-            WHERE id = ?
-        ''', (title, description, stats['distance'], stats['time'], 
-              stats['avg_speed'], stats['top_speed'], is_public, ride_id))
+        db = get_db()
         
         # Handle photo uploads
         photo_urls = []
         if photos:
-            import os
             upload_dir = os.path.join(app.root_path, 'static', 'uploads')
             os.makedirs(upload_dir, exist_ok=True)
             
@@ -3097,10 +3528,37 @@ def api_ride_stop():
                     
                     print(f"✅ Saved ride photo: {filename}")
         
-        # Store photos in database
+        # Stats, packed track and photos are committed together, so a failure never
+        # leaves a ride marked finished without its track
         import json
         photos_json = json.dumps(photo_urls)
-        query_db('UPDATE rides SET photos = ? WHERE id = ?', (photos_json, ride_id))
+        error = None
+        with db.transaction():
+            ride = query_db(sql.RIDE_RECORDING_STATE, (ride_id,), one=True)
+            if not ride or ride['user_id'] != session['user_id']:
+                error = ({'error': 'Ride not found'}, 404)
+            elif ride['finished']:
+                error = ({'error': 'Ride already finished'}, 409)
+            else:
+                # The ride is finished: drop GPS noise and outliers, measure what is left
+                # and pack it into one compact track blob. Read under the write lock, so
+                # every point committed before the stop is in the track
+                track, stats, rejected = clean_ride_track(load_track(ride_id))
+                if len(track['timestamp']) < 2:
+                    error = ({'error': 'Not enough GPS points to calculate stats'}, 400)
+                else:
+                    # Update ride with calculated stats
+                    query_db(sql.RIDE_FINISH, (title, description, stats['distance'], stats['time'], 
+                          stats['avg_speed'], stats['top_speed'], is_public, rejected, ride_id))
+                    store_ride_track(db, ride_id, track)
+                    # The running totals were only for the live view and are unfiltered
+                    query_db(sql.RIDE_PROGRESS_DELETE, (ride_id,))
+                    query_db(sql.RIDE_SET_PHOTOS, (photos_json, ride_id))
+        if error:
+            for url in photo_urls:
+                os.remove(os.path.join(app.root_path, url.lstrip('/')))
+            return jsonify(error[0]), error[1]
+        stats['rejected_points'] = rejected
         
         return jsonify({
             'success': True,
@@ -3111,6 +3569,180 @@ def api_ride_stop():
         print(f"Error stopping ride: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ride/<int:ride_id>/current-stats')
+def api_ride_current_stats(ride_id):
+    """Live stats for a ride being recorded, served from the running totals"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    ride = query_db(sql.RIDE_RECORDING_STATE, (ride_id,), one=True)
+    if not ride:
+        return jsonify({'error': 'Ride not found'}), 404
+    if ride['user_id'] != session['user_id']:
+        return jsonify({'error': 'You do not own this ride'}), 403
+    # A finished ride's stats are the cleaned ones saved on the ride, not running totals
+    if ride['finished']:
+        return jsonify({'error': 'Ride already finished'}), 409
+    
+    progress = query_db(sql.RIDE_PROGRESS_BY_RIDE, (ride_id,), one=True)
+    if not progress:
+        return jsonify({'success': True, 'ride_id': ride_id, 'stats': None})
+    
+    return jsonify({
+        'success': True,
+        'ride_id': ride_id,
+        'stats': progress_stats(progress),
+        'last_position': {
+            'latitude': progress['last_latitude'],
+            'longitude': progress['last_longitude'],
+            'timestamp': progress['last_timestamp']
+        }
+    })
+
+# Versioned track URLs (?v=) never change content, so browsers may keep them for a year.
+# Only browsers: a shared cache would keep serving the track after the ride is made private
+TRACK_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+TRACK_MAX_AGE = 3600
+
+def track_version(point_count, packed_at):
+    """Cache-busting version of a finished ride's track, for ?v= and the ETag"""
+    return f'{point_count}-{packed_at}'
+
+@app.route('/api/ride/<int:ride_id>/track')
+def api_ride_track(ride_id):
+    """
+    Map track of a ride as a Google encoded polyline, simplified to ?tolerance= meters
+    (or to the tolerance for ?zoom=). Finished rides get an ETag / Last-Modified and are
+    cacheable; rides still recording are not.
+    """
+    ride = query_db(sql.RIDE_TRACK_ACCESS, (ride_id,), one=True)
+    if not ride:
+        return jsonify({'error': 'Ride not found'}), 404
+    user_id = session.get('user_id')
+    if ride['public'] == 0 and (not user_id or ride['user_id'] != user_id):
+        return jsonify({'error': 'This ride is private'}), 403
+    
+    zoom = request.args.get('zoom', type=float)
+    tolerance = request.args.get('tolerance', type=float)
+    if zoom is not None:
+        tolerance = tolerance_for_zoom(min(max(zoom, 0), 22))
+    if not tolerance or tolerance <= 0:
+        tolerance = TRACK_MAP_TOLERANCE_M
+    tolerance = snap_tolerance(tolerance)
+    
+    finished = ride['point_count'] is not None
+    not_modified = False
+    if finished:
+        version = track_version(ride['point_count'], ride['packed_at'])
+        etag = f'ride{ride_id}-{version}-t{tolerance:g}'
+        last_modified = datetime.fromtimestamp(ride['packed_at'] or 0, timezone.utc)
+        # Answer revalidations from the ride_tracks row alone, before decoding anything
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif request.if_modified_since:
+            not_modified = request.if_modified_since >= last_modified
+    
+    if not_modified:
+        resp = app.response_class(status=304)
+    else:
+        track = load_map_track(ride_id, tolerance)
+        ts = track['timestamp']
+        resp = jsonify({
+            'ride_id': ride_id,
+            'finished': finished,
+            'tolerance': tolerance,
+            'precision': 5,
+            'point_count': int(len(ts)),
+            'polyline': encode_polyline(track['latitude'], track['longitude']),
+            'start_time': int(ts[0]) if len(ts) and ts[0] == ts[0] else None,
+            'end_time': int(ts[-1]) if len(ts) and ts[-1] == ts[-1] else None,
+        })
+    
+    if finished:
+        resp.set_etag(etag)
+        resp.last_modified = last_modified
+        immutable = request.args.get('v') == version
+        resp.cache_control.max_age = TRACK_IMMUTABLE_MAX_AGE if immutable else TRACK_MAX_AGE
+        resp.cache_control.immutable = immutable
+        if ride['public'] == 0 or immutable:
+            resp.cache_control.private = True
+        else:
+            resp.cache_control.public = True
+    else:
+        resp.cache_control.no_store = True
+    return resp
+
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'moto_log_exports')
+
+@app.route('/api/ride/<int:ride_id>/export.<fmt>')
+def api_ride_export(ride_id, fmt):
+    """
+    Download a ride as GPX, GeoJSON or CSV. The file is generated while it is sent, a
+    batch of points at a time, and gzip-compressed on the fly when the client accepts it.
+    """
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unsupported export format'}), 404
+    ride = query_db(sql.RIDE_EXPORT_INFO, (ride_id,), one=True)
+    if not ride:
+        return jsonify({'error': 'Ride not found'}), 404
+    user_id = session.get('user_id')
+    if ride['public'] == 0 and (not user_id or ride['user_id'] != user_id):
+        return jsonify({'error': 'This ride is private'}), 403
+    
+    chunks = coalesce(export_ride(get_db(), ride_id, fmt))
+    gzipped = 'gzip' in request.accept_encodings
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+    # stream_with_context keeps the request (and its pooled connection) alive until the last chunk
+    resp = app.response_class(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt])
+    filename = f"{(ride['date'] or '')[:10]}-{slugify(ride['title'])}.{fmt}".lstrip('-')
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    resp.vary.add('Accept-Encoding')
+    if gzipped:
+        resp.content_encoding = 'gzip'
+    resp.cache_control.no_cache = True
+    if ride['public'] == 0:
+        resp.cache_control.private = True
+    return resp
+
+@app.route('/api/account/export.zip')
+def api_account_export():
+    """
+    Download everything in the account as a zip (profile, bikes, ride list and one GPX per
+    ride). The archive is built on disk once per version of the account's data and served
+    with Range support, so interrupted downloads can resume.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    user_id = session['user_id']
+    
+    db = get_db()
+    version = account_export_version(db, user_id)
+    path = os.path.join(EXPORT_DIR, f'user_{user_id}_{version}.zip')
+    if not os.path.exists(path):
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        fd, partial = tempfile.mkstemp(prefix=f'user_{user_id}_', suffix='.part', dir=EXPORT_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                write_account_export(db, user_id, out)
+            os.replace(partial, path)
+        except Exception:
+            os.remove(partial)
+            raise
+        # Older versions of this user's archive can't be resumed any more (If-Range fails)
+        for name in os.listdir(EXPORT_DIR):
+            if name.startswith(f'user_{user_id}_') and name.endswith('.zip') and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(EXPORT_DIR, name))
+                except OSError:
+                    pass
+    
+    resp = send_file(path, mimetype='application/zip', as_attachment=True,
+                     download_name=f'moto-log-export-{datetime.now():%Y-%m-%d}.zip',
+                     conditional=True, etag=version, max_age=0)
+    resp.cache_control.private = True
+    return resp
+
 @app.route('/api/ride/upload-gpx', methods=['POST'])
 def api_upload_gpx():
     """Upload and parse a GPX file to simulate a ride"""
@@ -3122,32 +3754,12 @@ def api_upload_gpx():
             return jsonify({'error': 'No GPX file provided'}), 400
         
         file = request.files['gpx_file']
-        if not file.filename.endswith('.gpx'):
+        if not file.filename.lower().endswith('.gpx'):
             return jsonify({'error': 'File must be a GPX file'}), 400
         
-        # Parse GPX file
-        import xml.etree.ElementTree as ET
-        gpx_content = file.read().decode('utf-8')
-        root = ET.fromstring(gpx_content)
-        
-        # Extract namespace
-        ns = {'gpx': 'http://www.topografix.com/GPX/1/1'}
-        
-        points = []
-        for trkpt in root.findall('.//gpx:trkpt', ns):
-            lat = float(trkpt.get('lat'))
-            lon = float(trkpt.get('lon'))
-            ele_elem = trkpt.find('gpx:ele', ns)
-            ele = float(ele_elem.text) if ele_elem is not None else None
-            time_elem = trkpt.find('gpx:time', ns)
-            time_str = time_elem.text if time_elem is not None else None
-            
-            points.append({
-                'lat': lat,
-                'lon': lon,
-                'ele': ele,
-                'time': time_str
-            })
+        # Stream-parse straight from the upload instead of building the whole tree
+        points = [{'lat': p['lat'], 'lon': p['lon'], 'ele': p['ele'], 'time': p['time']}
+                  for p in iter_gpx_points(file.stream)]
         
         if not points:
             return jsonify({'error': 'No trackpoints found in GPX file'}), 400
@@ -3161,61 +3773,250 @@ def api_upload_gpx():
         print(f"Error uploading GPX: {e}")
         return jsonify({'error': str(e)}), 500
 
-def calculate_ride_stats(gps_points):
-    """Calculate ride statistics from GPS points"""
-    from math import radians, sin, cos, sqrt, atan2
-    
-    def haversine(lat1, lon1, lat2, lon2):
-        """Calculate distance between two GPS coordinates in kilometers"""
-        R = 6371  # Earth radius in km
-        lat1_rad = radians(lat1)
-        lat2_rad = radians(lat2)
-        delta_lat = radians(lat2 - lat1)
-        delta_lon = radians(lon2 - lon1)
-        
-        a = sin(delta_lat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lon/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1-a))
-        return R * c * 1000  # Return in meters
+@app.route('/api/ride/import-gpx', methods=['POST'])
+def api_import_gpx():
+    """Import a GPX file as a finished ride in one server-side pass"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
     
-    total_distance = 0  # in meters
-    top_speed = 0
-    speeds = []
+    file = request.files.get('gpx_file')
+    if not file or not file.filename:
+        return jsonify({'error': 'No GPX file provided'}), 400
+    if not file.filename.lower().endswith('.gpx'):
+        return jsonify({'error': 'File must be a GPX file'}), 400
     
-    for i in range(len(gps_points) - 1):
-        current = gps_points[i]
-        next_point = gps_points[i + 1]
-        
-        # Calculate distance
-        dist = haversine(current['latitude'], current['longitude'],
-                         next_point['latitude'], next_point['longitude'])
-        total_distance += dist
-        
-        # Track speeds
-        speed = current['speed'] if current['speed'] else 0
-        speeds.append(speed)
-        if speed > top_speed:
-            top_speed = speed
-    
-    # Calculate time in seconds
-    if len(gps_points) >= 2:
-        first_time = gps_points[0]['timestamp']
-        last_time = gps_points[-1]['timestamp']
-        total_time = max(1, last_time - first_time)  # Avoid division by zero
-    else:
-        total_time = 1
+    bike_id = request.form.get('bike_id', type=int)
+    if bike_id:
+        bike = query_db(sql.BIKE_OWNER, (bike_id,), one=True)
+        if not bike or bike['user_id'] != session['user_id']:
+            return jsonify({'error': 'Bike not found'}), 404
+    title = (request.form.get('title') or '').strip() or None
+    is_public = request.form.get('public', '1') in ('1', 'true')
     
-    # Calculate average speed (km/h)
-    distance_km = total_distance / 1000
-    time_hours = total_time / 3600
-    avg_speed = distance_km / time_hours if time_hours > 0 else 0
+    description = request.form.get('description', '')
     
-    return {
-        'distance': round(distance_km, 2),
-        'time': total_time,
-        'top_speed': round(top_speed, 2),
-        'avg_speed': round(avg_speed, 2)
-    }
+    try:
+        meta = {}
+        track = read_gpx_track(file.stream, meta)
+        if title:
+            meta['name'] = title
+        ride = prepare_ride(file.filename, track, meta)
+        inserted, duplicates = save_imported_rides(get_db(), session['user_id'], [ride], bike_id=bike_id or None,
+                                                   public=is_public, description=description)
+    except ET.ParseError as e:
+        return jsonify({'error': f'Invalid GPX file: {e}'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error importing GPX: {e}")
+        return jsonify({'error': str(e)}), 500
+    
+    if duplicates:
+        ride_id = duplicates[0][1]
+        return jsonify({
+            'error': 'This track has already been imported',
+            'ride_id': ride_id,
+            'url': url_for('view_ride', ride_id=ride_id)
+        }), 409
+    
+    ride_id = inserted[0][1]
+    return jsonify({
+        'success': True,
+        'ride_id': ride_id,
+        'stats': ride['stats'],
+        'url': url_for('view_ride', ride_id=ride_id)
+    })
+
+# ======== BULK RIDE IMPORT ========
+
+IMPORT_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+IMPORT_BATCH_SIZE = 50       # rides written per transaction
+IMPORT_MAX_ERRORS = 100      # per-file errors kept on the job row
+IMPORT_MAX_ARCHIVE_BYTES = 2 * 1024 * 1024 * 1024
+
+def update_import_job(conn, job_id, **fields):
+    """Set columns of an import_jobs row (and bump updated_at) in its own transaction"""
+    params = {name: fields.pop(name, None) for name in sql.IMPORT_JOB_FIELDS}
+    if fields:
+        raise TypeError(f'Unknown import job fields: {", ".join(fields)}')
+    with conn:
+        execute_query(conn, sql.IMPORT_JOB_UPDATE, {**params, 'id': job_id})
+
+@job_handler('ride_import')
+def run_import_job(conn, job):
+    """
+    Body of an archive import, run by the job worker: members are parsed in a process pool
+    (CPU-bound XML/FIT decoding, stats and packing) and their results taken in archive
+    order, every IMPORT_BATCH_SIZE members written in one transaction together with the
+    import's counters and the job's cursor (members done). A job taken over after a
+    restart resumes after the last batch written.
+    """
+    payload = job['payload']
+    job_id, user_id, archive_path = payload['import_id'], payload['user_id'], payload['archive_path']
+    row = run_query(conn, sql.IMPORT_JOB_BY_ID, (job_id,), one=True)
+    counts = {name: row[name] for name in ('processed', 'imported', 'duplicates', 'failed')}
+    errors = json.loads(row['errors'] or '[]')
+    pending = []
+    
+    def flush():
+        with conn.transaction():
+            inserted, duplicates = save_imported_rides(conn, user_id, pending,
+                                                       bike_id=payload['bike_id'], public=payload['public'])
+            counts['imported'] += len(inserted)
+            counts['duplicates'] += len(duplicates)
+            update_import_job(conn, job_id, errors=json.dumps(errors), **counts)
+            advance_job(conn, job, counts['processed'])
+        pending.clear()
+    
+    try:
+        members = archive_members(archive_path)
+        update_import_job(conn, job_id, status='running', total=len(members))
+        # spawn: forking a threaded server process can copy held locks into the children
+        with ProcessPoolExecutor(max_workers=IMPORT_WORKERS,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            remaining = iter(members[job['cursor']:])
+            in_flight = deque()
+            while True:
+                # Keep a bounded number of members in flight so results never pile up in memory
+                for member in remaining:
+                    in_flight.append(pool.submit(parse_archive_member, archive_path, member))
+                    if len(in_flight) >= IMPORT_WORKERS * 4:
+                        break
+                if not in_flight:
+                    break
+                result = in_flight.popleft().result()
+                counts['processed'] += 1
+                if 'ride' in result:
+                    pending.append(result['ride'])
+                else:
+                    counts['failed'] += 1
+                    if len(errors) < IMPORT_MAX_ERRORS:
+                        errors.append({'file': result['name'], 'error': result['error']})
+                if counts['processed'] % IMPORT_BATCH_SIZE == 0:
+                    flush()
+        flush()
+        update_import_job(conn, job_id, status='done', finished_at=datetime.now().isoformat())
+    except Exception as e:
+        # Not retried: a broken or missing archive fails the same way every time
+        print(f"Import job {job_id} failed: {e}")
+        errors.append({'file': None, 'error': str(e)})
+        try:
+            update_import_job(conn, job_id, status='failed', errors=json.dumps(errors),
+                              finished_at=datetime.now().isoformat(), **counts)
+        except sqlite3.Error:
+            pass
+    try:
+        os.remove(archive_path)
+    except OSError:
+        pass
 
+@app.route('/api/import/archive', methods=['POST'])
+def api_import_archive():
+    """Start a background import of a zip of GPX / TCX / FIT files (e.g. a Strava or Garmin export)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    file = request.files.get('archive')
+    if not file or not file.filename:
+        return jsonify({'error': 'No archive provided'}), 400
+    
+    bike_id = request.form.get('bike_id', type=int)
+    if bike_id:
+        bike = query_db(sql.BIKE_OWNER, (bike_id,), one=True)
+        if not bike or bike['user_id'] != session['user_id']:
+            return jsonify({'error': 'Bike not found'}), 404
+    is_public = 1 if request.form.get('public', '1') in ('1', 'true') else 0
+    
+    # Workers open the archive by path, so spool the upload to disk first
+    fd, archive_path = tempfile.mkstemp(prefix='moto_import_', suffix='.zip')
+    with os.fdopen(fd, 'wb') as out:
+        file.save(out)
+    if os.path.getsize(archive_path) > IMPORT_MAX_ARCHIVE_BYTES or not zipfile.is_zipfile(archive_path):
+        os.remove(archive_path)
+        return jsonify({'error': 'File must be a zip archive'}), 400
+    try:
+        if not archive_members(archive_path):
+            os.remove(archive_path)
+            return jsonify({'error': 'No GPX, TCX or FIT files found in archive'}), 400
+    except zipfile.BadZipFile as e:
+        os.remove(archive_path)
+        return jsonify({'error': f'Invalid zip archive: {e}'}), 400
+    
+    # The import runs on the persistent job queue, so a restart resumes it instead of
+    # leaving the import_jobs row running forever
+    db = get_db()
+    with db.transaction():
+        cur = execute_query(db, sql.IMPORT_JOB_INSERT, (session['user_id'], bike_id or None, is_public, secure_filename(file.filename)))
+        job_id = cur.lastrowid
+        enqueue_job('ride_import', {'import_id': job_id, 'user_id': session['user_id'], 'archive_path': archive_path,
+                                    'bike_id': bike_id or None, 'public': is_public})
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('api_import_status', job_id=job_id)
+    }), 202
+
+@app.route('/api/import/<int:job_id>')
+def api_import_status(job_id):
+    """Progress of a bulk import job"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    job = query_db(sql.IMPORT_JOB_BY_ID, (job_id,), one=True)
+    if not job or job['user_id'] != session['user_id']:
+        return jsonify({'error': 'Import job not found'}), 404
+    
+    total = job['total']
+    resp = jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'total': total,
+        'processed': job['processed'],
+        'imported': job['imported'],
+        'duplicates': job['duplicates'],
+        'failed': job['failed'],
+        'progress': round(100.0 * job['processed'] / total, 1) if total else 0.0,
+        'errors': json.loads(job['errors'] or '[]'),
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+        'finished_at': job['finished_at']
+    })
+    resp.cache_control.no_store = True
+    return resp
+
+# ======== DIAGNOSTICS ========
+
+@app.route('/api/debug/db-pool')
+def debug_db_pool():
+    """Connection pool hit/miss and wait-time stats (JSON)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    return jsonify(db_pool.stats())
+
+@app.route('/api/debug/queries')
+def debug_queries():
+    """Per-query call counts, rows and timings, slowest total first, and commit counts (JSON)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    return jsonify({
+        'statement_cache': DB_STATEMENT_CACHE,
+        'registered': len(sql.QUERIES),
+        'commits': query_stats.commits(),
+        'queries': query_stats.snapshot(),
+    })
+
+@app.route('/api/debug/jobs')
+def debug_jobs():
+    """Background job counts by status (JSON)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    counts = {row['status']: row['c'] for row in query_db(sql.JOB_COUNTS)}
+    return jsonify({'worker': job_worker.running, 'jobs': counts})
 
 if __name__ == '__main__':
+    # The reloader's watcher process only restarts the server; the worker belongs in the
+    # process that serves
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_job_worker()
     app.run(debug=True, host='127.0.0.1', port=5000)
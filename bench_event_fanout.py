@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark: notifying users about a new global event, synchronously in the request (one
+create_notification call, i.e. one commit, per user), queued for the job worker
+(batched executemany inserts, still one row per user) and as a broadcast
+(app.publish_broadcast, one row merged into everyone's notifications at read time).
+
+Builds a throwaway database with the app's schema (migrations.py) and N users, then
+reports what the request pays, how long the worker takes, the rows each way writes,
+and what reading a user's unread notifications and badge count costs afterwards.
+
+Run: python bench_event_fanout.py [users...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO)
+
+from migrations import apply_migrations
+
+DEFAULT_USERS = [500, 5_000]
+
+
+def add_users(conn, n):
+    start = conn.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]
+    conn.executemany("INSERT INTO users (username, email, password, country) VALUES (?, ?, 'x', 'Bulgaria')",
+                     [(f'rider{i}', f'rider{i}@example.com') for i in range(start + 1, start + n + 1)])
+    conn.commit()
+
+
+def add_event(conn, creator_id, title):
+    cur = conn.execute('''
+        INSERT INTO events (creator_id, title, description, event_date, location_name, city, category,
+                            is_local, status, created_at, updated_at)
+        VALUES (?, ?, 'bench', '2030-01-01T10:00', 'square', 'Sofia', 'other', 0, 'upcoming',
+                datetime('now'), datetime('now'))
+    ''', (creator_id, title))
+    conn.commit()
+    return cur.lastrowid
+
+
+def legacy_fan_out(app_module, actor_id, event_id, message):
+    """The original loop of app.create_event() for a global event, without its 500-user cap"""
+    query_db = app_module.query_db
+    last_id = 0
+    while True:
+        users = query_db('SELECT id FROM users WHERE id != ? AND id > ? ORDER BY id LIMIT ?', (actor_id, last_id, 1000))
+        if not users:
+            return
+        for user in users:
+            app_module.create_notification(user_id=user['id'], notif_type='event_created', actor_id=actor_id,
+                                           event_id=event_id, message=message)
+        last_id = users[-1]['id']
+
+
+def commits(app_module):
+    return app_module.query_stats.commits()['count']
+
+
+def queued_fan_out(app_module, actor_id, event_id, message):
+    """The job-queue fan-out that global events used before broadcasts (city events still use it)"""
+    app_module.enqueue_job('event_notifications', {'event_id': event_id, 'actor_id': actor_id,
+                                                   'city': 'Sofia', 'message': message})
+
+
+def read_cost(client, rounds=20):
+    """Average ms for one user to load the notifications page and the badge count"""
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        assert client.get('/notifications').status_code == 200
+        assert client.get('/api/notifications/count').status_code == 200
+    return (time.perf_counter() - t0) / rounds * 1000
+
+
+def run(sizes):
+    workdir = tempfile.mkdtemp()
+    apply_migrations(os.path.join(workdir, 'moto_log.db'))
+    os.chdir(workdir)  # app.DATABASE is relative to the working directory
+    os.environ['JOB_WORKER'] = '0'  # jobs are run here, in the foreground, to time them
+
+    import app as app_module
+    print(f"{'users':>7} {'way':>10} {'request (ms)':>13} {'worker (ms)':>12} {'commits':>8}"
+          f" {'rows':>7} {'read (ms)':>10}")
+    client = app_module.app.test_client()
+    with app_module.app.test_request_context():
+        conn = app_module.get_db()
+        for n in sizes:
+            users_now = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+            add_users(conn, n + 1 - users_now)
+            conn.execute("UPDATE users SET city = 'Sofia'")
+            conn.commit()
+            actor_id, reader_id = [r[0] for r in conn.execute('SELECT id FROM users ORDER BY id LIMIT 2')]
+            with client.session_transaction() as s:
+                s['user_id'] = reader_id
+
+            ways = [
+                ('sync', legacy_fan_out, 'notifications'),
+                ('queued', queued_fan_out, 'notifications'),
+                ('broadcast', lambda app_module, actor_id, event_id, message:
+                    app_module.publish_broadcast('global_event', actor_id=actor_id, event_id=event_id, message=message),
+                 'broadcasts'),
+            ]
+            for name, notify, table in ways:
+                event_id = add_event(conn, actor_id, f'{name} {n}')
+                before = commits(app_module)
+                t0 = time.perf_counter()
+                notify(app_module, actor_id, event_id, 'New global event')
+                t_request = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                while app_module.job_worker.run_next():
+                    pass
+                t_worker = time.perf_counter() - t0
+                c = commits(app_module) - before
+                rows = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE event_id = ?', (event_id,)).fetchone()[0]
+                print(f'{n:>7} {name:>10} {t_request * 1000:>13.2f} {t_worker * 1000:>12.1f} {c:>8}'
+                      f' {rows:>7} {read_cost(client):>10.2f}')
+                assert client.get('/api/notifications/count').get_json()['count'] >= 1
+                client.post('/api/notifications/mark-all-read')
+
+
+if __name__ == '__main__':
+    run([int(a) for a in sys.argv[1:]] or DEFAULT_USERS)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /messages inbox built from two set-based queries (app.inbox_conversations)
+vs the old per-conversation lookups.
+
+Builds a throwaway database with the schema of moto_log.db, the indexes from
+migrate_add_indexes.py and the unread counters, gives one user 500 direct conversations plus a set of
+groups, then times both versions and counts the SQL statements each one runs.
+The two versions must return the same inbox.
+
+Run: python bench_messages_inbox.py [conversations] [messages_per_conversation] [groups]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO)
+
+from migrate_add_indexes import INDEXES
+from migrate_add_unread_counters import install as install_unread_counters, rebuild_counters
+
+DEFAULT_CONVERSATIONS = 500
+DEFAULT_MESSAGES = 20
+DEFAULT_GROUPS = 50
+RUNS = 5
+
+
+def build_database(path, conversations, per_conversation, groups):
+    """Create the app schema in a fresh database and fill it for user 1"""
+    source = sqlite3.connect(f"file:{os.path.join(REPO, 'moto_log.db')}?mode=ro&immutable=1", uri=True)
+    schema = [row[0] for row in source.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND sql IS NOT NULL")]
+    source.close()
+
+    conn = sqlite3.connect(path)
+    for sql in schema:
+        conn.execute(sql)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for name, table, columns in INDEXES:
+        if table in tables:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+
+    rng = random.Random(7)
+    uid = 1
+    conn.executemany('INSERT INTO users (id, username, email, password, country) VALUES (?, ?, ?, ?, ?)',
+                     [(i, f'rider{i}', f'rider{i}@example.com', 'x', 'Bulgaria') for i in range(1, conversations + 2)])
+
+    rows = []
+    for other in range(2, conversations + 2):
+        for k in range(per_conversation):
+            incoming = rng.random() < 0.5
+            sender, recipient = (other, uid) if incoming else (uid, other)
+            is_read = 0 if incoming and rng.random() < 0.2 else 1
+            created = f'2026-01-{1 + k % 28:02d} {rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}'
+            rows.append((sender, recipient, f'message {k}', created, is_read))
+    conn.executemany('INSERT INTO messages (sender_id, recipient_id, content, created_at, is_read) VALUES (?, ?, ?, ?, ?)', rows)
+
+    rows = []
+    for gid in range(1, groups + 1):
+        conn.execute('INSERT INTO groups (id, name, owner_id) VALUES (?, ?, ?)', (gid, f'group {gid}', uid))
+        members = [uid] + rng.sample(range(2, conversations + 2), min(5, conversations))
+        conn.executemany('INSERT INTO group_members (group_id, user_id, last_read) VALUES (?, ?, ?)',
+                         [(gid, m, '2026-01-15 00:00:00') for m in members])
+        for k in range(per_conversation):
+            sender = rng.choice(members + [0])
+            created = f'2026-01-{1 + k % 28:02d} {rng.randrange(24):02d}:{rng.randrange(60):02d}:00'
+            rows.append((gid, sender, f'group message {k}', created))
+    conn.executemany('INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, ?)', rows)
+    install_unread_counters(conn)
+    conn.commit()
+    rebuild_counters(conn)
+    conn.close()
+    return uid
+
+
+def legacy_inbox(app_module, uid):
+    """The pre-change body of app.messages(): one query per conversation and per group"""
+    query_db = app_module.query_db
+    conversations = query_db('''
+        SELECT DISTINCT
+            CASE WHEN sender_id = ? THEN recipient_id ELSE sender_id END as other_user_id,
+            MAX(created_at) as last_msg_time
+        FROM messages
+        WHERE sender_id = ? OR recipient_id = ?
+        GROUP BY other_user_id
+        ORDER BY last_msg_time DESC
+    ''', (uid, uid, uid))
+    all_convs = []
+    for conv in conversations:
+        other_id = conv['other_user_id']
+        other_user = query_db('SELECT id, username, profile_pic FROM users WHERE id = ?', (other_id,), one=True)
+        unread = query_db('SELECT COUNT(*) as c FROM messages WHERE sender_id = ? AND recipient_id = ? AND is_read = 0',
+                          (other_id, uid), one=True)['c']
+        all_convs.append({'type': 'user', 'unread': unread, 'last_time': conv['last_msg_time'], 'id': other_user['id'],
+                          'name': other_user['username'], 'profile_pic': other_user['profile_pic']})
+
+    groups = query_db('''
+        SELECT g.id, g.name, g.profile_pic, MAX(gm.created_at) AS last_msg_time
+        FROM groups g
+        JOIN group_members gmbr ON g.id = gmbr.group_id
+        LEFT JOIN group_messages gm ON g.id = gm.group_id
+        WHERE gmbr.user_id = ?
+        GROUP BY g.id
+        ORDER BY last_msg_time DESC
+    ''', (uid,))
+    for g in groups:
+        last_read = query_db('SELECT last_read FROM group_members WHERE group_id = ? AND user_id = ?', (g['id'], uid), one=True)
+        last_read_time = last_read['last_read'] if last_read and last_read['last_read'] else '1900-01-01'
+        unread = query_db('SELECT COUNT(*) as c FROM group_messages WHERE group_id = ? AND sender_id != 0 AND sender_id != ? AND created_at > ?',
+                          (g['id'], uid, last_read_time), one=True)['c']
+        all_convs.append({'type': 'group', 'unread': unread, 'last_time': g['last_msg_time'], 'id': g['id'],
+                          'name': g['name'], 'profile_pic': g['profile_pic']})
+
+    all_convs.sort(key=lambda c: c['last_time'] or '1900-01-01', reverse=True)
+    return all_convs
+
+
+def measure(fn, conn):
+    """Best-of-RUNS wall time and the number of SQL statements one call executes"""
+    statements = []
+    conn.set_trace_callback(lambda sql: statements.append(sql) if sql.lstrip().upper().startswith('SELECT') else None)
+    result = fn()
+    conn.set_trace_callback(None)
+    best = float('inf')
+    for _ in range(RUNS):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return result, best, len(statements)
+
+
+def run(conversations, per_conversation, groups):
+    workdir = tempfile.mkdtemp()
+    uid = build_database(os.path.join(workdir, 'moto_log.db'), conversations, per_conversation, groups)
+    os.chdir(workdir)  # app.DATABASE is relative to the working directory
+
+    import app as app_module
+    with app_module.app.app_context():
+        conn = app_module.get_db()
+        old, t_old, q_old = measure(lambda: legacy_inbox(app_module, uid), conn)
+        new, t_new, q_new = measure(lambda: app_module.inbox_conversations(uid), conn)
+
+    key = lambda c: (c['type'], c['id'])
+    assert sorted(old, key=key) == sorted(new, key=key), 'inbox contents differ'
+    assert [c['last_time'] for c in old] == [c['last_time'] for c in new], 'inbox order differs'
+
+    print(f'{conversations} conversations x {per_conversation} messages, {groups} groups')
+    print(f"{'version':>10} {'queries':>8} {'time (ms)':>10}")
+    print(f"{'legacy':>10} {q_old:>8} {t_old * 1000:>10.1f}")
+    print(f"{'set-based':>10} {q_new:>8} {t_new * 1000:>10.1f}")
+    print(f'speedup: {t_old / t_new:.1f}x')
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    run(*(args + [DEFAULT_CONVERSATIONS, DEFAULT_MESSAGES, DEFAULT_GROUPS][len(args):]))
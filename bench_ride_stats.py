@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark: vectorized ride stats (ride_stats.py) vs the old per-point Python loop.
+
+Generates synthetic tracks of 10k / 100k / 1M points, times both implementations
+and checks that the distances agree within the documented tolerance.
+
+Run: python bench_ride_stats.py [sizes...]
+"""
+
+import sys
+import time
+from math import radians, sin, cos, sqrt, atan2
+
+import numpy as np
+
+from ride_stats import compute_ride_stats, haversine_m, track_arrays
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+REL_TOLERANCE = 1e-9
+
+
+def legacy_distance_m(points):
+    """The original per-segment haversine loop from app.calculate_ride_stats"""
+    def haversine(lat1, lon1, lat2, lon2):
+        R = 6371
+        lat1_rad = radians(lat1)
+        lat2_rad = radians(lat2)
+        delta_lat = radians(lat2 - lat1)
+        delta_lon = radians(lon2 - lon1)
+        a = sin(delta_lat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lon/2)**2
+        c = 2 * atan2(sqrt(a), sqrt(1-a))
+        return R * c * 1000
+
+    total = 0
+    for i in range(len(points) - 1):
+        total += haversine(points[i]['latitude'], points[i]['longitude'],
+                           points[i + 1]['latitude'], points[i + 1]['longitude'])
+    return total
+
+
+def synthetic_track(n, seed=42):
+    """A wandering 1 Hz track around Sofia with some stops and altitude changes"""
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.05, n))
+    speed_kmh = np.clip(rng.normal(45, 20, n), 0, 140)
+    speed_kmh[rng.random(n) < 0.05] = 0  # occasional stops
+    step_m = speed_kmh / 3.6
+    lat = 42.6955 + np.cumsum(step_m * np.cos(heading)) / 111_320
+    lon = 23.3322 + np.cumsum(step_m * np.sin(heading)) / (111_320 * np.cos(np.radians(42.7)))
+    altitude = 550 + np.cumsum(rng.normal(0, 0.5, n))
+    timestamp = 1_700_000_000 + np.arange(n)
+    return [
+        {'latitude': float(a), 'longitude': float(b), 'speed': float(s), 'altitude': float(h), 'timestamp': int(t)}
+        for a, b, s, h, t in zip(lat, lon, speed_kmh, altitude, timestamp)
+    ]
+
+
+def run(sizes):
+    print(f"{'points':>10} {'loop (s)':>10} {'to array (s)':>13} {'numpy (s)':>10} {'speedup':>8} {'rel diff':>10}")
+    for n in sizes:
+        points = synthetic_track(n)
+
+        t0 = time.perf_counter()
+        legacy = legacy_distance_m(points)
+        t_loop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        track = track_arrays(points)
+        t_convert = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        stats = compute_ride_stats(track['latitude'], track['longitude'], track['timestamp'],
+                                   speed=track['speed'], altitude=track['altitude'])
+        t_numpy = time.perf_counter() - t0
+
+        # Compare unrounded distances
+        vectorized = float(np.nansum(haversine_m(track['latitude'][:-1], track['longitude'][:-1],
+                                                 track['latitude'][1:], track['longitude'][1:])))
+        rel = abs(vectorized - legacy) / legacy if legacy else 0.0
+        assert rel <= REL_TOLERANCE, f'distance mismatch for {n} points: {rel:.3e}'
+        assert round(legacy / 1000, 2) == stats['distance']
+
+        print(f"{n:>10} {t_loop:>10.3f} {t_convert:>13.3f} {t_numpy:>10.3f} {t_loop / t_numpy:>7.1f}x {rel:>10.1e}")
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or DEFAULT_SIZES
+    run(sizes)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark: SQLite prepared-statement cache size on a long-lived connection running the
+queries registered in queries.py.
+
+sqlite3 keeps the last cached_statements prepared statements per connection, keyed on
+the SQL text. A request touches a few dozen of the registered queries and a pooled
+connection serves all of them, so a cache smaller than the registry keeps evicting
+statements that are about to be needed again and re-parses and re-plans them.
+
+Each cache size runs every read query of the registry round-robin on one connection,
+like a pooled connection serving many requests. Every parameter is bound to 1 on an
+empty database, so the time is dominated by preparing rather than by reading rows.
+
+Run: python bench_statement_cache.py [rounds]
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO)
+
+import queries
+from migrations import apply_migrations
+
+DEFAULT_ROUNDS = 200
+# No cache, a cache well under the registry, sqlite3's default and app.DB_STATEMENT_CACHE's default
+CACHE_SIZES = [0, 32, 128, len(queries.QUERIES) + 64]
+
+
+def params_for(sql):
+    """1 for every parameter, positional or :named (NULL would not do for LIMIT)"""
+    names = re.findall(r':(\w+)', sql)
+    return dict.fromkeys(names, 1) if names else [1] * sql.count('?')
+
+
+def read_queries():
+    """(name, sql, params) for every registered query that only reads"""
+    return [(name, sql, params_for(sql)) for name, sql in queries.QUERIES.items()
+            if sql.strip().upper().startswith(('SELECT', 'WITH'))]
+
+
+def run(db_path, cache_size, statements, rounds):
+    conn = sqlite3.connect(db_path, cached_statements=cache_size)
+    for _, sql, params in statements:  # warm-up: page cache, schema
+        conn.execute(sql, params).fetchall()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _, sql, params in statements:
+            conn.execute(sql, params).fetchall()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+
+def main(rounds):
+    statements = read_queries()
+    with tempfile.TemporaryDirectory() as work:
+        db_path = os.path.join(work, 'bench.db')
+        apply_migrations(db_path)
+        print(f'{len(statements)} registered read queries, {rounds} rounds')
+        print(f"{'cache':>6} {'total (s)':>10} {'us/query':>9} {'speedup':>8}")
+        baseline = None
+        for size in CACHE_SIZES:
+            elapsed = run(db_path, size, statements, rounds)
+            baseline = baseline or elapsed
+            per_query = elapsed / (rounds * len(statements)) * 1e6
+            print(f'{size:>6} {elapsed:>10.3f} {per_query:>9.1f} {baseline / elapsed:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROUNDS)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: GPS outlier rejection (track_filter.py) on synthetic 1 Hz tracks.
+
+Each track gets isolated spikes (one bad fix), a bad start (the first fixes far away)
+and a tunnel exit (a few consecutive bad fixes). Reports how long filter_track takes,
+how many injected outliers it caught, how many clean points it dropped, and the
+distance / top speed before and after.
+
+Run: python bench_track_filter.py [sizes...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from ride_stats import compute_ride_stats
+from track_filter import filter_track
+
+DEFAULT_SIZES = [3_600, 36_000, 360_000, 1_000_000]
+SPIKES_PER_HOUR = 20
+
+
+def synthetic_track(n, seed=42):
+    """A wandering 1 Hz track around Sofia with stops, 3 m position noise and injected outliers"""
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0, 0.05, n))
+    speed_kmh = np.clip(rng.normal(60, 20, n), 0, 160)
+    speed_kmh[(np.arange(n) // 600) % 10 == 0] = 0  # a one-minute stop every ten
+    step_m = speed_kmh / 3.6
+    lat = 42.6955 + (np.cumsum(step_m * np.cos(heading)) + rng.normal(0, 3, n)) / 111_320
+    lon = 23.3322 + (np.cumsum(step_m * np.sin(heading)) + rng.normal(0, 3, n)) / (111_320 * np.cos(np.radians(42.7)))
+    track = {
+        'latitude': lat,
+        'longitude': lon,
+        'speed': speed_kmh.copy(),
+        'altitude': 550 + np.cumsum(rng.normal(0, 0.5, n)),
+        'timestamp': 1_700_000_000 + np.arange(n, dtype=np.float64),
+    }
+    clean = {c: v.copy() for c, v in track.items()}
+
+    bad = np.zeros(n, dtype=bool)
+    spikes = rng.choice(np.arange(10, n - 10), max(1, n * SPIKES_PER_HOUR // 3600), replace=False)
+    track['latitude'][spikes] += rng.choice([-1, 1], len(spikes)) * rng.uniform(0.002, 0.05, len(spikes))
+    track['speed'][spikes[::4]] = 999
+    bad[spikes] = True
+    track['latitude'][:3] += 0.3  # bad start
+    bad[:3] = True
+    tunnel = n // 2
+    track['longitude'][tunnel:tunnel + 4] += 0.04  # re-acquiring after a tunnel
+    bad[tunnel:tunnel + 4] = True
+    return clean, track, bad
+
+
+def ride_stats(track):
+    return compute_ride_stats(track['latitude'], track['longitude'], track['timestamp'],
+                              speed=track['speed'], altitude=track['altitude'])
+
+
+def run(sizes):
+    print(f"{'points':>10} {'filter (ms)':>12} {'outliers':>9} {'caught':>7} {'clean lost':>11}"
+          f" {'km clean':>9} {'km noisy':>9} {'km filtered':>12} {'top km/h':>9}")
+    for n in sizes:
+        clean, noisy, bad = synthetic_track(n)
+
+        filter_track(noisy)  # warm-up
+        t0 = time.perf_counter()
+        filtered, rejected = filter_track(noisy)
+        t_filter = time.perf_counter() - t0
+
+        # Which points survived: timestamps are unique, so match on them
+        kept = np.isin(noisy['timestamp'], filtered['timestamp'])
+        caught = int((bad & ~kept).sum())
+        lost = int((~bad & ~kept).sum())
+        assert rejected == caught + lost
+
+        before, after, reference = ride_stats(noisy), ride_stats(filtered), ride_stats(clean)
+        print(f"{n:>10} {t_filter * 1000:>12.1f} {int(bad.sum()):>9} {caught:>7} {lost:>11}"
+              f" {reference['distance']:>9.2f} {before['distance']:>9.2f} {after['distance']:>12.2f}"
+              f" {before['top_speed']:>4.0f}->{after['top_speed']:<4.0f}")
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or DEFAULT_SIZES
+    run(sizes)
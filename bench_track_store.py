@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark: packed ride_tracks blobs (track_store.py) vs gps_points rows.
+
+Loads synthetic 1 Hz tracks into a scratch database both ways and reports the bytes
+per point each layout takes on disk (including the gps_points index) and how long it
+takes to read a ride back as NumPy arrays. Also checks the round-trip error stays
+inside the fixed-point resolution.
+
+Run: python bench_track_store.py [sizes...]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench_ride_stats import synthetic_track
+from migrate_add_ride_tracks import install
+from ride_stats import track_arrays
+from track_store import COLUMNS, SCALES, decode_track, encode_track, load_ride_track, pack_ride_points
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def db_bytes(conn, table):
+    """Bytes used by a table and its indexes, from the dbstat virtual table when available"""
+    try:
+        return conn.execute('''
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name = ? OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?)
+        ''', (table, table)).fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return None
+
+
+def run(sizes):
+    workdir = tempfile.mkdtemp()
+    conn = sqlite3.connect(os.path.join(workdir, 'bench.db'))
+    conn.execute('''
+        CREATE TABLE gps_points (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, ride_id INTEGER NOT NULL,
+            latitude REAL, longitude REAL, speed REAL, altitude REAL, timestamp INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_gps_points_ride_ts ON gps_points(ride_id, timestamp)')
+    install(conn)
+    conn.commit()
+
+    print(f"{'points':>8} {'rows B/pt':>10} {'blob B/pt':>10} {'rows read (s)':>14} {'blob read (s)':>14} {'max err':>10}")
+    for ride_id, n in enumerate(sizes, start=1):
+        points = synthetic_track(n, seed=ride_id)
+        with conn:
+            conn.execute('DELETE FROM gps_points')
+            conn.execute('DELETE FROM ride_tracks')
+            conn.executemany('''
+                INSERT INTO gps_points (ride_id, latitude, longitude, speed, altitude, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(ride_id, p['latitude'], p['longitude'], p['speed'], p['altitude'], p['timestamp']) for p in points])
+        rows_size = db_bytes(conn, 'gps_points')
+
+        start = time.perf_counter()
+        rows_track = load_ride_track(conn, ride_id)
+        rows_read = time.perf_counter() - start
+
+        pack_ride_points(conn, ride_id)
+        blob_size = conn.execute('SELECT length(data) FROM ride_tracks WHERE ride_id = ?', (ride_id,)).fetchone()[0]
+
+        start = time.perf_counter()
+        blob_track = load_ride_track(conn, ride_id)
+        blob_read = time.perf_counter() - start
+
+        # Worst error relative to each column's resolution; <= 0.5 means exact to the stored precision
+        err = max(float(np.nanmax(np.abs(rows_track[c] - blob_track[c]))) * SCALES[c] for c in COLUMNS)
+        assert err <= 0.5 + 1e-6, f'round-trip error {err} exceeds the fixed-point resolution'
+
+        rows_bpp = f'{rows_size / n:.1f}' if rows_size is not None else 'n/a'
+        print(f'{n:>8} {rows_bpp:>10} {blob_size / n:>10.1f} {rows_read:>14.4f} {blob_read:>14.4f} {err:>10.3f}')
+
+    # Encoder / decoder alone, without SQLite
+    track = track_arrays(synthetic_track(max(sizes)))
+    start = time.perf_counter()
+    blob = encode_track(track)
+    encode_s = time.perf_counter() - start
+    start = time.perf_counter()
+    decode_track(blob)
+    decode_s = time.perf_counter() - start
+    print(f'\nencode {max(sizes)} points: {encode_s:.4f}s, decode: {decode_s:.4f}s')
+    conn.close()
+
+
+if __name__ == '__main__':
+    run([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES)
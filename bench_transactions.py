@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Benchmark: multi-statement handlers as one unit of work (db.transaction()) vs one
+commit per query_db call.
+
+Builds a throwaway database with the app's schema (migrations.py) and runs three user
+actions both ways on fresh data each time:
+
+    delete account  a rider with rides, owned groups, memberships and messages
+    create group    a group with the owner and N members
+    delete ride     a ride with likes and comments
+
+The legacy versions are the pre-change handler bodies; the new ones are the
+statements the handlers now run inside `with db.transaction():`. Commits are counted
+by the app's own counter (query_stats.commits()), and the end state of both versions
+must be the same.
+
+Run: python bench_transactions.py [rides] [groups] [members]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO)
+
+from migrations import apply_migrations
+
+DEFAULT_RIDES = 50
+DEFAULT_GROUPS = 10
+DEFAULT_MEMBERS = 20
+RUNS = 5
+
+
+def seed_rider(conn, rides, groups, members):
+    """A rider with rides (liked and commented on), owned groups, follows and messages; returns (user id, member ids)"""
+    cur = conn.execute("INSERT INTO users (username, email, password, country) VALUES ('rider', ?, 'x', 'Bulgaria')",
+                       (f'rider{time.perf_counter_ns()}@example.com',))
+    uid = cur.lastrowid
+    others = []
+    for i in range(members):
+        others.append(conn.execute("INSERT INTO users (username, email, password, country) VALUES (?, ?, 'x', 'Bulgaria')",
+                                   (f'friend{i}', f'friend{i}.{time.perf_counter_ns()}@example.com')).lastrowid)
+    for i in range(rides):
+        ride_id = conn.execute("INSERT INTO rides (user_id, date, distance, time, public) VALUES (?, date('now'), 10, 600, 1)",
+                               (uid,)).lastrowid
+        conn.executemany('INSERT INTO likes (user_id, ride_id) VALUES (?, ?)', [(o, ride_id) for o in others[:3]])
+        conn.executemany("INSERT INTO comments (user_id, ride_id, content) VALUES (?, ?, 'nice')", [(o, ride_id) for o in others[:2]])
+    for i in range(groups):
+        gid = conn.execute('INSERT INTO groups (name, owner_id) VALUES (?, ?)', (f'group {i}', uid)).lastrowid
+        conn.executemany('INSERT INTO group_members (group_id, user_id) VALUES (?, ?)', [(gid, m) for m in [uid] + others])
+        conn.executemany("INSERT INTO group_messages (group_id, sender_id, content) VALUES (?, ?, 'hi')",
+                         [(gid, m) for m in [uid] + others[:5]])
+    conn.executemany('INSERT INTO follows (follower_id, followed_id) VALUES (?, ?)',
+                     [(uid, o) for o in others] + [(o, uid) for o in others])
+    conn.executemany("INSERT INTO messages (sender_id, recipient_id, content) VALUES (?, ?, 'hey')",
+                     [(uid, o) for o in others] + [(o, uid) for o in others])
+    conn.commit()
+    return uid, others
+
+
+def legacy_delete_account(app_module, uid):
+    """The pre-change body of app.delete_profile(): every statement commits on its own"""
+    sql, query_db = app_module.sql, app_module.query_db
+    query_db(sql.USER_LIKES_DELETE, (uid,))
+    query_db(sql.USER_COMMENTS_DELETE, (uid,))
+    query_db(sql.USER_FOLLOWS_DELETE, (uid, uid))
+    query_db(sql.USER_MESSAGES_DELETE, (uid, uid))
+    query_db(sql.USER_GROUP_MESSAGES_DELETE, (uid,))
+    for g in query_db(sql.USER_OWNED_GROUPS, (uid,)):
+        query_db(sql.GROUP_MESSAGES_DELETE, (g['id'],))
+        query_db(sql.GROUP_MEMBERS_DELETE, (g['id'],))
+        query_db(sql.GROUP_DELETE, (g['id'],))
+    query_db(sql.USER_GROUP_MEMBERSHIPS_DELETE, (uid,))
+    query_db(sql.USER_RIDE_PROGRESS_DELETE, (uid,))
+    query_db(sql.USER_RIDE_TRACKS_DELETE, (uid,))
+    query_db(sql.USER_RIDES_DELETE, (uid,))
+    query_db(sql.USER_DELETE, (uid,))
+
+
+def unit_delete_account(app_module, uid):
+    """app.delete_profile() as it is now"""
+    sql, query_db, execute_query = app_module.sql, app_module.query_db, app_module.execute_query
+    db = app_module.get_db()
+    with db.transaction():
+        query_db(sql.USER_LIKES_DELETE, (uid,))
+        query_db(sql.USER_COMMENTS_DELETE, (uid,))
+        query_db(sql.USER_FOLLOWS_DELETE, (uid, uid))
+        query_db(sql.USER_MESSAGES_DELETE, (uid, uid))
+        query_db(sql.USER_GROUP_MESSAGES_DELETE, (uid,))
+        owned_groups = [(g['id'],) for g in query_db(sql.USER_OWNED_GROUPS, (uid,))]
+        if owned_groups:
+            execute_query(db, sql.GROUP_MESSAGES_DELETE, owned_groups, many=True)
+            execute_query(db, sql.GROUP_MEMBERS_DELETE, owned_groups, many=True)
+            execute_query(db, sql.GROUP_DELETE, owned_groups, many=True)
+        query_db(sql.USER_GROUP_MEMBERSHIPS_DELETE, (uid,))
+        query_db(sql.USER_RIDE_PROGRESS_DELETE, (uid,))
+        query_db(sql.USER_RIDE_TRACKS_DELETE, (uid,))
+        query_db(sql.USER_RIDES_DELETE, (uid,))
+        query_db(sql.USER_DELETE, (uid,))
+
+
+def legacy_create_group(app_module, uid, members):
+    """The pre-change body of app.create_group()"""
+    sql, query_db = app_module.sql, app_module.query_db
+    query_db(sql.GROUP_INSERT, (f'group of {uid}', uid, None))
+    group_id = query_db('SELECT id FROM groups ORDER BY id DESC LIMIT 1', (), one=True)['id']
+    query_db(sql.GROUP_MEMBER_INSERT, (group_id, uid))
+    for member in members:
+        if not query_db(sql.GROUP_MEMBERSHIP, (group_id, member), one=True):
+            query_db(sql.GROUP_MEMBER_INSERT, (group_id, member))
+    return group_id
+
+
+def unit_create_group(app_module, uid, members):
+    """app.create_group() as it is now"""
+    sql, execute_query = app_module.sql, app_module.execute_query
+    db = app_module.get_db()
+    with db.transaction():
+        group_id = execute_query(db, sql.GROUP_INSERT, (f'group of {uid}', uid, None)).lastrowid
+        execute_query(db, sql.GROUP_MEMBER_INSERT, [(group_id, m) for m in [uid] + members], many=True)
+    return group_id
+
+
+def legacy_delete_ride(app_module, ride_id, uid):
+    """The pre-change body of app.delete_ride()"""
+    sql, query_db = app_module.sql, app_module.query_db
+    query_db(sql.RIDE_LIKES_DELETE, (ride_id,))
+    query_db(sql.RIDE_COMMENTS_DELETE, (ride_id,))
+    query_db(sql.RIDE_PROGRESS_DELETE, (ride_id,))
+    query_db(sql.RIDE_TRACK_DELETE, (ride_id,))
+    query_db(sql.RIDE_DELETE_BY_USER, (ride_id, uid))
+
+
+def unit_delete_ride(app_module, ride_id, uid):
+    """app.delete_ride() as it is now"""
+    with app_module.get_db().transaction():
+        legacy_delete_ride(app_module, ride_id, uid)
+
+
+def snapshot(conn, uid, others):
+    """End state used to check that both versions did the same thing"""
+    everyone = [uid] + others
+    marks = ', '.join('?' for _ in everyone)
+    tables = {
+        'users': f'SELECT COUNT(*) FROM users WHERE id IN ({marks})',
+        'rides': f'SELECT COUNT(*) FROM rides WHERE user_id IN ({marks})',
+        'likes': f'SELECT COUNT(*) FROM likes WHERE user_id IN ({marks})',
+        'groups': f'SELECT COUNT(*) FROM groups WHERE owner_id IN ({marks})',
+        'group_members': f'SELECT COUNT(*) FROM group_members WHERE user_id IN ({marks})',
+        'messages': f'SELECT COUNT(*) FROM messages WHERE sender_id IN ({marks}) OR recipient_id IN ({marks})',
+    }
+    return {name: conn.execute(q, everyone * q.count('IN (')).fetchone()[0] for name, q in tables.items()}
+
+
+def measure(app_module, conn, action, rides, groups, members):
+    """Best-of-RUNS time and commits of one action, each run on freshly seeded data; also returns the end state"""
+    best, commits, state = float('inf'), 0, None
+    for _ in range(RUNS):
+        uid, others = seed_rider(conn, rides, groups, members)
+        ride_id = conn.execute('SELECT id FROM rides WHERE user_id = ? LIMIT 1', (uid,)).fetchone()[0]
+        before = app_module.query_stats.commits()['count']
+        t0 = time.perf_counter()
+        action(uid, others, ride_id)
+        best = min(best, time.perf_counter() - t0)
+        commits = app_module.query_stats.commits()['count'] - before
+        state = snapshot(conn, uid, others)
+    return best, commits, state
+
+
+def run(rides, groups, members):
+    workdir = tempfile.mkdtemp()
+    apply_migrations(os.path.join(workdir, 'moto_log.db'))
+    os.chdir(workdir)  # app.DATABASE is relative to the working directory
+
+    import app as app_module
+    actions = [
+        ('delete account',
+         lambda uid, others, ride_id: legacy_delete_account(app_module, uid),
+         lambda uid, others, ride_id: unit_delete_account(app_module, uid)),
+        ('create group',
+         lambda uid, others, ride_id: legacy_create_group(app_module, uid, others),
+         lambda uid, others, ride_id: unit_create_group(app_module, uid, others)),
+        ('delete ride',
+         lambda uid, others, ride_id: legacy_delete_ride(app_module, ride_id, uid),
+         lambda uid, others, ride_id: unit_delete_ride(app_module, ride_id, uid)),
+    ]
+
+    print(f'{rides} rides, {groups} owned groups, {members} members / friends')
+    print(f"{'action':>15} {'commits':>8} {'time (ms)':>10} {'unit commits':>13} {'unit (ms)':>10} {'speedup':>8}")
+    with app_module.app.app_context():
+        conn = app_module.get_db()
+        for name, legacy, unit in actions:
+            t_old, c_old, s_old = measure(app_module, conn, legacy, rides, groups, members)
+            t_new, c_new, s_new = measure(app_module, conn, unit, rides, groups, members)
+            assert s_old == s_new, f'{name}: end states differ'
+            print(f'{name:>15} {c_old:>8} {t_old * 1000:>10.1f} {c_new:>13} {t_new * 1000:>10.1f} {t_old / t_new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    run(*(args + [DEFAULT_RIDES, DEFAULT_GROUPS, DEFAULT_MEMBERS][len(args):]))
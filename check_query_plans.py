@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Check: run EXPLAIN QUERY PLAN on every SQL statement registered in queries.py and
+fail if any of them falls back to a full table scan.
+
+Every query the app runs is a named constant in queries.py, so new queries are picked
+up automatically. SQL written inline instead (a string literal or f-string passed to
+query_db/run_query/execute_query/execute in app.py or one of the helper modules in
+SOURCES) bypasses the registry and is reported as a failure too. Migrations and the
+maintenance scripts keep their SQL inline and are not checked. Queries that scan on
+purpose (whole-table aggregates, LIKE search) are listed in ALLOWED_SCANS with the reason.
+
+Run: python check_query_plans.py [path/to/moto_log.db]
+Exit code is 1 if any unexpected scan is found.
+"""
+
+import ast
+import os
+import re
+import sqlite3
+import sys
+
+import queries
+
+# app.py and the modules it passes its connection to
+SOURCES = ['app.py', 'track_store.py', 'track_simplify.py', 'ride_export.py', 'ride_import.py']
+DB_PATH = 'moto_log.db'
+# Statements with a query plan; DDL, PRAGMAs and BEGIN / COMMIT are skipped
+PLANNED = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')
+
+# (substring of the SQL, table alias/name that may be scanned, reason)
+ALLOWED_SCANS = [
+    ('FROM user_stats s JOIN users u ON u.id = s.user_id ORDER BY', 's', 'top-N walk of the distance index, stops at LIMIT'),
+    ('WHERE username LIKE ?', 'users', 'substring search cannot use a b-tree index'),
+    ("WHERE e.status IN ('upcoming', 'ongoing')", 'e', 'browse lists all open events'),
+    ('SELECT DISTINCT city FROM events', 'events', 'city dropdown over all events'),
+    ('SELECT status, COUNT(*) AS c FROM jobs GROUP BY status', 'jobs', 'diagnostics, walks the status index'),
+    ('IN (SELECT value FROM json_each(?))', 'json_each', 'the bound JSON array of keys, each looked up by index'),
+]
+
+
+def sql_literal(node):
+    """The text of a str literal or f-string (placeholders left as {}), else None"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        return ''.join(v.value if isinstance(v, ast.Constant) else '{}' for v in node.values)
+    return None
+
+
+def inline_queries(sources=SOURCES):
+    """Yield (file:line, sql) for every SQL literal passed to a query function in `sources`"""
+    base = os.path.dirname(os.path.abspath(__file__))
+    for source in sources:
+        tree = ast.parse(open(os.path.join(base, source), encoding='utf-8').read())
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call):
+                continue
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+            if name in ('query_db', 'execute', 'executemany') and node.args:
+                first = node.args[0]
+            elif name in ('run_query', 'execute_query') and len(node.args) > 1:
+                first = node.args[1]
+            else:
+                continue
+            text = sql_literal(first)
+            if text is not None and text.strip().upper().startswith(PLANNED):
+                yield f'{source}:{node.lineno}', text
+
+
+def null_params(sql):
+    """NULL for every parameter of a statement, positional or :named"""
+    names = re.findall(r':(\w+)', sql)
+    return dict.fromkeys(names) if names else [None] * sql.count('?')
+
+
+def is_allowed(sql, table):
+    # Compare with whitespace collapsed so re-indenting a query does not break its entry
+    flat = ' '.join(sql.split())
+    return any(' '.join(snippet.split()) in flat and table == alias for snippet, alias, _ in ALLOWED_SCANS)
+
+
+def check(db_path=DB_PATH):
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    failures = []
+    checked = 0
+    for where, sql in inline_queries():
+        failures.append((where, 'inline SQL, add it to queries.py', ' '.join(sql.split())))
+    for name, sql in queries.QUERIES.items():
+        if not sql.strip().upper().startswith(PLANNED):
+            continue
+        try:
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, null_params(sql)).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f'⏭️  {name} skipped ({e})')
+            continue
+        checked += 1
+        # Subqueries in FROM show up as "MATERIALIZE c" / "CO-ROUTINE c"; scanning their result is fine,
+        # the plan rows for the subquery itself are checked like any other
+        derived = {row[-1].split()[1] for row in plan if row[-1].startswith(('MATERIALIZE ', 'CO-ROUTINE '))}
+        for row in plan:
+            detail = row[-1]
+            # "SCAN t" is a full table scan; "SCAN t USING [COVERING] INDEX" walks a whole index
+            if not detail.startswith('SCAN '):
+                continue
+            table = detail.split()[1]
+            if table.startswith('CONSTANT') or table in derived or is_allowed(sql, table):
+                continue
+            failures.append((name, detail, ' '.join(sql.split())))
+
+    conn.close()
+    for where, detail, sql in failures:
+        print(f'❌ {where}: {detail}\n     {sql[:160]}')
+    print(f'{"❌" if failures else "✅"} {checked} queries checked, {len(failures)} failures')
+    return not failures
+
+
+if __name__ == '__main__':
+    ok = check(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    sys.exit(0 if ok else 1)
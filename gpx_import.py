@@ -0,0 +1,108 @@
+"""
+Streaming GPX import.
+
+GPX files are parsed with ElementTree.iterparse and every <trkpt> is detached from
+the tree as soon as it has been read, so memory stays flat no matter how large the
+file is: only the point columns are kept, as packed float64 arrays (~40 bytes per
+point). ride_import turns the track into a finished ride (stats, packed ride_tracks
+blob) without the points ever going through gps_points.
+
+Namespaces are ignored, so GPX 1.0 and 1.1 files (and vendor variants) both work.
+GPX 1.0 <speed> (m/s) is kept as km/h when present.
+"""
+
+import array
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+import numpy as np
+
+from track_store import COLUMNS
+
+
+def _local(tag):
+    """Tag name without its {namespace}"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_gpx_time(text):
+    """ISO 8601 GPX <time> as epoch seconds (float), or None; naive times are taken as UTC"""
+    if not text:
+        return None
+    try:
+        dt = datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def iter_gpx_points(source, meta=None):
+    """
+    Stream the <trkpt> elements of a GPX file (path or binary file object) as dicts with
+    lat, lon, ele, time (raw string) and speed (km/h or None). Points without valid
+    coordinates are skipped. If `meta` is a dict, the first <name> in the file is stored
+    in meta['name']. Raises xml.etree.ElementTree.ParseError on malformed XML.
+    """
+    parents = []
+    local_names = {}
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = local_names.get(elem.tag)
+        if tag is None:
+            tag = local_names[elem.tag] = _local(elem.tag)
+        if tag != 'trkpt':
+            if tag == 'name' and meta is not None and 'name' not in meta and elem.text and elem.text.strip():
+                meta['name'] = elem.text.strip()
+            continue
+
+        lat, lon = _float(elem.get('lat')), _float(elem.get('lon'))
+        children = {local_names.get(child.tag) or _local(child.tag): child.text for child in elem}
+        # Done with this point: drop it from its parent so the tree never grows
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+
+        if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            continue
+        speed = _float(children.get('speed'))
+        yield {
+            'lat': lat,
+            'lon': lon,
+            'ele': _float(children.get('ele')),
+            'time': children.get('time'),
+            'speed': speed * 3.6 if speed is not None else None,
+        }
+
+
+def read_gpx_track(source, meta=None):
+    """Stream-parse a GPX file into a track dict of float64 arrays (NaN = missing), in time order"""
+    columns = {c: array.array('d') for c in COLUMNS}
+    nan = float('nan')
+    for point in iter_gpx_points(source, meta):
+        columns['latitude'].append(point['lat'])
+        columns['longitude'].append(point['lon'])
+        columns['altitude'].append(nan if point['ele'] is None else point['ele'])
+        columns['speed'].append(nan if point['speed'] is None else point['speed'])
+        stamp = parse_gpx_time(point['time'])
+        columns['timestamp'].append(nan if stamp is None else stamp)
+
+    track = {c: np.frombuffer(values, dtype=np.float64) if len(values) else np.zeros(0)
+             for c, values in columns.items()}
+    # Multi-segment files are occasionally stored out of order
+    if np.any(np.diff(track['timestamp']) < 0):
+        order = np.argsort(track['timestamp'], kind='stable')
+        track = {c: v[order] for c, v in track.items()}
+    return track
+
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Migration: Broadcast notifications, stored once and merged in at read time.
+
+A global event used to write one notifications row per user. broadcasts holds it as a
+single row instead, shown to every user who had an account when it was published.
+
+Read state is per user: broadcast_watermarks.read_upto marks every broadcast up to that
+id as read. It starts at the newest broadcast when the account is created (trigger) and
+moves on "Mark all as read". broadcast_reads holds the ones above it that were read one
+by one (the actor's own broadcast is one of them from the start), pruned when the
+watermark moves past them.
+
+That keeps the badge count a few index lookups however many broadcasts there are:
+the unread ones are the ids above the watermark, less the reads above it and the ids
+freed by deleted broadcasts (broadcast_deletions, filled by trigger).
+
+Targeted notifications (follows, joins, local events) stay in the notifications table.
+
+Run: python migrate_add_broadcasts.py
+"""
+
+import sqlite3
+
+TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_broadcasts_insert AFTER INSERT ON users
+    BEGIN
+        INSERT OR IGNORE INTO broadcast_watermarks (user_id, read_upto)
+        VALUES (NEW.id, (SELECT COALESCE(MAX(id), 0) FROM broadcasts));
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_broadcasts_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM broadcast_reads WHERE user_id = OLD.id;
+        DELETE FROM broadcast_watermarks WHERE user_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_broadcasts_delete AFTER DELETE ON broadcasts
+    BEGIN
+        INSERT OR IGNORE INTO broadcast_deletions (id) VALUES (OLD.id);
+        DELETE FROM broadcast_reads WHERE broadcast_id = OLD.id;
+    END
+    ''',
+]
+
+
+def install(conn):
+    """Create the broadcast tables, their triggers and every existing user's watermark (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            actor_id INTEGER,
+            event_id INTEGER,
+            message TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_event ON broadcasts(event_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_reads (
+            user_id INTEGER NOT NULL,
+            broadcast_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, broadcast_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_reads_broadcast ON broadcast_reads(broadcast_id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_watermarks (
+            user_id INTEGER PRIMARY KEY,
+            read_upto INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE TABLE IF NOT EXISTS broadcast_deletions (id INTEGER PRIMARY KEY)')
+    for sql in TRIGGERS:
+        conn.execute(sql)
+    conn.execute('''
+        INSERT OR IGNORE INTO broadcast_watermarks (user_id, read_upto)
+        SELECT id, (SELECT COALESCE(MAX(id), 0) FROM broadcasts) FROM users
+    ''')
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        conn.commit()
+        print("✅ Created broadcasts, broadcast_reads, broadcast_watermarks and broadcast_deletions")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
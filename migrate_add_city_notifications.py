@@ -7,37 +7,42 @@ Run: python migrate_add_city_notifications.py
 
 import sqlite3
 
+def install(conn):
+    """Add users.city and create notifications (idempotent, no commit); True if city was added"""
+    # 1. Add city column to users if it doesn't exist
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    added = 'city' not in cols
+    if added:
+        conn.execute("ALTER TABLE users ADD COLUMN city TEXT")
+
+    # 2. Create notifications table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            actor_id INTEGER,
+            event_id INTEGER,
+            message TEXT,
+            is_read INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (actor_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE
+        )
+    ''')
+    return added
+
 def migrate():
     conn = sqlite3.connect('moto_log.db')
     c = conn.cursor()
     try:
         c.execute('PRAGMA foreign_keys = OFF')
 
-        # 1. Add city column to users if it doesn't exist
-        c.execute("PRAGMA table_info(users)")
-        cols = [row[1] for row in c.fetchall()]
-        if 'city' not in cols:
-            c.execute("ALTER TABLE users ADD COLUMN city TEXT")
+        if install(conn):
             print("✅ Added city column to users table")
         else:
             print("ℹ️ city column already exists in users table")
-
-        # 2. Create notifications table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                type TEXT NOT NULL,
-                actor_id INTEGER,
-                event_id INTEGER,
-                message TEXT,
-                is_read INTEGER DEFAULT 0,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
-                FOREIGN KEY (actor_id) REFERENCES users (id) ON DELETE CASCADE,
-                FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE
-            )
-        ''')
         print("✅ Created notifications table")
 
         c.execute('PRAGMA foreign_keys = ON')
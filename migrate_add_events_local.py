@@ -4,17 +4,20 @@
 
 import sqlite3
 
+def install(conn):
+    """Add events.is_local if missing (idempotent, no commit); True if it was added"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(events)")]
+    if 'is_local' in columns:
+        return False
+    conn.execute('ALTER TABLE events ADD COLUMN is_local INTEGER DEFAULT 1')
+    return True
+
 def migrate_add_is_local():
     conn = sqlite3.connect('moto_log.db')
-    c = conn.cursor()
     
     try:
         # Add is_local column if it doesn't exist
-        c.execute("PRAGMA table_info(events)")
-        columns = [row[1] for row in c.fetchall()]
-        
-        if 'is_local' not in columns:
-            c.execute('ALTER TABLE events ADD COLUMN is_local INTEGER DEFAULT 1')
+        if install(conn):
             print("✅ Added is_local column to events table")
         else:
             print("ℹ️ is_local column already exists")
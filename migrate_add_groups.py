@@ -1,8 +1,8 @@
 # migrate_add_groups.py
 import sqlite3
 
-def run():
-    conn = sqlite3.connect('moto_log.db')
+def install(conn):
+    """Create the group tables if missing (idempotent, no commit)"""
     c = conn.cursor()
 
     # groups: id, name, owner_id, profile_pic, created_at
@@ -42,6 +42,9 @@ def run():
         )
     ''')
 
+def run():
+    conn = sqlite3.connect('moto_log.db')
+    install(conn)
     conn.commit()
     conn.close()
     print("Group tables created (if not existed).")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Migration: Bulk ride import jobs and per-user de-duplication of imported tracks.
+
+import_jobs tracks one archive upload (status, progress counters, per-file errors)
+for the /api/import/<job_id> status endpoint. ride_imports records the content hash
+of every imported track per user, so re-uploading the same files is a no-op
+(see ride_import.py).
+
+Run: python migrate_add_import_jobs.py
+"""
+
+import sqlite3
+
+TRIGGERS = [
+    # Deleting a ride frees its hash, so the same file can be imported again
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_ride_imports_ride_delete AFTER DELETE ON rides
+    BEGIN
+        DELETE FROM ride_imports WHERE ride_id = OLD.id;
+    END
+    ''',
+]
+
+
+def install(conn):
+    """Create import_jobs, ride_imports and their trigger (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            bike_id INTEGER,
+            public INTEGER NOT NULL DEFAULT 1,
+            filename TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            imported INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            errors TEXT NOT NULL DEFAULT '[]',
+            created_at TEXT,
+            updated_at TEXT,
+            finished_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_import_jobs_user ON import_jobs(user_id, id)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ride_imports (
+            user_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            ride_id INTEGER NOT NULL,
+            source_name TEXT,
+            imported_at TEXT,
+            PRIMARY KEY (user_id, content_hash),
+            FOREIGN KEY (ride_id) REFERENCES rides (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ride_imports_ride ON ride_imports(ride_id)')
+    for sql in TRIGGERS:
+        conn.execute(sql)
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        conn.commit()
+        print("✅ Created import_jobs and ride_imports tables")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
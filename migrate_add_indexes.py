@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Migration: Add secondary indexes for the columns the app filters, joins and sorts on.
+
+Safe to re-run (CREATE INDEX IF NOT EXISTS). Check the result with check_query_plans.py.
+
+Run: python migrate_add_indexes.py
+"""
+
+import sqlite3
+
+INDEXES = [
+    # rides: per-user lists (dashboard, profile, history), leaderboard sums, per-bike lists
+    ('idx_rides_user_date', 'rides', 'user_id, date'),
+    ('idx_rides_user_public', 'rides', 'user_id, public, distance, time'),
+    ('idx_rides_bike_date', 'rides', 'bike_id, date'),
+    # GPS track reads are always one ride in time order
+    ('idx_gps_points_ride_ts', 'gps_points', 'ride_id, timestamp'),
+    # direct messages: conversation by pair, unread by recipient
+    ('idx_messages_pair', 'messages', 'sender_id, recipient_id, created_at'),
+    ('idx_messages_recipient_unread', 'messages', 'recipient_id, is_read, sender_id'),
+    # chat paging walks a conversation by message id (since_id / before_id cursors)
+    ('idx_messages_pair_id', 'messages', 'sender_id, recipient_id, id'),
+    # group chat
+    ('idx_group_messages_group_created', 'group_messages', 'group_id, created_at'),
+    ('idx_group_messages_group_id', 'group_messages', 'group_id, id'),
+    ('idx_group_messages_sender', 'group_messages', 'sender_id'),
+    ('idx_group_members_group_user', 'group_members', 'group_id, user_id'),
+    ('idx_group_members_user_group', 'group_members', 'user_id, group_id'),
+    ('idx_groups_owner', 'groups', 'owner_id'),
+    # social graph
+    ('idx_follows_follower_followed', 'follows', 'follower_id, followed_id'),
+    ('idx_follows_followed_follower', 'follows', 'followed_id, follower_id'),
+    ('idx_likes_ride_user', 'likes', 'ride_id, user_id'),
+    ('idx_likes_user', 'likes', 'user_id'),
+    ('idx_comments_ride', 'comments', 'ride_id'),
+    ('idx_comments_user', 'comments', 'user_id'),
+    # notifications badge and list
+    ('idx_notifications_user_read', 'notifications', 'user_id, is_read, created_at'),
+    # events
+    ('idx_event_participants_user_event', 'event_participants', 'user_id, event_id'),
+    ('idx_events_creator', 'events', 'creator_id, event_date'),
+    ('idx_events_status_date', 'events', 'status, event_date'),
+    # garage / maintenance
+    ('idx_bikes_user', 'bikes', 'user_id, name'),
+    ('idx_bike_maintenance_bike_date', 'bike_maintenance', 'bike_id, date'),
+    ('idx_maintenance_user', 'maintenance', 'user_id'),
+    # user lookups
+    ('idx_users_username', 'users', 'username'),
+    ('idx_users_country', 'users', 'country'),
+    ('idx_users_city', 'users', 'city'),
+]
+
+def install(conn):
+    """
+    Create every index whose table exists (idempotent, no commit). Returns the
+    (name, table, columns) entries created and the ones skipped.
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    created, skipped = [], []
+    for entry in INDEXES:
+        name, table, columns = entry
+        if table not in tables:
+            skipped.append(entry)
+            continue
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+        created.append(entry)
+    return created, skipped
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        created, skipped = install(conn)
+        for name, table, columns in skipped:
+            print(f"⏭️  Skipping {name}: table {table} does not exist")
+        for name, table, columns in created:
+            print(f"✅ {name} ON {table} ({columns})")
+        conn.commit()
+        print("✅ Migration completed successfully!")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Migration: Persistent background job queue.
+
+jobs holds work the request handlers hand off to the worker thread in app.py (e.g.
+notifying everyone about a new event), so it survives restarts: queued jobs are picked
+up when the app starts again, and a job whose worker died mid-run is taken over once
+its lease expires. cursor is the job's resume position (for the event fan-out, the
+last user id notified), committed together with each batch of work.
+
+run_after is when a queued job becomes due; once a job runs it is the start of its
+lease (renewed with every batch) and, when it is done, its finishing time, so one
+index serves claiming, lease expiry and purging.
+
+Run: python migrate_add_job_queue.py
+"""
+
+import sqlite3
+
+
+def install(conn):
+    """Create the jobs table and its index (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'queued',
+            cursor INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            run_after TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            updated_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, run_after)')
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        conn.commit()
+        print("✅ Created jobs table")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -2,6 +2,14 @@
 import sqlite3
 from datetime import datetime
 
+def install(conn):
+    """Add group_members.last_read if missing (idempotent, no commit)"""
+    try:
+        conn.execute('ALTER TABLE group_members ADD COLUMN last_read TEXT')
+    except sqlite3.OperationalError as e:
+        if 'duplicate column name' not in str(e):
+            raise
+
 def run():
     conn = sqlite3.connect('moto_log.db')
     c = conn.cursor()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Migration: Per-user, per-period rollup buckets for the weekly / monthly / yearly leaderboards.
+
+leaderboard_buckets holds one row per (period, bucket, user) with the totals of that
+user's public rides dated inside the bucket:
+    week  -> bucket is the Monday of the ride's week   ('2026-10-12')
+    month -> 'YYYY-MM'
+    year  -> 'YYYY'
+Triggers on rides apply the delta on every insert, delete and edit, so a "this week in
+Bulgaria" board is the same top-N index walk as the all-time one on user_stats.
+BUCKET_SQL must stay in step with app.leaderboard_bucket().
+
+The buckets are rebuilt from rides at the end of the migration; rebuild_leaderboards.py
+does the same on a live database.
+
+Run: python migrate_add_leaderboard_buckets.py
+"""
+
+import sqlite3
+
+# SQL expression for the bucket key of a ride date ({d} is the date column)
+BUCKET_SQL = {
+    'week': "date({d}, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m', {d})",
+    'year': "strftime('%Y', {d})",
+}
+
+INDEXES = [
+    ('idx_leaderboard_buckets_distance', 'leaderboard_buckets', 'period, bucket, distance DESC, user_id'),
+    ('idx_leaderboard_buckets_country_distance', 'leaderboard_buckets', 'period, bucket, country, distance DESC, user_id'),
+    ('idx_leaderboard_buckets_user', 'leaderboard_buckets', 'user_id'),
+]
+
+
+def _add(row):
+    """Statements adding ride `row` (NEW or OLD) to its bucket in every period"""
+    statements = []
+    for period, expr in BUCKET_SQL.items():
+        bucket = expr.format(d=f'{row}.date')
+        statements.append(f'''
+        INSERT OR IGNORE INTO leaderboard_buckets (period, bucket, user_id, country)
+            SELECT '{period}', {bucket}, id, country FROM users
+            WHERE id = {row}.user_id AND {row}.public = 1 AND {bucket} IS NOT NULL;
+        UPDATE leaderboard_buckets
+           SET distance = distance + COALESCE({row}.distance, 0), rides = rides + 1, time = time + COALESCE({row}.time, 0)
+         WHERE period = '{period}' AND bucket = {bucket} AND user_id = {row}.user_id AND {row}.public = 1;''')
+    return ''.join(statements)
+
+
+def _remove(row):
+    """Statements taking ride `row` out of its buckets; empty buckets are dropped"""
+    statements = []
+    for period, expr in BUCKET_SQL.items():
+        bucket = expr.format(d=f'{row}.date')
+        statements.append(f'''
+        UPDATE leaderboard_buckets
+           SET distance = MAX(0, distance - COALESCE({row}.distance, 0)), rides = rides - 1,
+               time = MAX(0, time - COALESCE({row}.time, 0))
+         WHERE period = '{period}' AND bucket = {bucket} AND user_id = {row}.user_id AND {row}.public = 1;
+        DELETE FROM leaderboard_buckets
+         WHERE period = '{period}' AND bucket = {bucket} AND user_id = {row}.user_id AND rides <= 0;''')
+    return ''.join(statements)
+
+
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_leaderboard_buckets_ride_insert AFTER INSERT ON rides
+    WHEN NEW.public = 1
+    BEGIN{_add('NEW')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_leaderboard_buckets_ride_delete AFTER DELETE ON rides
+    WHEN OLD.public = 1
+    BEGIN{_remove('OLD')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS trg_leaderboard_buckets_ride_update AFTER UPDATE OF public, distance, time, user_id, date ON rides
+    WHEN OLD.public = 1 OR NEW.public = 1
+    BEGIN{_remove('OLD')}{_add('NEW')}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_leaderboard_buckets_user_country AFTER UPDATE OF country ON users
+    BEGIN
+        UPDATE leaderboard_buckets SET country = NEW.country WHERE user_id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_leaderboard_buckets_user_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM leaderboard_buckets WHERE user_id = OLD.id;
+    END
+    ''',
+]
+
+
+def install(conn):
+    """Create leaderboard_buckets, its indexes and the triggers (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_buckets (
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            country TEXT,
+            distance REAL NOT NULL DEFAULT 0,
+            rides INTEGER NOT NULL DEFAULT 0,
+            time REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, user_id)
+        )
+    ''')
+    for name, table, columns in INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+    for sql in TRIGGERS:
+        conn.execute(sql)
+
+
+def rebuild_buckets(conn):
+    """
+    Recompute every bucket from rides; returns the number of rows written.
+    Does not commit: run it inside the caller's transaction.
+    """
+    written = 0
+    conn.execute('DELETE FROM leaderboard_buckets')
+    for period, expr in BUCKET_SQL.items():
+        bucket = expr.format(d='r.date')
+        cur = conn.execute(f'''
+            INSERT INTO leaderboard_buckets (period, bucket, user_id, country, distance, rides, time)
+            SELECT '{period}', {bucket}, u.id, u.country,
+                   COALESCE(SUM(r.distance), 0), COUNT(*), COALESCE(SUM(r.time), 0)
+            FROM rides r
+            JOIN users u ON u.id = r.user_id
+            WHERE r.public = 1 AND {bucket} IS NOT NULL
+            GROUP BY {bucket}, u.id
+        ''')
+        written += cur.rowcount
+    return written
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        count = rebuild_buckets(conn)
+        conn.commit()
+        print(f"✅ Created leaderboard_buckets and triggers ({count} buckets backfilled)")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
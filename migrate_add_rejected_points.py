@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Migration: rides.rejected_points, the number of GPS fixes dropped as noise or outliers
+(see track_filter.py) when the ride was recorded, stopped or imported.
+
+Run: python migrate_add_rejected_points.py
+"""
+
+import sqlite3
+
+def install(conn):
+    """Add the column if it is missing (idempotent, no commit)"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(rides)')]
+    if 'rejected_points' not in columns:
+        conn.execute('ALTER TABLE rides ADD COLUMN rejected_points INTEGER NOT NULL DEFAULT 0')
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        conn.commit()
+        print("✅ Added rides.rejected_points")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -8,6 +8,25 @@ import os
 
 DB_PATH = 'moto_log.db'
 
+# public defaults to 1: rides are public unless the rider says otherwise
+COLUMNS_TO_ADD = {
+    'title': 'TEXT DEFAULT "My Ride"',
+    'description': 'TEXT DEFAULT ""',
+    'public': 'INTEGER DEFAULT 1',
+    'avg_speed': 'REAL DEFAULT 0',
+    'top_speed': 'REAL DEFAULT 0'
+}
+
+def install(conn):
+    """Add the missing columns (idempotent, no commit); returns the names added"""
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(rides)')}
+    added = []
+    for col_name, col_def in COLUMNS_TO_ADD.items():
+        if col_name not in existing:
+            conn.execute(f'ALTER TABLE rides ADD COLUMN {col_name} {col_def}')
+            added.append(col_name)
+    return added
+
 def migrate():
     if not os.path.exists(DB_PATH):
         print(f"❌ Database {DB_PATH} not found")
@@ -17,15 +36,7 @@ def migrate():
     conn.execute('PRAGMA foreign_keys = ON')
     cur = conn.cursor()
     
-    columns_to_add = {
-        'title': 'TEXT DEFAULT "My Ride"',
-        'description': 'TEXT DEFAULT ""',
-        'public': 'INTEGER DEFAULT 0',
-        'avg_speed': 'REAL DEFAULT 0',
-        'top_speed': 'REAL DEFAULT 0'
-    }
-    
-    for col_name, col_def in columns_to_add.items():
+    for col_name, col_def in COLUMNS_TO_ADD.items():
         try:
             cur.execute(f'ALTER TABLE rides ADD COLUMN {col_name} {col_def}')
             print(f'✅ Added column "{col_name}" to rides table')
@@ -8,6 +8,12 @@ import os
 
 DB_PATH = 'moto_log.db'
 
+def install(conn):
+    """Add rides.photos if missing (idempotent, no commit)"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(rides)')]
+    if 'photos' not in columns:
+        conn.execute('ALTER TABLE rides ADD COLUMN photos TEXT DEFAULT "[]"')
+
 def migrate():
     if not os.path.exists(DB_PATH):
         print(f"❌ Database {DB_PATH} not found")
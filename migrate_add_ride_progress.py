@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Migration: Create ride_progress table holding running stats for rides being recorded.
+
+Run: python migrate_add_ride_progress.py
+"""
+
+import sqlite3
+
+def install(conn):
+    """Create the ride_progress table (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ride_progress (
+            ride_id INTEGER PRIMARY KEY,
+            point_count INTEGER NOT NULL DEFAULT 0,
+            distance REAL NOT NULL DEFAULT 0,
+            moving_time INTEGER NOT NULL DEFAULT 0,
+            max_speed REAL NOT NULL DEFAULT 0,
+            elevation_gain REAL NOT NULL DEFAULT 0,
+            elevation_loss REAL NOT NULL DEFAULT 0,
+            first_timestamp INTEGER,
+            last_timestamp INTEGER,
+            last_latitude REAL,
+            last_longitude REAL,
+            last_altitude REAL,
+            out_of_order INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT,
+            FOREIGN KEY (ride_id) REFERENCES rides (id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        conn.commit()
+        print("✅ Created ride_progress table")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Migration: Compact per-ride track blobs (see track_store.py).
+
+Creates ride_tracks and packs the gps_points of every existing ride into it, one ride
+per transaction, deleting the packed rows. Rides whose newest point is less than
+ACTIVE_WINDOW seconds old are left alone since they may still be recording; they are
+packed when /api/ride/stop runs.
+
+Run: python migrate_add_ride_tracks.py
+"""
+
+import sqlite3
+import time
+
+from track_store import pack_ride_points
+
+ACTIVE_WINDOW = 6 * 3600
+
+
+def install(conn):
+    """Create the ride_tracks table (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ride_tracks (
+            ride_id INTEGER PRIMARY KEY,
+            point_count INTEGER NOT NULL,
+            encoding TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at TEXT,
+            FOREIGN KEY (ride_id) REFERENCES rides (id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def pack_existing(conn, active_window=ACTIVE_WINDOW):
+    """Pack every finished ride still stored as gps_points; returns (rides, points)"""
+    cutoff = time.time() - active_window
+    ride_ids = [row[0] for row in conn.execute('''
+        SELECT ride_id FROM gps_points GROUP BY ride_id HAVING MAX(timestamp) < ?
+    ''', (cutoff,))]
+    points = 0
+    for ride_id in ride_ids:
+        points += pack_ride_points(conn, ride_id)
+    return len(ride_ids), points
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        conn.commit()
+        rides, points = pack_existing(conn)
+        print(f"✅ Created ride_tracks ({rides} rides, {points} points packed)")
+        if rides:
+            print("   Run VACUUM to return the freed gps_points pages to the filesystem")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
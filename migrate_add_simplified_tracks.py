@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Migration: Cache of Douglas-Peucker simplified ride tracks (see track_simplify.py).
+
+ride_track_simplified holds one packed track per (ride, tolerance), filled the first
+time a map asks for it. Triggers on ride_tracks drop a ride's cached copies whenever
+its full track is written or deleted, so the cache never serves a stale route.
+
+Run: python migrate_add_simplified_tracks.py
+"""
+
+import sqlite3
+
+TRIGGERS = [
+    # INSERT OR REPLACE into ride_tracks fires the insert trigger, which covers re-packing
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_ride_tracks_simplified_insert AFTER INSERT ON ride_tracks
+    BEGIN
+        DELETE FROM ride_track_simplified WHERE ride_id = NEW.ride_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_ride_tracks_simplified_update AFTER UPDATE ON ride_tracks
+    BEGIN
+        DELETE FROM ride_track_simplified WHERE ride_id IN (OLD.ride_id, NEW.ride_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_ride_tracks_simplified_delete AFTER DELETE ON ride_tracks
+    BEGIN
+        DELETE FROM ride_track_simplified WHERE ride_id = OLD.ride_id;
+    END
+    ''',
+]
+
+
+def install(conn):
+    """Create ride_track_simplified and its triggers (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ride_track_simplified (
+            ride_id INTEGER NOT NULL,
+            tolerance REAL NOT NULL,
+            point_count INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (ride_id, tolerance),
+            FOREIGN KEY (ride_id) REFERENCES rides (id) ON DELETE CASCADE
+        )
+    ''')
+    for sql in TRIGGERS:
+        conn.execute(sql)
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        conn.commit()
+        print("✅ Created ride_track_simplified and triggers")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Migration: Denormalized unread counters for the navbar badges.
+
+unread_counters holds one row per user (messages, group_messages, notifications) and
+group_members.unread_count holds the per-group share of group_messages. Triggers keep
+them up to date on every write to messages, group_messages, group_members and
+notifications, so the badge endpoints are a primary-key lookup.
+
+Counters are rebuilt from the source tables at the end of the migration; run
+repair_unread_counters.py to do the same on a live database if they ever drift.
+
+Run: python migrate_add_unread_counters.py
+"""
+
+import sqlite3
+
+TRIGGERS = [
+    # ---- direct messages: unread = addressed to the user, not sent by them, is_read = 0 ----
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_unread_insert AFTER INSERT ON messages
+    WHEN NEW.is_read = 0 AND NEW.sender_id != NEW.recipient_id
+    BEGIN
+        INSERT OR IGNORE INTO unread_counters (user_id) VALUES (NEW.recipient_id);
+        UPDATE unread_counters SET messages = messages + 1 WHERE user_id = NEW.recipient_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_unread_read AFTER UPDATE OF is_read ON messages
+    WHEN OLD.is_read = 0 AND NEW.is_read != 0 AND NEW.sender_id != NEW.recipient_id
+    BEGIN
+        UPDATE unread_counters SET messages = MAX(0, messages - 1) WHERE user_id = NEW.recipient_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_unread_delete AFTER DELETE ON messages
+    WHEN OLD.is_read = 0 AND OLD.sender_id != OLD.recipient_id
+    BEGIN
+        UPDATE unread_counters SET messages = MAX(0, messages - 1) WHERE user_id = OLD.recipient_id;
+    END
+    ''',
+    # ---- group messages: unread for every other member; system messages (sender_id = 0) never count ----
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_group_messages_unread_insert AFTER INSERT ON group_messages
+    WHEN NEW.sender_id != 0
+    BEGIN
+        INSERT OR IGNORE INTO unread_counters (user_id)
+            SELECT user_id FROM group_members WHERE group_id = NEW.group_id AND user_id != NEW.sender_id;
+        UPDATE unread_counters SET group_messages = group_messages + 1
+            WHERE user_id IN (SELECT user_id FROM group_members WHERE group_id = NEW.group_id AND user_id != NEW.sender_id);
+        UPDATE group_members SET unread_count = unread_count + 1
+            WHERE group_id = NEW.group_id AND user_id != NEW.sender_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_group_messages_unread_delete AFTER DELETE ON group_messages
+    WHEN OLD.sender_id != 0
+    BEGIN
+        UPDATE unread_counters SET group_messages = MAX(0, group_messages - 1)
+            WHERE user_id IN (SELECT user_id FROM group_members
+                              WHERE group_id = OLD.group_id AND user_id != OLD.sender_id AND unread_count > 0
+                                AND COALESCE(last_read, '1900-01-01') < OLD.created_at);
+        UPDATE group_members SET unread_count = unread_count - 1
+            WHERE group_id = OLD.group_id AND user_id != OLD.sender_id AND unread_count > 0
+              AND COALESCE(last_read, '1900-01-01') < OLD.created_at;
+    END
+    ''',
+    # Moving last_read forward means the member has seen everything in the group
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_group_members_read AFTER UPDATE OF last_read ON group_members
+    WHEN OLD.unread_count > 0
+    BEGIN
+        UPDATE unread_counters SET group_messages = MAX(0, group_messages - OLD.unread_count) WHERE user_id = NEW.user_id;
+        UPDATE group_members SET unread_count = 0 WHERE id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_group_members_unread_delete AFTER DELETE ON group_members
+    WHEN OLD.unread_count > 0
+    BEGIN
+        UPDATE unread_counters SET group_messages = MAX(0, group_messages - OLD.unread_count) WHERE user_id = OLD.user_id;
+    END
+    ''',
+    # ---- notifications ----
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_notifications_unread_insert AFTER INSERT ON notifications
+    WHEN COALESCE(NEW.is_read, 0) = 0
+    BEGIN
+        INSERT OR IGNORE INTO unread_counters (user_id) VALUES (NEW.user_id);
+        UPDATE unread_counters SET notifications = notifications + 1 WHERE user_id = NEW.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_notifications_unread_read AFTER UPDATE OF is_read ON notifications
+    WHEN COALESCE(OLD.is_read, 0) = 0 AND NEW.is_read != 0
+    BEGIN
+        UPDATE unread_counters SET notifications = MAX(0, notifications - 1) WHERE user_id = NEW.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_notifications_unread_delete AFTER DELETE ON notifications
+    WHEN COALESCE(OLD.is_read, 0) = 0
+    BEGIN
+        UPDATE unread_counters SET notifications = MAX(0, notifications - 1) WHERE user_id = OLD.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_unread_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM unread_counters WHERE user_id = OLD.id;
+    END
+    ''',
+]
+
+
+def rebuild_counters(conn):
+    """
+    Recompute every counter from the source tables. Returns the number of users whose
+    stored counters were wrong. Does not commit: run it inside the caller's transaction.
+    """
+    before = {row[0]: tuple(row[1:]) for row in conn.execute(
+        'SELECT user_id, messages, group_messages, notifications FROM unread_counters')}
+
+    conn.execute('''
+        UPDATE group_members SET unread_count = (
+            SELECT COUNT(*) FROM group_messages gm
+            WHERE gm.group_id = group_members.group_id
+              AND gm.sender_id != 0 AND gm.sender_id != group_members.user_id
+              AND gm.created_at > COALESCE(group_members.last_read, '1900-01-01')
+        )
+    ''')
+    conn.execute('DELETE FROM unread_counters')
+    conn.execute('''
+        INSERT INTO unread_counters (user_id, messages, group_messages, notifications)
+        SELECT u.id,
+               (SELECT COUNT(*) FROM messages WHERE recipient_id = u.id AND is_read = 0 AND sender_id != u.id),
+               (SELECT COALESCE(SUM(unread_count), 0) FROM group_members WHERE user_id = u.id),
+               (SELECT COUNT(*) FROM notifications WHERE user_id = u.id AND COALESCE(is_read, 0) = 0)
+        FROM users u
+    ''')
+
+    after = {row[0]: tuple(row[1:]) for row in conn.execute(
+        'SELECT user_id, messages, group_messages, notifications FROM unread_counters')}
+    # A missing row reads as all zeros in the app, so only count real differences
+    zero = (0, 0, 0)
+    return sum(1 for uid in set(before) | set(after) if before.get(uid, zero) != after.get(uid, zero))
+
+
+def install(conn):
+    """Create the counter table, the group_members column and the triggers (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS unread_counters (
+            user_id INTEGER PRIMARY KEY,
+            messages INTEGER NOT NULL DEFAULT 0,
+            group_messages INTEGER NOT NULL DEFAULT 0,
+            notifications INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    try:
+        conn.execute('ALTER TABLE group_members ADD COLUMN unread_count INTEGER NOT NULL DEFAULT 0')
+    except sqlite3.OperationalError as e:
+        if 'duplicate column name' not in str(e):
+            raise
+    for sql in TRIGGERS:
+        conn.execute(sql)
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        fixed = rebuild_counters(conn)
+        conn.commit()
+        print(f"✅ Created unread_counters and triggers ({fixed} users backfilled)")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Migration: Precomputed per-user leaderboard aggregates.
+
+user_stats holds one row per user with the totals of their public rides (distance,
+ride count, time) and a copy of their country. Triggers on rides and users keep it
+current whenever a ride is inserted, edited, deleted or made public/private, so
+/leaderboard reads the top N straight off the (distance) and (country, distance)
+indexes instead of aggregating every ride.
+
+The table is rebuilt from rides at the end of the migration.
+
+Run: python migrate_add_user_stats.py
+"""
+
+import sqlite3
+
+TRIGGERS = [
+    # Every user has a row, so riders without public rides still rank (with 0 km) like before
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_user_stats_user_insert AFTER INSERT ON users
+    BEGIN
+        INSERT OR IGNORE INTO user_stats (user_id, country) VALUES (NEW.id, NEW.country);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_user_stats_user_country AFTER UPDATE OF country ON users
+    BEGIN
+        UPDATE user_stats SET country = NEW.country WHERE user_id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_user_stats_user_delete AFTER DELETE ON users
+    BEGIN
+        DELETE FROM user_stats WHERE user_id = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_user_stats_ride_insert AFTER INSERT ON rides
+    WHEN NEW.public = 1
+    BEGIN
+        INSERT OR IGNORE INTO user_stats (user_id, country)
+            SELECT id, country FROM users WHERE id = NEW.user_id;
+        UPDATE user_stats
+           SET public_distance = public_distance + COALESCE(NEW.distance, 0),
+               public_rides = public_rides + 1,
+               public_time = public_time + COALESCE(NEW.time, 0)
+         WHERE user_id = NEW.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_user_stats_ride_delete AFTER DELETE ON rides
+    WHEN OLD.public = 1
+    BEGIN
+        UPDATE user_stats
+           SET public_distance = MAX(0, public_distance - COALESCE(OLD.distance, 0)),
+               public_rides = MAX(0, public_rides - 1),
+               public_time = MAX(0, public_time - COALESCE(OLD.time, 0))
+         WHERE user_id = OLD.user_id;
+    END
+    ''',
+    # Edits and public/private toggles: take the old values out, put the new ones in
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_user_stats_ride_update AFTER UPDATE OF public, distance, time, user_id ON rides
+    WHEN OLD.public = 1 OR NEW.public = 1
+    BEGIN
+        UPDATE user_stats
+           SET public_distance = MAX(0, public_distance - COALESCE(OLD.distance, 0)),
+               public_rides = MAX(0, public_rides - 1),
+               public_time = MAX(0, public_time - COALESCE(OLD.time, 0))
+         WHERE user_id = OLD.user_id AND OLD.public = 1;
+        INSERT OR IGNORE INTO user_stats (user_id, country)
+            SELECT id, country FROM users WHERE id = NEW.user_id AND NEW.public = 1;
+        UPDATE user_stats
+           SET public_distance = public_distance + COALESCE(NEW.distance, 0),
+               public_rides = public_rides + 1,
+               public_time = public_time + COALESCE(NEW.time, 0)
+         WHERE user_id = NEW.user_id AND NEW.public = 1;
+    END
+    ''',
+]
+
+INDEXES = [
+    # ties broken by user id so ranks are stable between requests
+    ('idx_user_stats_distance', 'user_stats', 'public_distance DESC, user_id'),
+    ('idx_user_stats_country_distance', 'user_stats', 'country, public_distance DESC, user_id'),
+]
+
+
+def install(conn):
+    """Create user_stats, its indexes and the triggers (idempotent, no commit)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            country TEXT,
+            public_distance REAL NOT NULL DEFAULT 0,
+            public_rides INTEGER NOT NULL DEFAULT 0,
+            public_time REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    for name, table, columns in INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+    for sql in TRIGGERS:
+        conn.execute(sql)
+
+
+def rebuild_user_stats(conn):
+    """
+    Recompute user_stats from users and rides; returns the number of rows written.
+    Does not commit: run it inside the caller's transaction.
+    """
+    conn.execute('DELETE FROM user_stats')
+    cur = conn.execute('''
+        INSERT INTO user_stats (user_id, country, public_distance, public_rides, public_time)
+        SELECT u.id, u.country,
+               COALESCE(SUM(r.distance), 0), COUNT(r.id), COALESCE(SUM(r.time), 0)
+        FROM users u
+        LEFT JOIN rides r ON r.user_id = u.id AND r.public = 1
+        GROUP BY u.id
+    ''')
+    return cur.rowcount
+
+
+def migrate():
+    conn = sqlite3.connect('moto_log.db')
+    try:
+        install(conn)
+        count = rebuild_user_stats(conn)
+        conn.commit()
+        print(f"✅ Created user_stats and triggers ({count} users backfilled)")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Migration failed: {e}")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -8,14 +8,19 @@ def column_exists(conn, table, column):
     cols = [r[1] for r in cur.fetchall()]
     return column in cols
 
+def install(conn):
+    """Add bikes.is_private if missing (idempotent, no commit); True if it was added"""
+    if column_exists(conn, 'bikes', 'is_private'):
+        return False
+    conn.execute("ALTER TABLE bikes ADD COLUMN is_private INTEGER DEFAULT 0")
+    return True
+
 def run():
     conn = sqlite3.connect(DB)
-    c = conn.cursor()
 
     # Add is_private to bikes if missing
     try:
-        if not column_exists(conn, 'bikes', 'is_private'):
-            c.execute("ALTER TABLE bikes ADD COLUMN is_private INTEGER DEFAULT 0")
+        if install(conn):
             print("Added column bikes.is_private")
     except sqlite3.OperationalError:
         print("Could not add column bikes.is_private")
@@ -1,9 +1,16 @@
 # migrate_events_optional_coords.py
 import sqlite3
 
+def install(conn):
+    """Add events.city if missing (idempotent, no commit); True if it was added"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(events)")]
+    if 'city' in columns:
+        return False
+    conn.execute('ALTER TABLE events ADD COLUMN city TEXT')
+    return True
+
 def migrate_optional_coords():
     conn = sqlite3.connect('moto_log.db')
-    c = conn.cursor()
     
     try:
         # Check if latitude/longitude are NOT NULL, if so we need to handle this carefully
@@ -11,11 +18,7 @@ def migrate_optional_coords():
         # For new installations, coordinates are already optional in the schema
         
         # Add city column if it doesn't exist (extracted from location_name)
-        c.execute("PRAGMA table_info(events)")
-        columns = [row[1] for row in c.fetchall()]
-        
-        if 'city' not in columns:
-            c.execute('ALTER TABLE events ADD COLUMN city TEXT')
+        if install(conn):
             print("✅ Added city column to events table")
         else:
             print("ℹ️ city column already exists")
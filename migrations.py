@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Schema migration runner.
+
+Every change to the schema is a numbered step in MIGRATIONS, recorded in the
+schema_version table once it has been applied. app.py calls apply_migrations() once
+at startup, so request handlers never run DDL: a database that is up to date costs a
+single SELECT on schema_version.
+
+Steps reuse the install(conn) function of the matching migrate_*.py script, which stay
+runnable on their own. Every step is idempotent (CREATE ... IF NOT EXISTS, columns
+added only when missing), so a database migrated by hand before this runner existed
+simply gets all its versions recorded on the first start, and a step interrupted
+before its version row was written is re-run safely.
+
+New schema changes get a new step at the end of MIGRATIONS; never renumber or edit a
+step that has shipped. migrate_fix_groups.py is not a step: it drops the group tables
+and is only for repairing a broken database by hand.
+
+Run: python migrations.py [path/to/moto_log.db]
+"""
+
+import sqlite3
+import sys
+from datetime import datetime
+
+import migrate_db
+import migrate_add_events
+import migrate_add_events_local
+import migrate_add_groups
+import migrate_add_last_read
+import migrate_add_ride_columns
+import migrate_add_ride_photos
+import migrate_events_optional_coords
+import migrate_make_coords_nullable
+import migrate_add_city_notifications
+import migrate_add_ride_progress
+import migrate_add_indexes
+import migrate_add_unread_counters
+import migrate_add_user_stats
+import migrate_add_leaderboard_buckets
+import migrate_add_ride_tracks
+import migrate_add_simplified_tracks
+import migrate_add_import_jobs
+import migrate_add_rejected_points
+import migrate_add_job_queue
+import migrate_add_broadcasts
+
+# Tables that predate the migrate_*.py scripts (init_db.py and the social features);
+# rides and gps_points used to be created on every /api/ride/start
+BASE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        country TEXT NOT NULL,
+        profile_pic TEXT,
+        bio TEXT,
+        emergency_name TEXT,
+        emergency_phone TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS bikes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        make_model TEXT,
+        year INTEGER,
+        odo REAL DEFAULT 0,
+        image TEXT,
+        notes TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS bike_maintenance (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bike_id INTEGER NOT NULL,
+        item TEXT NOT NULL,
+        date TEXT,
+        notes TEXT,
+        FOREIGN KEY (bike_id) REFERENCES bikes (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS maintenance (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        item TEXT NOT NULL,
+        due_date TEXT,
+        last_changed TEXT,
+        notes TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS rides (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        bike_id INTEGER,
+        date TEXT NOT NULL,
+        distance REAL NOT NULL,
+        time REAL NOT NULL,
+        description TEXT,
+        tags TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (bike_id) REFERENCES bikes (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS gps_points (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ride_id INTEGER NOT NULL,
+        latitude REAL,
+        longitude REAL,
+        speed REAL,
+        altitude REAL,
+        timestamp INTEGER,
+        FOREIGN KEY (ride_id) REFERENCES rides(id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS follows (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        follower_id INTEGER NOT NULL,
+        followed_id INTEGER NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS likes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        ride_id INTEGER NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        ride_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender_id INTEGER NOT NULL,
+        recipient_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        is_read INTEGER DEFAULT 0
+    )
+    ''',
+]
+
+# Columns the app writes that no migrate_*.py script ever added
+APP_COLUMNS = [
+    ('rides', 'is_private', 'INTEGER DEFAULT 0'),
+    ('bikes', 'additional_photos', "TEXT DEFAULT '[]'"),
+]
+
+
+def base_schema(conn):
+    for sql in BASE_TABLES:
+        conn.execute(sql)
+
+
+def app_columns(conn):
+    for table, column, definition in APP_COLUMNS:
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+# Aggregate tables are backfilled from the source rows when they are first created, in
+# the step's own transaction (the rebuild helpers never commit)
+def unread_counters(conn):
+    migrate_add_unread_counters.install(conn)
+    migrate_add_unread_counters.rebuild_counters(conn)
+
+
+def user_stats(conn):
+    migrate_add_user_stats.install(conn)
+    migrate_add_user_stats.rebuild_user_stats(conn)
+
+
+def leaderboard_buckets(conn):
+    migrate_add_leaderboard_buckets.install(conn)
+    migrate_add_leaderboard_buckets.rebuild_buckets(conn)
+
+
+# (version, name, step): applied in order, each at most once per database
+MIGRATIONS = [
+    (1, 'base_schema', base_schema),
+    (2, 'events', migrate_add_events.install),
+    (3, 'bikes_is_private', migrate_db.install),
+    (4, 'events_is_local', migrate_add_events_local.install),
+    (5, 'groups', migrate_add_groups.install),
+    (6, 'group_members_last_read', migrate_add_last_read.install),
+    (7, 'ride_columns', migrate_add_ride_columns.install),
+    (8, 'ride_photos', migrate_add_ride_photos.install),
+    (9, 'app_columns', app_columns),
+    (10, 'events_city', migrate_events_optional_coords.install),
+    (11, 'events_nullable_coords', migrate_make_coords_nullable.install),
+    (12, 'city_notifications', migrate_add_city_notifications.install),
+    (13, 'ride_progress', migrate_add_ride_progress.install),
+    (14, 'indexes', migrate_add_indexes.install),
+    (15, 'unread_counters', unread_counters),
+    (16, 'user_stats', user_stats),
+    (17, 'leaderboard_buckets', leaderboard_buckets),
+    # Existing gps_points are packed by migrate_add_ride_tracks.py, not at startup;
+    # load_ride_track reads either layout
+    (18, 'ride_tracks', migrate_add_ride_tracks.install),
+    (19, 'simplified_tracks', migrate_add_simplified_tracks.install),
+    (20, 'import_jobs', migrate_add_import_jobs.install),
+    (21, 'rejected_points', migrate_add_rejected_points.install),
+    (22, 'job_queue', migrate_add_job_queue.install),
+    (23, 'broadcasts', migrate_add_broadcasts.install),
+]
+
+
+def applied_versions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+
+def apply_migrations(database, migrations=MIGRATIONS):
+    """
+    Apply the steps not yet recorded in schema_version, each in its own transaction,
+    and return the (version, name) pairs applied. Runs on a private connection with
+    foreign keys off (table rebuilds must not cascade). Several processes starting at
+    once are fine: each step re-checks its version under the write lock.
+    """
+    conn = sqlite3.connect(database, timeout=30.0, isolation_level=None)
+    applied = []
+    try:
+        conn.execute('PRAGMA foreign_keys = OFF')
+        done = applied_versions(conn)
+        for version, name, step in migrations:
+            if version in done:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                    conn.rollback()
+                    continue
+                step(conn)
+                conn.execute('INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                             (version, name, datetime.now().isoformat()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append((version, name))
+    finally:
+        conn.close()
+    return applied
+
+
+def migrate(db_path='moto_log.db'):
+    try:
+        applied = apply_migrations(db_path)
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return False
+    for version, name in applied:
+        print(f"✅ {version:03d} {name}")
+    print(f"✅ Schema is at version {MIGRATIONS[-1][0]} ({len(applied)} steps applied)")
+    return True
+
+if __name__ == '__main__':
+    migrate(sys.argv[1] if len(sys.argv) > 1 else 'moto_log.db')
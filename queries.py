@@ -0,0 +1,694 @@
+"""
+Named SQL statements for app.py and the helper modules it passes its connection to
+(track_store, track_simplify, ride_export, ride_import).
+
+Every statement the app runs is a module-level constant here, so the SQL text of a
+query is one and the same string object on every call. That lets SQLite's per-connection
+statement cache (cached_statements, see DB_STATEMENT_CACHE in app.py) hand back the
+already prepared statement on the long-lived pooled connections instead of parsing it
+again, and gives every query a name for the per-query counters behind
+/api/debug/queries.
+
+Statements that used to be assembled per request are built once at import: the chat
+paging variants, the leaderboard rank queries for each board, and the events browser,
+whose optional filters are SQL parameters instead of string concatenation.
+
+QUERIES maps every name to its SQL (dict constants as NAME.key) and QUERY_NAMES is
+the reverse lookup. check_query_plans.py runs EXPLAIN QUERY PLAN over QUERIES.
+"""
+
+# ---- Accounts and profiles ----
+
+USER_INSERT = 'INSERT INTO users (username, email, password, country, city) VALUES (?, ?, ?, ?, ?)'
+USER_BY_EMAIL = 'SELECT * FROM users WHERE email = ?'
+USER_BY_ID = 'SELECT * FROM users WHERE id = ?'
+USER_ID_AND_NAME = 'SELECT id, username FROM users WHERE id = ?'
+USERNAME_BY_ID = 'SELECT username FROM users WHERE id = ?'
+USER_CARD = 'SELECT id, username, profile_pic FROM users WHERE id = ?'
+NAVBAR_USER = 'SELECT profile_pic, username FROM users WHERE id = ?'
+USERNAME_TAKEN = 'SELECT id FROM users WHERE username = ? AND id != ?'
+USER_SET_USERNAME = 'UPDATE users SET username = ? WHERE id = ?'
+USER_SET_PROFILE_PIC = 'UPDATE users SET profile_pic = ? WHERE id = ?'
+USER_SET_BIO = 'UPDATE users SET bio = ? WHERE id = ?'
+USER_SET_COUNTRY = 'UPDATE users SET country = ? WHERE id = ?'
+USER_SET_CITY = 'UPDATE users SET city = ? WHERE id = ?'
+USER_SET_EMERGENCY_CONTACT = 'UPDATE users SET emergency_name = ?, emergency_phone = ? WHERE id = ?'
+USER_SEARCH = 'SELECT id, username, profile_pic FROM users WHERE username LIKE ? COLLATE NOCASE LIMIT 30'
+USER_RIDE_COUNT = 'SELECT COUNT(*) as c FROM rides WHERE user_id = ?'
+USER_RIDE_DISTANCE = 'SELECT COALESCE(SUM(distance), 0) as d FROM rides WHERE user_id = ?'
+USER_PUBLIC_RIDE_COUNT = 'SELECT COUNT(*) as c FROM rides WHERE user_id = ? AND public = 1'
+USER_PUBLIC_RIDE_DISTANCE = 'SELECT COALESCE(SUM(distance), 0) as d FROM rides WHERE user_id = ? AND public = 1'
+USER_RIDES = 'SELECT * FROM rides WHERE user_id = ? ORDER BY date DESC'
+USER_RECENT_RIDES = 'SELECT * FROM rides WHERE user_id = ? ORDER BY date DESC LIMIT 10'
+USER_RECENT_PUBLIC_RIDES = 'SELECT * FROM rides WHERE user_id = ? AND public = 1 ORDER BY date DESC LIMIT 10'
+
+# ---- Deleting an account ----
+
+USER_LIKES_DELETE = 'DELETE FROM likes WHERE user_id = ?'
+USER_COMMENTS_DELETE = 'DELETE FROM comments WHERE user_id = ?'
+USER_FOLLOWS_DELETE = 'DELETE FROM follows WHERE follower_id = ? OR followed_id = ?'
+USER_MESSAGES_DELETE = 'DELETE FROM messages WHERE sender_id = ? OR recipient_id = ?'
+USER_GROUP_MESSAGES_DELETE = 'DELETE FROM group_messages WHERE sender_id = ?'
+USER_OWNED_GROUPS = 'SELECT id FROM groups WHERE owner_id = ?'
+USER_GROUP_MEMBERSHIPS_DELETE = 'DELETE FROM group_members WHERE user_id = ?'
+USER_RIDE_PROGRESS_DELETE = 'DELETE FROM ride_progress WHERE ride_id IN (SELECT id FROM rides WHERE user_id = ?)'
+USER_RIDE_TRACKS_DELETE = 'DELETE FROM ride_tracks WHERE ride_id IN (SELECT id FROM rides WHERE user_id = ?)'
+USER_RIDES_DELETE = 'DELETE FROM rides WHERE user_id = ?'
+USER_DELETE = 'DELETE FROM users WHERE id = ?'
+
+# ---- Follows ----
+
+USER_FOLLOWERS = '''
+    SELECT u.id, u.username, u.profile_pic
+    FROM users u
+    JOIN follows f ON u.id = f.follower_id
+    WHERE f.followed_id = ?
+    ORDER BY f.created_at DESC
+'''
+
+USER_FOLLOWING = '''
+    SELECT u.id, u.username, u.profile_pic
+    FROM users u
+    JOIN follows f ON u.id = f.followed_id
+    WHERE f.follower_id = ?
+    ORDER BY f.created_at DESC
+'''
+
+FOLLOW_ID = 'SELECT id FROM follows WHERE follower_id = ? AND followed_id = ?'
+FOLLOW_DELETE = 'DELETE FROM follows WHERE id = ?'
+FOLLOW_INSERT = 'INSERT INTO follows (follower_id, followed_id, created_at) VALUES (?, ?, datetime("now"))'
+MUTUAL_FOLLOWS = '''
+    SELECT DISTINCT u.id, u.username, u.profile_pic
+    FROM follows f
+    JOIN users u ON u.id = f.followed_id
+    WHERE f.follower_id = ?
+    AND u.id != ?
+    AND EXISTS (SELECT 1 FROM follows WHERE follower_id = u.id AND followed_id = ?)
+    ORDER BY u.username
+'''
+
+# ---- Bikes and maintenance ----
+
+USER_BIKES = 'SELECT * FROM bikes WHERE user_id = ?'
+GARAGE_BIKES = 'SELECT * FROM bikes WHERE user_id = ? ORDER BY name'
+TRACK_RIDE_BIKES = 'SELECT id, name, make_model FROM bikes WHERE user_id = ? ORDER BY name, make_model'
+BIKE_INSERT = 'INSERT INTO bikes (user_id,name,make_model,year,odo,image,notes,is_private) VALUES (?,?,?,?,?,?,?,?)'
+BIKE_BY_ID = 'SELECT * FROM bikes WHERE id = ?'
+BIKE_BY_ID_AND_USER = 'SELECT * FROM bikes WHERE id = ? AND user_id = ?'
+BIKE_OWNER = 'SELECT user_id FROM bikes WHERE id = ?'
+BIKE_NAME = 'SELECT name FROM bikes WHERE id = ?'
+BIKE_NAME_AND_MODEL = 'SELECT name, make_model FROM bikes WHERE id = ?'
+BIKE_UPDATE = 'UPDATE bikes SET name=?, make_model=?, year=?, odo=?, image=?, notes=?, is_private=?, additional_photos=? WHERE id=?'
+BIKE_RIDE_COUNT = 'SELECT COUNT(*) AS c FROM rides WHERE bike_id = ?'
+BIKE_RIDES_PAGE = 'SELECT * FROM rides WHERE bike_id = ? ORDER BY date DESC, id DESC LIMIT ? OFFSET ?'
+BIKE_MAINTENANCE = 'SELECT * FROM bike_maintenance WHERE bike_id = ? ORDER BY date DESC'
+BIKE_MAINTENANCE_INSERT = 'INSERT INTO bike_maintenance (bike_id, item, date, notes) VALUES (?, ?, ?, ?)'
+BIKE_MAINTENANCE_DELETE = 'DELETE FROM bike_maintenance WHERE id = ? AND bike_id = ?'
+USER_MAINTENANCE = 'SELECT * FROM maintenance WHERE user_id = ? ORDER BY due_date IS NULL, due_date'
+MAINTENANCE_INSERT = 'INSERT INTO maintenance (user_id, item, due_date, last_changed, notes) VALUES (?, ?, ?, ?, ?)'
+MAINTENANCE_DELETE = 'DELETE FROM maintenance WHERE id = ? AND user_id = ?'
+
+# ---- Groups ----
+
+GROUP_INSERT = 'INSERT INTO groups (name, owner_id, profile_pic) VALUES (?, ?, ?)'
+GROUP_BY_ID = 'SELECT * FROM groups WHERE id = ?'
+GROUP_SET_NAME = 'UPDATE groups SET name = ? WHERE id = ?'
+GROUP_SET_PROFILE_PIC = 'UPDATE groups SET profile_pic = ? WHERE id = ?'
+GROUP_MEMBERSHIP = 'SELECT id FROM group_members WHERE group_id = ? AND user_id = ?'
+GROUP_MEMBERS = '''
+    SELECT u.id, u.username, u.profile_pic FROM users u
+    JOIN group_members gm ON u.id = gm.user_id
+    WHERE gm.group_id = ?
+    ORDER BY u.username
+'''
+
+GROUP_MEMBER_IDS = 'SELECT user_id FROM group_members WHERE group_id = ?'
+GROUP_MEMBER_INSERT = 'INSERT INTO group_members (group_id, user_id) VALUES (?, ?)'
+GROUP_MEMBER_DELETE = 'DELETE FROM group_members WHERE group_id = ? AND user_id = ?'
+GROUP_MEMBER_MARK_READ = 'UPDATE group_members SET last_read = datetime("now") WHERE group_id = ? AND user_id = ?'
+GROUP_MESSAGE_INSERT = 'INSERT INTO group_messages (group_id, sender_id, content, created_at) VALUES (?, ?, ?, datetime("now"))'
+GROUP_MESSAGES_DELETE = 'DELETE FROM group_messages WHERE group_id = ?'
+GROUP_MEMBERS_DELETE = 'DELETE FROM group_members WHERE group_id = ?'
+GROUP_DELETE = 'DELETE FROM groups WHERE id = ?'
+
+# ---- Direct messages and chat ----
+
+INBOX_CONVERSATIONS = '''
+    SELECT u.id, u.username, u.profile_pic, c.last_msg_time, c.unread
+    FROM (
+        SELECT CASE WHEN sender_id = ? THEN recipient_id ELSE sender_id END AS other_user_id,
+               MAX(created_at) AS last_msg_time,
+               -- only messages FROM the other user TO you that are unread
+               SUM(CASE WHEN recipient_id = ? AND is_read = 0 THEN 1 ELSE 0 END) AS unread
+        FROM messages
+        WHERE sender_id = ? OR recipient_id = ?
+        GROUP BY other_user_id
+    ) c
+    JOIN users u ON u.id = c.other_user_id
+'''
+
+INBOX_GROUPS = '''
+    SELECT g.id, g.name, g.profile_pic, m.unread,
+           (SELECT MAX(created_at) FROM group_messages WHERE group_id = g.id) AS last_msg_time
+    FROM (SELECT group_id, SUM(unread_count) AS unread FROM group_members WHERE user_id = ? GROUP BY group_id) m
+    JOIN groups g ON g.id = m.group_id
+'''
+
+CHAT_UNREAD_COUNT = 'SELECT messages + group_messages AS c FROM unread_counters WHERE user_id = ?'
+MESSAGE_INSERT = 'INSERT INTO messages (sender_id, recipient_id, content, created_at) VALUES (?, ?, ?, datetime("now"))'
+MESSAGE_INSERT_UNREAD = 'INSERT INTO messages (sender_id, recipient_id, content, is_read, created_at) VALUES (?, ?, ?, 0, datetime("now"))'
+MESSAGES_MARK_READ = 'UPDATE messages SET is_read = 1 WHERE sender_id = ? AND recipient_id = ?'
+MESSAGES_MARK_READ_UPTO = 'UPDATE messages SET is_read = 1 WHERE sender_id = ? AND recipient_id = ? AND id <= ? AND is_read = 0'
+DM_STREAM_AFTER = '''
+    SELECT m.id, m.sender_id, m.content, m.created_at, u.username FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE m.id > ? AND ((m.sender_id = ? AND m.recipient_id = ?) OR (m.sender_id = ? AND m.recipient_id = ?))
+    ORDER BY m.id ASC
+    LIMIT ?
+'''
+
+GROUP_STREAM_AFTER = '''
+    SELECT gm.id, gm.sender_id, gm.content, gm.created_at, u.username FROM group_messages gm
+    LEFT JOIN users u ON gm.sender_id = u.id
+    WHERE gm.group_id = ? AND gm.id > ?
+    ORDER BY gm.id ASC
+    LIMIT ?
+'''
+
+# Conversation pages for chat_page(): the next page after a cursor, the page before a
+# cursor and the latest page, each fetching one row more than asked to tell if there is more
+def _chat_pages(select, id_column):
+    return {
+        'after': f'{select} AND {id_column} > ? ORDER BY {id_column} ASC LIMIT ?',
+        'before': f'{select} AND {id_column} < ? ORDER BY {id_column} DESC LIMIT ?',
+        'latest': f'{select} ORDER BY {id_column} DESC LIMIT ?',
+    }
+
+DM_PAGE = _chat_pages('''
+    SELECT m.*, u.username, u.profile_pic FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE ((m.sender_id = ? AND m.recipient_id = ?) OR (m.sender_id = ? AND m.recipient_id = ?))''', 'm.id')
+
+GROUP_PAGE = _chat_pages('''
+    SELECT gm.*, u.username, u.profile_pic FROM group_messages gm
+    LEFT JOIN users u ON gm.sender_id = u.id
+    WHERE gm.group_id = ?''', 'gm.id')
+
+# ---- Notifications ----
+
+NOTIFICATION_INSERT = '''
+    INSERT INTO notifications (user_id, type, actor_id, event_id, message, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+NOTIFICATIONS_UNREAD = '''
+    SELECT n.*, u.username as actor_username, u.id as actor_id,
+           e.title as event_title, e.id as event_id, 0 as is_broadcast
+    FROM notifications n
+    LEFT JOIN users u ON n.actor_id = u.id
+    LEFT JOIN events e ON n.event_id = e.id
+    WHERE n.user_id = ? AND n.is_read = 0
+    ORDER BY n.created_at DESC
+    LIMIT 20
+'''
+
+NOTIFICATION_UNREAD_COUNT = 'SELECT notifications FROM unread_counters WHERE user_id = ?'
+NOTIFICATION_BY_ID_AND_USER = 'SELECT * FROM notifications WHERE id = ? AND user_id = ?'
+NOTIFICATION_MARK_READ = 'UPDATE notifications SET is_read = 1 WHERE id = ?'
+NOTIFICATIONS_MARK_ALL_READ = 'UPDATE notifications SET is_read = 1 WHERE user_id = ?'
+
+# Broadcasts (migrate_add_broadcasts.py): one row per global notification; a user's
+# unread ones are those above their watermark that they have not read one by one
+BROADCAST_INSERT = '''
+    INSERT INTO broadcasts (type, actor_id, event_id, message, created_at)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+BROADCASTS_UNREAD = '''
+    SELECT b.id, b.type, b.actor_id, b.event_id, b.message, b.created_at,
+           u.username as actor_username, e.title as event_title, 1 as is_broadcast
+    FROM broadcasts b
+    LEFT JOIN users u ON b.actor_id = u.id
+    LEFT JOIN events e ON b.event_id = e.id
+    WHERE b.id > COALESCE((SELECT read_upto FROM broadcast_watermarks WHERE user_id = :user_id), 0)
+      AND NOT EXISTS (SELECT 1 FROM broadcast_reads r WHERE r.user_id = :user_id AND r.broadcast_id = b.id)
+    ORDER BY b.id DESC
+    LIMIT 20
+'''
+
+# Ids above the watermark, less the ones read one by one and the ids of deleted broadcasts;
+# negative only when the newest broadcasts were deleted after the watermark passed them
+BROADCAST_UNREAD_COUNT = '''
+    SELECT MAX(0, top.id - w.read_upto
+                  - (SELECT COUNT(*) FROM broadcast_reads r
+                     WHERE r.user_id = w.user_id AND r.broadcast_id > w.read_upto)
+                  - (SELECT COUNT(*) FROM broadcast_deletions d
+                     WHERE d.id > w.read_upto AND d.id <= top.id)) AS count
+    FROM broadcast_watermarks w, (SELECT COALESCE(MAX(id), 0) AS id FROM broadcasts) top
+    WHERE w.user_id = ?
+'''
+
+BROADCAST_BY_ID = 'SELECT id FROM broadcasts WHERE id = ?'
+BROADCAST_MARK_READ = 'INSERT OR IGNORE INTO broadcast_reads (user_id, broadcast_id) VALUES (?, ?)'
+BROADCASTS_MARK_ALL_READ = '''
+    INSERT INTO broadcast_watermarks (user_id, read_upto)
+    VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM broadcasts))
+    ON CONFLICT(user_id) DO UPDATE SET read_upto = MAX(read_upto, excluded.read_upto)
+'''
+BROADCAST_READS_PRUNE = '''
+    DELETE FROM broadcast_reads
+    WHERE user_id = ? AND broadcast_id <= (SELECT read_upto FROM broadcast_watermarks WHERE user_id = ?)
+'''
+BROADCASTS_DELETE_BY_EVENT = 'DELETE FROM broadcasts WHERE event_id = ?'
+
+# ---- Leaderboards ----
+
+LEADERBOARD_ALL_TIME = '''
+    SELECT u.id, u.username, u.country, u.profile_pic, ROUND(s.public_distance, 2) AS total_distance
+    FROM user_stats s
+    JOIN users u ON u.id = s.user_id
+    ORDER BY s.public_distance DESC, s.user_id
+    LIMIT ?
+'''
+
+LEADERBOARD_ALL_TIME_COUNTRY = '''
+    SELECT u.id, u.username, u.country, u.profile_pic, ROUND(s.public_distance, 2) AS total_distance
+    FROM user_stats s
+    JOIN users u ON u.id = s.user_id
+    WHERE s.country = ?
+    ORDER BY s.public_distance DESC, s.user_id
+    LIMIT ?
+'''
+
+LEADERBOARD_PERIOD = '''
+    SELECT u.id, u.username, u.country, u.profile_pic, ROUND(b.distance, 2) AS total_distance
+    FROM leaderboard_buckets b
+    JOIN users u ON u.id = b.user_id
+    WHERE b.period = ? AND b.bucket = ?
+    ORDER BY b.distance DESC, b.user_id
+    LIMIT ?
+'''
+
+LEADERBOARD_PERIOD_COUNTRY = '''
+    SELECT u.id, u.username, u.country, u.profile_pic, ROUND(b.distance, 2) AS total_distance
+    FROM leaderboard_buckets b
+    JOIN users u ON u.id = b.user_id
+    WHERE b.period = ? AND b.bucket = ? AND b.country = ?
+    ORDER BY b.distance DESC, b.user_id
+    LIMIT ?
+'''
+
+RANK_USER = 'SELECT id, username, country FROM users WHERE id = ?'
+
+# Rank queries for leaderboard_rank(): the table, distance column and filter of each board
+def _rank_queries(table, col, scope):
+    neighbours = f'''
+    SELECT u.id, u.username, u.country, u.profile_pic, ROUND(t.{col}, 2) AS total_distance, t.{col} AS sort_distance
+    FROM {table} t
+    JOIN users u ON u.id = t.user_id
+    WHERE {scope.replace('country', 't.country')} AND {{where}}
+    ORDER BY {{order}}
+    LIMIT ?
+'''
+    return {
+        'me': f'SELECT {col} AS distance FROM {table} WHERE {scope} AND user_id = ?',
+        'ahead': f'''
+    SELECT (SELECT COUNT(*) FROM {table} WHERE {scope} AND {col} > ?)
+         + (SELECT COUNT(*) FROM {table} WHERE {scope} AND {col} = ? AND user_id < ?) AS c
+''',
+        'above_tied': neighbours.format(where=f't.{col} = ? AND t.user_id < ?', order='t.user_id DESC'),
+        'above': neighbours.format(where=f't.{col} > ?', order=f't.{col} ASC, t.user_id DESC'),
+        'below_tied': neighbours.format(where=f't.{col} = ? AND t.user_id > ?', order='t.user_id ASC'),
+        'below': neighbours.format(where=f't.{col} < ?', order=f't.{col} DESC, t.user_id ASC'),
+    }
+
+# Keyed by board: all-time (user_stats) or a period bucket, optionally within one country
+RANK_QUERIES = {
+    'all': _rank_queries('user_stats', 'public_distance', '1 = 1'),
+    'all_country': _rank_queries('user_stats', 'public_distance', '1 = 1 AND country = ?'),
+    'bucket': _rank_queries('leaderboard_buckets', 'distance', 'period = ? AND bucket = ?'),
+    'bucket_country': _rank_queries('leaderboard_buckets', 'distance', 'period = ? AND bucket = ? AND country = ?'),
+}
+
+# ---- Rides, likes and comments ----
+
+RIDE_BY_ID = 'SELECT * FROM rides WHERE id = ?'
+RIDE_BY_ID_AND_USER = 'SELECT * FROM rides WHERE id = ? AND user_id = ?'
+RIDE_OWNER = 'SELECT user_id FROM rides WHERE id = ?'
+RIDE_VISIBILITY = 'SELECT public, user_id FROM rides WHERE id = ?'
+RIDE_INSERT_MANUAL = '''
+    INSERT INTO rides
+    (user_id, bike_id, date, public)
+    VALUES (?, ?, ?, 1)
+'''
+
+RIDE_UPDATE = '''
+    UPDATE rides SET bike_id = ?, date = ?, distance = ?, time = ?, description = ?, tags = ?, is_private = ?
+    WHERE id = ? AND user_id = ?
+'''
+
+RIDE_SET_PUBLIC = 'UPDATE rides SET public = ? WHERE id = ?'
+RIDE_HISTORY = '''
+    SELECT id, title, description, date, distance, time, avg_speed, top_speed, public, bike_id
+    FROM rides
+    WHERE user_id = ?
+    ORDER BY date DESC
+'''
+
+RIDE_VIEW = '''
+    SELECT id, title, description, date, distance, time, avg_speed, top_speed, public, bike_id, user_id, photos,
+           rejected_points
+    FROM rides
+    WHERE id = ?
+'''
+
+RIDE_TRACK_INFO = '''
+    SELECT t.point_count, CAST(strftime('%s', t.created_at) AS INTEGER) AS packed_at,
+           p.point_count AS recorded_points
+    FROM rides r
+    LEFT JOIN ride_tracks t ON t.ride_id = r.id
+    LEFT JOIN ride_progress p ON p.ride_id = r.id
+    WHERE r.id = ?
+'''
+
+RIDE_DELETE = 'DELETE FROM rides WHERE id = ?'
+RIDE_DELETE_BY_USER = 'DELETE FROM rides WHERE id = ? AND user_id = ?'
+RIDE_LIKES_DELETE = 'DELETE FROM likes WHERE ride_id = ?'
+RIDE_COMMENTS_DELETE = 'DELETE FROM comments WHERE ride_id = ?'
+RIDE_GPS_POINTS_DELETE = 'DELETE FROM gps_points WHERE ride_id = ?'
+RIDE_TRACK_DELETE = 'DELETE FROM ride_tracks WHERE ride_id = ?'
+RIDE_PROGRESS_DELETE = 'DELETE FROM ride_progress WHERE ride_id = ?'
+COMMENT_INSERT = 'INSERT INTO comments (ride_id, user_id, content, created_at) VALUES (?, ?, ?, datetime("now"))'
+LIKE_ID = 'SELECT id FROM likes WHERE user_id = ? AND ride_id = ?'
+LIKE_DELETE = 'DELETE FROM likes WHERE id = ?'
+LIKE_INSERT = 'INSERT INTO likes (user_id, ride_id, created_at) VALUES (?, ?, datetime("now"))'
+
+# ---- Events ----
+
+# Events browser: only upcoming and ongoing events. Every filter is optional (NULL = off):
+# :category, :city, :scope ('local' / 'global'), :search (a LIKE pattern); :popular sorts
+# by participants first
+EVENTS_BROWSE = '''
+    SELECT e.*, u.username, u.profile_pic,
+           COUNT(DISTINCT ep.user_id) as participant_count
+    FROM events e
+    JOIN users u ON e.creator_id = u.id
+    LEFT JOIN event_participants ep ON e.id = ep.event_id
+    WHERE e.status IN ('upcoming', 'ongoing')
+      AND (:category IS NULL OR e.category = :category)
+      AND (:city IS NULL OR e.city = :city)
+      AND (:scope IS NULL
+           OR (:scope = 'local' AND (e.is_local = 1 OR e.is_local IS NULL))
+           OR (:scope = 'global' AND e.is_local = 0))
+      AND (:search IS NULL OR e.title LIKE :search OR e.description LIKE :search
+           OR e.location_name LIKE :search OR e.city LIKE :search)
+    GROUP BY e.id
+    ORDER BY CASE WHEN :popular THEN participant_count END DESC, e.event_date ASC
+'''
+
+EVENT_BY_ID = 'SELECT * FROM events WHERE id = ?'
+EVENT_DETAIL = '''
+    SELECT e.*, u.id as creator_id, u.username as creator_username, u.profile_pic as creator_pic,
+           COUNT(DISTINCT ep.user_id) as participant_count
+    FROM events e
+    JOIN users u ON e.creator_id = u.id
+    LEFT JOIN event_participants ep ON e.id = ep.event_id
+    WHERE e.id = ?
+    GROUP BY e.id
+'''
+
+EVENT_PARTICIPANTS = '''
+    SELECT u.id, u.username, u.profile_pic
+    FROM users u
+    JOIN event_participants ep ON u.id = ep.user_id
+    WHERE ep.event_id = ?
+    ORDER BY ep.joined_at ASC
+'''
+
+EVENT_INSERT = '''
+    INSERT INTO events
+    (creator_id, title, description, event_date, location_name, city, latitude, longitude, category, max_participants, cover_image, is_local, status, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+EVENT_LATEST_BY_CREATOR = 'SELECT id FROM events WHERE creator_id = ? AND title = ? ORDER BY created_at DESC LIMIT 1'
+EVENT_UPDATE = '''
+    UPDATE events
+    SET title = ?, description = ?, event_date = ?, location_name = ?,
+        city = ?, latitude = ?, longitude = ?, max_participants = ?, cover_image = ?, updated_at = ?
+    WHERE id = ?
+'''
+
+EVENT_DELETE = 'DELETE FROM events WHERE id = ?'
+MY_EVENTS_JOINED = '''
+    SELECT e.*, u.username as creator_username, u.profile_pic as creator_pic,
+           COUNT(DISTINCT ep.user_id) as participant_count
+    FROM events e
+    JOIN users u ON e.creator_id = u.id
+    JOIN event_participants ep_user ON e.id = ep_user.event_id AND ep_user.user_id = ?
+    LEFT JOIN event_participants ep ON e.id = ep.event_id
+    GROUP BY e.id
+    ORDER BY e.event_date ASC
+'''
+
+MY_EVENTS_CREATED = '''
+    SELECT e.*, u.username as creator_username, u.profile_pic as creator_pic,
+           COUNT(DISTINCT ep.user_id) as participant_count
+    FROM events e
+    JOIN users u ON e.creator_id = u.id
+    LEFT JOIN event_participants ep ON e.id = ep.event_id
+    WHERE e.creator_id = ?
+    GROUP BY e.id
+    ORDER BY e.event_date ASC
+'''
+
+EVENT_PARTICIPATION = 'SELECT id FROM event_participants WHERE event_id = ? AND user_id = ?'
+EVENT_PARTICIPANT_COUNT = 'SELECT COUNT(*) as c FROM event_participants WHERE event_id = ?'
+EVENT_PARTICIPANT_INSERT = 'INSERT INTO event_participants (event_id, user_id, joined_at) VALUES (?, ?, ?)'
+EVENT_PARTICIPANT_DELETE = 'DELETE FROM event_participants WHERE event_id = ? AND user_id = ?'
+EVENT_CITIES = 'SELECT DISTINCT city FROM events WHERE city IS NOT NULL AND city <> ? ORDER BY city ASC'
+EVENT_CITIES_LOCAL = 'SELECT DISTINCT city FROM events WHERE city IS NOT NULL AND city <> ? AND (is_local = 1 OR is_local IS NULL) ORDER BY city ASC'
+EVENT_CITIES_GLOBAL = 'SELECT DISTINCT city FROM events WHERE city IS NOT NULL AND city <> ? AND is_local = 0 ORDER BY city ASC'
+USER_CITIES_IN_COUNTRY = 'SELECT DISTINCT city FROM users WHERE country = ? AND city IS NOT NULL AND city <> ? ORDER BY city ASC'
+# Audience of a new event for the notification fan-out, a page of users after an id at a time
+USERS_IN_CITY_AFTER = 'SELECT id FROM users WHERE city = ? AND id != ? AND id > ? ORDER BY id LIMIT ?'
+
+# ---- GPS ride tracking ----
+
+RIDE_INSERT_STARTED = '''
+    INSERT INTO rides (user_id, bike_id, date, distance, time)
+    VALUES (?, ?, ?, 0, 0)
+'''
+
+RIDE_RECORDING_STATE = '''
+    SELECT r.user_id, t.ride_id IS NOT NULL AS finished
+    FROM rides r LEFT JOIN ride_tracks t ON t.ride_id = r.id
+    WHERE r.id = ?
+'''
+
+GPS_POINT_INSERT = '''
+    INSERT INTO gps_points (ride_id, latitude, longitude, speed, altitude, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+RIDE_REJECT_POINT = 'UPDATE rides SET rejected_points = rejected_points + 1 WHERE id = ?'
+RIDE_REJECT_POINTS = 'UPDATE rides SET rejected_points = rejected_points + ? WHERE id = ?'
+RIDE_PROGRESS_BY_RIDE = 'SELECT * FROM ride_progress WHERE ride_id = ?'
+PROGRESS_COLUMNS = ('point_count', 'distance', 'moving_time', 'max_speed',
+                    'elevation_gain', 'elevation_loss', 'first_timestamp', 'last_timestamp',
+                    'last_latitude', 'last_longitude', 'last_altitude', 'out_of_order')
+
+RIDE_PROGRESS_UPSERT = f'''
+    INSERT OR REPLACE INTO ride_progress (ride_id, {', '.join(PROGRESS_COLUMNS)}, updated_at)
+    VALUES (?, {', '.join('?' for _ in PROGRESS_COLUMNS)}, ?)
+'''
+
+RIDE_FINISH = '''
+    UPDATE rides
+    SET title = ?, description = ?, distance = ?, time = ?,
+        avg_speed = ?, top_speed = ?, public = ?, rejected_points = rejected_points + ?
+    WHERE id = ?
+'''
+
+RIDE_SET_PHOTOS = 'UPDATE rides SET photos = ? WHERE id = ?'
+RIDE_TRACK_ACCESS = '''
+    SELECT r.user_id, r.public, t.point_count, CAST(strftime('%s', t.created_at) AS INTEGER) AS packed_at
+    FROM rides r LEFT JOIN ride_tracks t ON t.ride_id = r.id
+    WHERE r.id = ?
+'''
+
+RIDE_EXPORT_INFO = 'SELECT user_id, public, title, date FROM rides WHERE id = ?'
+
+# ---- Packed and simplified tracks ----
+# track_store.py and track_simplify.py; a page of rides is bound as one JSON array of ids
+
+RIDE_TRACK_DATA = 'SELECT data FROM ride_tracks WHERE ride_id = ?'
+RIDE_TRACK_POINT_COUNT = 'SELECT point_count FROM ride_tracks WHERE ride_id = ?'
+RIDES_TRACK_DATA = 'SELECT ride_id, data FROM ride_tracks WHERE ride_id IN (SELECT value FROM json_each(?))'
+
+RIDE_TRACK_STORE = '''
+    INSERT OR REPLACE INTO ride_tracks (ride_id, point_count, encoding, data, created_at)
+    VALUES (?, ?, ?, ?, datetime('now'))
+'''
+
+RIDE_TRACK_POINTS = '''
+    SELECT latitude, longitude, speed, altitude, timestamp
+    FROM gps_points WHERE ride_id = ? ORDER BY timestamp, id
+'''
+
+RIDES_TRACK_POINTS = '''
+    SELECT ride_id, latitude, longitude, speed, altitude, timestamp
+    FROM gps_points WHERE ride_id IN (SELECT value FROM json_each(?))
+    ORDER BY ride_id, timestamp, id
+'''
+
+SIMPLIFIED_TRACK_DATA = 'SELECT data FROM ride_track_simplified WHERE ride_id = ? AND tolerance = ?'
+
+SIMPLIFIED_TRACKS_DATA = '''
+    SELECT ride_id, data FROM ride_track_simplified
+    WHERE tolerance = ? AND ride_id IN (SELECT value FROM json_each(?))
+'''
+
+SIMPLIFIED_TRACK_STORE = '''
+    INSERT OR REPLACE INTO ride_track_simplified (ride_id, tolerance, point_count, data)
+    VALUES (?, ?, ?, ?)
+'''
+
+# ---- Exports ----
+# ride_export.py; the account archive's ride listing and its fingerprint share the ride columns
+
+_EXPORT_RIDE_FIELDS = 'id, user_id, bike_id, title, description, date, distance, time, avg_speed, top_speed, public'
+_EXPORT_RIDE_FIELDS_R = ', '.join('r.' + f for f in _EXPORT_RIDE_FIELDS.split(', '))
+
+EXPORT_RIDE = f'SELECT {_EXPORT_RIDE_FIELDS} FROM rides WHERE id = ?'
+EXPORT_PROFILE = '''
+    SELECT id, username, email, country, city, bio, emergency_name, emergency_phone FROM users WHERE id = ?
+'''
+EXPORT_BIKES = 'SELECT * FROM bikes WHERE user_id = ? ORDER BY id'
+
+EXPORT_RIDES = f'''
+    SELECT {_EXPORT_RIDE_FIELDS_R},
+           t.point_count AS packed_points,
+           EXISTS (SELECT 1 FROM gps_points p WHERE p.ride_id = r.id) AS has_points
+    FROM rides r LEFT JOIN ride_tracks t ON t.ride_id = r.id
+    WHERE r.user_id = ? ORDER BY r.date, r.id
+'''
+
+# account_export_version(): each ride row with its track state (packed, or count and last id of its points)
+EXPORT_VERSION_RIDES = f'''
+    SELECT {_EXPORT_RIDE_FIELDS_R},
+           t.point_count, t.created_at,
+           CASE WHEN t.ride_id IS NULL THEN
+               (SELECT COUNT(*) || ':' || IFNULL(MAX(p.id), 0) FROM gps_points p WHERE p.ride_id = r.id)
+           END
+    FROM rides r LEFT JOIN ride_tracks t ON t.ride_id = r.id
+    WHERE r.user_id = ? ORDER BY r.id
+'''
+
+# ---- Bulk ride import ----
+
+IMPORT_JOB_INSERT = '''
+    INSERT INTO import_jobs (user_id, bike_id, public, filename, status, created_at, updated_at)
+    VALUES (?, ?, ?, ?, 'queued', datetime('now'), datetime('now'))
+'''
+
+IMPORT_JOB_BY_ID = 'SELECT * FROM import_jobs WHERE id = ?'
+
+# Columns update_import_job() may set; the ones passed as NULL keep their value
+IMPORT_JOB_FIELDS = ('status', 'total', 'processed', 'imported', 'duplicates', 'failed', 'errors', 'finished_at')
+
+IMPORT_JOB_UPDATE = f'''
+    UPDATE import_jobs
+    SET {', '.join(f'{c} = COALESCE(:{c}, {c})' for c in IMPORT_JOB_FIELDS)},
+        updated_at = datetime('now')
+    WHERE id = :id
+'''
+
+# save_imported_rides() in ride_import.py; the batch's hashes are bound as one JSON array
+RIDE_IMPORTS_SEEN = '''
+    SELECT content_hash, ride_id FROM ride_imports
+    WHERE user_id = ? AND content_hash IN (SELECT value FROM json_each(?))
+'''
+
+RIDE_INSERT_IMPORTED = '''
+    INSERT INTO rides (user_id, bike_id, title, description, date, distance, time,
+                       avg_speed, top_speed, public, photos, rejected_points)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '[]', ?)
+'''
+
+RIDE_TRACK_INSERT_IMPORTED = '''
+    INSERT INTO ride_tracks (ride_id, point_count, encoding, data, created_at)
+    VALUES (?, ?, ?, ?, datetime('now'))
+'''
+
+RIDE_IMPORT_INSERT = '''
+    INSERT INTO ride_imports (user_id, content_hash, ride_id, source_name, imported_at)
+    VALUES (?, ?, ?, ?, datetime('now'))
+'''
+
+
+# ---- Background jobs ----
+
+JOB_INSERT = '''
+    INSERT INTO jobs (kind, payload, status, run_after, created_at, updated_at)
+    VALUES (?, ?, 'queued', datetime('now'), datetime('now'), datetime('now'))
+'''
+
+# Next job to run: queued and due, or left running by a worker whose lease (?: '-N seconds') expired
+JOB_NEXT = '''
+    SELECT id, kind, payload, cursor, attempts FROM jobs
+    WHERE (status = 'queued' AND run_after <= datetime('now'))
+       OR (status = 'running' AND run_after < datetime('now', ?))
+    ORDER BY id
+    LIMIT 1
+'''
+
+JOB_START = '''
+    UPDATE jobs SET status = 'running', attempts = attempts + 1, run_after = datetime('now'),
+                    started_at = datetime('now'), updated_at = datetime('now')
+    WHERE id = ?
+'''
+
+# Progress also renews the lease
+JOB_ADVANCE = "UPDATE jobs SET cursor = ?, run_after = datetime('now'), updated_at = datetime('now') WHERE id = ?"
+JOB_DONE = '''
+    UPDATE jobs SET status = 'done', last_error = NULL, run_after = datetime('now'),
+                    finished_at = datetime('now'), updated_at = datetime('now')
+    WHERE id = ?
+'''
+JOB_RETRY = '''
+    UPDATE jobs SET status = 'queued', last_error = ?, run_after = datetime('now', ?), updated_at = datetime('now')
+    WHERE id = ?
+'''
+JOB_FAIL = '''
+    UPDATE jobs SET status = 'failed', last_error = ?, finished_at = datetime('now'), updated_at = datetime('now')
+    WHERE id = ?
+'''
+JOB_PURGE_DONE = "DELETE FROM jobs WHERE status = 'done' AND run_after < datetime('now', ?)"
+JOB_COUNTS = 'SELECT status, COUNT(*) AS c FROM jobs GROUP BY status'
+
+# ---- Registry ----
+
+def _registry(namespace):
+    """Every upper-case str constant, and the str values of dict constants as NAME.key"""
+    queries = {}
+
+    def add(name, value):
+        if isinstance(value, str):
+            queries[name] = value
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                add(f'{name}.{key}', item)
+
+    for name, value in namespace.items():
+        if name.isupper() and not name.startswith('_'):
+            add(name, value)
+    return queries
+
+QUERIES = _registry(globals())
+
+QUERY_NAMES = {}
+for _name, _sql in QUERIES.items():
+    if _sql in QUERY_NAMES:
+        raise ValueError(f'{_name} repeats the SQL of {QUERY_NAMES[_sql]}')
+    QUERY_NAMES[_sql] = _name
@@ -0,0 +1,80 @@
+"""
+Run named SQL from queries.py on any connection, counted per query.
+
+run_query and execute_query record calls, time and rows under the query's name in
+queries.py (see QUERY_NAMES); /api/debug/queries serves the counters. app.py and the
+helper modules it calls with its connection (track_store, track_simplify, ride_export,
+ride_import) all go through them, so every statement shows up there.
+"""
+
+import threading
+import time
+
+import queries as sql
+
+
+class QueryStats:
+    """Per-query counters (calls, time, rows) keyed by the query's name in queries.py, plus commits"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._commits = 0
+        self._commit_time = 0.0
+
+    def record(self, query, seconds, rows):
+        name = sql.QUERY_NAMES.get(query, '(unregistered)')
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = {'calls': 0, 'total': 0.0, 'max': 0.0, 'rows': 0}
+            stat['calls'] += 1
+            stat['total'] += seconds
+            stat['max'] = max(stat['max'], seconds)
+            stat['rows'] += rows
+
+    def record_commit(self, seconds):
+        with self._lock:
+            self._commits += 1
+            self._commit_time += seconds
+
+    def commits(self):
+        with self._lock:
+            commits, total = self._commits, self._commit_time
+        return {
+            'count': commits,
+            'total_ms': round(total * 1000, 2),
+            'avg_ms': round(total * 1000 / commits, 3) if commits else 0.0,
+        }
+
+    def snapshot(self):
+        with self._lock:
+            stats = [(name, dict(stat)) for name, stat in self._stats.items()]
+        return sorted(({
+            'name': name,
+            'calls': stat['calls'],
+            'rows': stat['rows'],
+            'total_ms': round(stat['total'] * 1000, 2),
+            'avg_ms': round(stat['total'] * 1000 / stat['calls'], 3),
+            'max_ms': round(stat['max'] * 1000, 2),
+        } for name, stat in stats), key=lambda s: s['total_ms'], reverse=True)
+
+
+query_stats = QueryStats()
+
+
+def execute_query(conn, query, args=(), many=False):
+    """conn.execute (or executemany) counted in query_stats; returns the cursor"""
+    start = time.perf_counter()
+    cur = conn.executemany(query, args) if many else conn.execute(query, args)
+    query_stats.record(query, time.perf_counter() - start, max(cur.rowcount, 0))
+    return cur
+
+
+def run_query(conn, query, args=(), one=False):
+    """Execute and fetch on any connection, counted in query_stats; does not commit"""
+    start = time.perf_counter()
+    cur = conn.execute(query, args)
+    rv = cur.fetchall()
+    query_stats.record(query, time.perf_counter() - start, len(rv) if cur.description else max(cur.rowcount, 0))
+    return (rv[0] if rv else None) if one else rv
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Rebuild the leaderboard aggregates from the rides table: the all-time user_stats rows
+and the weekly / monthly / yearly leaderboard_buckets. Use it to backfill an existing
+database or to repair the aggregates if they ever drift from rides.
+
+Each table is rebuilt in its own transaction, so it is safe against a live database.
+
+Run: python rebuild_leaderboards.py [path/to/moto_log.db]
+"""
+
+import sqlite3
+import sys
+
+from migrate_add_user_stats import rebuild_user_stats
+from migrate_add_leaderboard_buckets import rebuild_buckets
+
+def rebuild(db_path='moto_log.db'):
+    conn = sqlite3.connect(db_path, timeout=10.0)
+    try:
+        with conn:
+            users = rebuild_user_stats(conn)
+        with conn:
+            buckets = rebuild_buckets(conn)
+        print(f"✅ Rebuilt user_stats ({users} users) and leaderboard_buckets ({buckets} buckets)")
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    rebuild(sys.argv[1] if len(sys.argv) > 1 else 'moto_log.db')
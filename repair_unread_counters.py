@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Consistency repair: recompute the unread counters (unread_counters, group_members.unread_count)
+from messages, group_messages and notifications, and report how many users were off.
+
+Safe to run against a live database; the rebuild is a single transaction.
+
+Run: python repair_unread_counters.py [path/to/moto_log.db]
+"""
+
+import sqlite3
+import sys
+
+from migrate_add_unread_counters import rebuild_counters
+
+def repair(db_path='moto_log.db'):
+    conn = sqlite3.connect(db_path, timeout=10.0)
+    try:
+        with conn:
+            fixed = rebuild_counters(conn)
+        print(f"✅ Unread counters rebuilt, {fixed} users had drifted")
+        return fixed
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    repair(sys.argv[1] if len(sys.argv) > 1 else 'moto_log.db')
@@ -0,0 +1,277 @@
+"""
+Streaming ride exports: one ride as GPX, GeoJSON or CSV, and a whole account as a zip.
+
+Every exporter is a generator of text chunks. Points are read a batch at a time,
+either sliced out of the decoded ride_tracks blob of a finished ride or pulled from a
+gps_points cursor with fetchmany() for a ride still recording, so a response never
+holds more than one ride's packed track (a few bytes per point) plus one batch of
+formatted text. gzip_chunks() compresses the stream on the fly.
+
+The account archive is written to disk rather than streamed, so it can be served with
+a Content-Length and byte ranges (resumable downloads); account_export_version() is a
+fingerprint of everything in it, so the file is only rebuilt when the account changes.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import re
+import zlib
+import zipfile
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+import queries as sql
+from query_runner import execute_query, run_query
+from track_store import COLUMNS, decode_track
+
+EXPORT_FORMATS = {
+    'gpx': 'application/gpx+xml',
+    'geojson': 'application/geo+json',
+    'csv': 'text/csv',
+}
+EXPORT_BATCH = 5000          # points formatted per chunk
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Bump when the archive layout changes so cached account exports are rebuilt
+ACCOUNT_EXPORT_LAYOUT = 1
+
+
+def _none_if_nan(values):
+    return [None if v != v else v for v in values.tolist()]
+
+
+def iter_track_batches(conn, ride_id, batch=EXPORT_BATCH):
+    """
+    Points of a ride in time order, as lists of up to `batch` (latitude, longitude,
+    speed, altitude, timestamp) tuples with None for missing values. Reads the packed
+    track of a finished ride, otherwise streams gps_points through a cursor.
+    """
+    row = run_query(conn, sql.RIDE_TRACK_DATA, (ride_id,), one=True)
+    if row:
+        track = decode_track(row[0])
+        for start in range(0, len(track['latitude']), batch):
+            yield list(zip(*(_none_if_nan(track[c][start:start + batch]) for c in COLUMNS)))
+        return
+    cur = execute_query(conn, sql.RIDE_TRACK_POINTS, (ride_id,))
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            break
+        yield [tuple(r) for r in rows]
+
+
+def iso_times(stamps):
+    """
+    Epoch seconds as ISO 8601 UTC strings ('Z'), None for missing ones. Milliseconds are
+    kept if any stamp in the batch has them. Formatted by NumPy in one call per batch,
+    ~5x faster than a datetime per point.
+    """
+    values = np.array([np.nan if s is None else s for s in stamps], dtype=np.float64)
+    present = ~np.isnan(values)
+    out = [None] * len(values)
+    if present.any():
+        ms = np.round(values[present] * 1000).astype(np.int64)
+        unit = 's' if not np.any(ms % 1000) else 'ms'
+        text = np.datetime_as_string(ms.astype('datetime64[ms]'), unit=unit).tolist()
+        for i, t in zip(np.flatnonzero(present).tolist(), text):
+            out[i] = t + 'Z'
+    return out
+
+
+def _stamp(stamp):
+    if stamp is None:
+        return ''
+    return str(int(stamp)) if stamp == int(stamp) else f'{stamp:.3f}'
+
+
+def _num(value, digits):
+    return '' if value is None else f'{value:.{digits}f}'
+
+
+def gpx_chunks(conn, ride):
+    """GPX 1.1 document for a ride (speed, in m/s, goes in a Garmin TrackPointExtension)"""
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="Moto Log" xmlns="http://www.topografix.com/GPX/1/1" '
+           'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2">\n')
+    yield f'<metadata><name>{escape(ride["title"] or "Ride")}</name></metadata>\n'
+    yield f'<trk><name>{escape(ride["title"] or "Ride")}</name>'
+    if ride['description']:
+        yield f'<desc>{escape(ride["description"])}</desc>'
+    yield '<trkseg>\n'
+    for points in iter_track_batches(conn, ride['id']):
+        out = []
+        times = iso_times([p[4] for p in points])
+        for (lat, lon, speed, alt, stamp), when in zip(points, times):
+            if lat is None or lon is None:
+                continue
+            out.append(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}">')
+            if alt is not None:
+                out.append(f'<ele>{alt:.2f}</ele>')
+            if when is not None:
+                out.append(f'<time>{when}</time>')
+            if speed is not None:
+                out.append('<extensions><gpxtpx:TrackPointExtension>'
+                           f'<gpxtpx:speed>{speed / 3.6:.2f}</gpxtpx:speed>'
+                           '</gpxtpx:TrackPointExtension></extensions>')
+            out.append('</trkpt>\n')
+        yield ''.join(out)
+    yield '</trkseg></trk>\n</gpx>\n'
+
+
+def geojson_chunks(conn, ride):
+    """
+    GeoJSON Feature with a LineString ([lon, lat, ele]) and the point times in
+    properties.coordTimes, the convention used by togeojson and Mapbox. The times are
+    a second pass over the track so neither array is ever built in memory.
+    """
+    properties = {
+        'id': ride['id'],
+        'title': ride['title'],
+        'date': ride['date'],
+        'distance_km': ride['distance'],
+        'time_s': ride['time'],
+        'avg_speed_kmh': ride['avg_speed'],
+        'top_speed_kmh': ride['top_speed'],
+    }
+    head = json.dumps(properties)[:-1]
+    yield '{"type": "Feature", "geometry": {"type": "LineString", "coordinates": ['
+    first = True
+    for points in iter_track_batches(conn, ride['id']):
+        out = []
+        for lat, lon, speed, alt, stamp in points:
+            if lat is None or lon is None:
+                continue
+            coord = f'[{lon:.7f}, {lat:.7f}, {alt:.2f}]' if alt is not None else f'[{lon:.7f}, {lat:.7f}]'
+            out.append(coord if first else ', ' + coord)
+            first = False
+        yield ''.join(out)
+    yield ']}, "properties": ' + head + ', "coordTimes": ['
+    first = True
+    for points in iter_track_batches(conn, ride['id']):
+        out = []
+        times = iso_times([p[4] for p in points])
+        for (lat, lon, speed, alt, stamp), when in zip(points, times):
+            if lat is None or lon is None:
+                continue
+            value = f'"{when}"' if when else 'null'
+            out.append(value if first else ', ' + value)
+            first = False
+        yield ''.join(out)
+    yield ']}}\n'
+
+
+def csv_chunks(conn, ride):
+    """One CSV row per point: epoch and ISO time, position, altitude (m), speed (km/h)"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(('timestamp', 'time', 'latitude', 'longitude', 'altitude', 'speed'))
+    for points in iter_track_batches(conn, ride['id']):
+        times = iso_times([p[4] for p in points])
+        writer.writerows(
+            (_stamp(stamp), when or '', _num(lat, 7), _num(lon, 7), _num(alt, 2), _num(speed, 2))
+            for (lat, lon, speed, alt, stamp), when in zip(points, times))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+EXPORTERS = {
+    'gpx': gpx_chunks,
+    'geojson': geojson_chunks,
+    'csv': csv_chunks,
+}
+
+
+def _fetch_ride(conn, ride_id):
+    cur = execute_query(conn, sql.EXPORT_RIDE, (ride_id,))
+    row = cur.fetchone()
+    return dict(zip([d[0] for d in cur.description], row)) if row else None
+
+
+def export_ride(conn, ride_id, fmt):
+    """Chunks of one ride in `fmt` (a key of EXPORT_FORMATS), or None if there is no such ride"""
+    ride = _fetch_ride(conn, ride_id)
+    if ride is None:
+        return None
+    return EXPORTERS[fmt](conn, ride)
+
+
+def coalesce(chunks, size=EXPORT_CHUNK_BYTES):
+    """Re-chunk a stream of text into UTF-8 byte chunks of about `size` bytes"""
+    parts, length = [], 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        parts.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzip_chunks(chunks, level=6):
+    """gzip-compress a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def slugify(text, default='ride'):
+    slug = re.sub(r'[^a-z0-9]+', '-', (text or '').lower()).strip('-')[:40]
+    return slug or default
+
+
+def account_export_version(conn, user_id):
+    """
+    Fingerprint of everything the account archive contains: profile, bikes, ride rows
+    and each ride's track state. Changes whenever any of them does.
+    """
+    digest = hashlib.sha256(f'layout{ACCOUNT_EXPORT_LAYOUT}'.encode())
+    for query in (sql.USER_BY_ID, sql.EXPORT_BIKES, sql.EXPORT_VERSION_RIDES):
+        for row in execute_query(conn, query, (user_id,)):
+            digest.update(repr(tuple(row)).encode())
+        digest.update(b'|')
+    return digest.hexdigest()[:32]
+
+
+def write_account_export(conn, user_id, fileobj):
+    """
+    Write a zip of the account to `fileobj`: profile.json, bikes.json, rides.csv (one
+    summary row per ride) and rides/<id>-<title>.gpx for every ride with a track. Each
+    GPX member is streamed into the archive batch by batch.
+    """
+    cur = execute_query(conn, sql.EXPORT_PROFILE, (user_id,))
+    user = cur.fetchone()
+    profile = dict(zip([d[0] for d in cur.description], user)) if user else {}
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('profile.json', json.dumps(profile, indent=2, default=str))
+        cur = execute_query(conn, sql.EXPORT_BIKES, (user_id,))
+        names = [d[0] for d in cur.description]
+        bikes = [dict(zip(names, b)) for b in cur]
+        archive.writestr('bikes.json', json.dumps(bikes, indent=2, default=str))
+
+        cur = execute_query(conn, sql.EXPORT_RIDES, (user_id,))
+        names = [d[0] for d in cur.description]
+        rides = cur.fetchall()
+        summary = io.StringIO()
+        writer = csv.writer(summary, lineterminator='\n')
+        writer.writerow(('id', 'date', 'title', 'bike_id', 'distance_km', 'time_s', 'avg_speed_kmh',
+                         'top_speed_kmh', 'public', 'track_file'))
+        for ride in rides:
+            ride = dict(zip(names, ride))
+            track_file = ''
+            if ride['packed_points'] or ride['has_points']:
+                track_file = f'rides/{ride["id"]}-{slugify(ride["title"])}.gpx'
+                with archive.open(track_file, 'w', force_zip64=True) as member:
+                    for chunk in coalesce(gpx_chunks(conn, ride)):
+                        member.write(chunk)
+            writer.writerow((ride['id'], ride['date'], ride['title'], ride['bike_id'], ride['distance'],
+                             ride['time'], ride['avg_speed'], ride['top_speed'], ride['public'], track_file))
+        archive.writestr('rides.csv', summary.getvalue())
@@ -0,0 +1,300 @@
+"""
+Importing finished rides from track files: GPX, TCX and FIT, plain or gzipped (the
+layout of Strava / Garmin bulk exports), one at a time or a whole zip archive.
+
+    read_track_file()      file name + bytes -> (track arrays, meta)
+    parse_archive_member() runs in a worker process: read one archive member, compute
+                           its stats and pack its track, returning only small picklable
+                           results (stats dict and the packed blob)
+    save_imported_rides()  write a batch of parsed rides in one transaction, skipping
+                           tracks the user already has
+
+Tracks are de-duplicated per user on a SHA-256 of their positions (to ~1 m) and times
+(to the second) as parsed, before any filtering, so uploading the same files twice
+imports them once (see migrate_add_import_jobs.py). Speed and altitude are left out:
+GPX exports derive speed and FIT rounds altitude to 0.2 m, so a GPX and a FIT export of
+one ride match whenever their points and clocks agree.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import struct
+import xml.etree.ElementTree as ET
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+import queries as sql
+from query_runner import execute_query, run_query
+from gpx_import import read_gpx_track, parse_gpx_time, _local, _float
+from track_filter import clean_ride_track
+from track_store import COLUMNS, ENCODING, encode_track
+
+TRACK_EXTENSIONS = ('.gpx', '.tcx', '.fit')
+# Guard rails for archives: members larger than this (uncompressed, after gunzip) are skipped
+MAX_MEMBER_BYTES = 200 * 1024 * 1024
+
+
+def track_format(filename):
+    """'gpx' / 'tcx' / 'fit' for a supported (optionally .gz) file name, else None"""
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    for ext in TRACK_EXTENSIONS:
+        if name.endswith(ext):
+            return ext[1:]
+    return None
+
+
+def _columns_to_track(columns):
+    track = {c: np.asarray(columns[c], dtype=np.float64) for c in COLUMNS}
+    if np.any(np.diff(track['timestamp']) < 0):
+        order = np.argsort(track['timestamp'], kind='stable')
+        track = {c: v[order] for c, v in track.items()}
+    return track
+
+
+def read_tcx_track(source):
+    """Stream-parse a Garmin TCX file into a track dict (same shape as read_gpx_track)"""
+    columns = {c: [] for c in COLUMNS}
+    nan = float('nan')
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if _local(elem.tag) != 'Trackpoint':
+            continue
+        values = {_local(child.tag): child.text for child in elem.iter()}
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+
+        lat, lon = _float(values.get('LatitudeDegrees')), _float(values.get('LongitudeDegrees'))
+        if lat is None or lon is None:
+            continue  # indoor / paused samples carry no position
+        stamp = parse_gpx_time(values.get('Time'))
+        altitude = _float(values.get('AltitudeMeters'))
+        speed = _float(values.get('Speed'))
+        columns['latitude'].append(lat)
+        columns['longitude'].append(lon)
+        columns['timestamp'].append(nan if stamp is None else stamp)
+        columns['altitude'].append(nan if altitude is None else altitude)
+        columns['speed'].append(nan if speed is None else speed * 3.6)
+    return _columns_to_track(columns)
+
+
+# ---- FIT (Garmin binary) ----
+
+FIT_EPOCH = 631065600  # 1989-12-31T00:00:00Z
+FIT_RECORD = 20
+SEMICIRCLES_TO_DEG = 180.0 / 2 ** 31
+# Record message fields we read: field number -> (name, struct code, invalid value, scale, offset);
+# decoded value = raw / scale - offset, giving degrees, meters and km/h
+FIT_RECORD_FIELDS = {
+    253: ('timestamp', 'I', 0xFFFFFFFF, 1, 0),
+    0: ('latitude', 'i', 0x7FFFFFFF, 1 / SEMICIRCLES_TO_DEG, 0),
+    1: ('longitude', 'i', 0x7FFFFFFF, 1 / SEMICIRCLES_TO_DEG, 0),
+    2: ('altitude', 'H', 0xFFFF, 5, 500),
+    78: ('enhanced_altitude', 'I', 0xFFFFFFFF, 5, 500),
+    6: ('speed', 'H', 0xFFFF, 1000 / 3.6, 0),
+    73: ('enhanced_speed', 'I', 0xFFFFFFFF, 1000 / 3.6, 0),
+}
+
+
+def read_fit_track(data):
+    """
+    Decode the record messages of a FIT file (bytes) into a track dict. Handles normal
+    and compressed-timestamp headers and skips developer fields; only position,
+    timestamp, altitude and speed are read.
+    """
+    if len(data) < 12 or data[8:12] != b'.FIT':
+        raise ValueError('Not a FIT file')
+    header_size = data[0]
+    end = min(len(data), header_size + struct.unpack_from('<I', data, 4)[0])
+    pos = header_size
+    definitions = {}
+    last_timestamp = None
+    columns = {c: [] for c in COLUMNS}
+    nan = float('nan')
+
+    while pos < end:
+        header = data[pos]
+        pos += 1
+        if header & 0x80:
+            # Compressed timestamp header: 5-bit offset from the last full timestamp
+            local = (header >> 5) & 0x03
+            offset = header & 0x1F
+            compressed = None
+            if last_timestamp is not None:
+                compressed = last_timestamp + ((offset - (last_timestamp & 0x1F)) & 0x1F)
+        elif header & 0x40:
+            local = header & 0x0F
+            endian = '>' if data[pos + 1] else '<'
+            global_num = struct.unpack_from(endian + 'H', data, pos + 2)[0]
+            count = data[pos + 4]
+            pos += 5
+            fields = [(data[pos + 3 * i], data[pos + 3 * i + 1]) for i in range(count)]
+            pos += 3 * count
+            dev_size = 0
+            if header & 0x20:
+                dev_count = data[pos]
+                pos += 1
+                dev_size = sum(data[pos + 3 * i + 1] for i in range(dev_count))
+                pos += 3 * dev_count
+            definitions[local] = (global_num, endian, fields, dev_size)
+            continue
+        else:
+            local = header & 0x0F
+            compressed = None
+
+        if local not in definitions:
+            raise ValueError('FIT data message without a definition')
+        global_num, endian, fields, dev_size = definitions[local]
+        values = {}
+        for num, size in fields:
+            spec = FIT_RECORD_FIELDS.get(num)
+            if spec and struct.calcsize(spec[1]) == size and (global_num == FIT_RECORD or num == 253):
+                raw = struct.unpack_from(endian + spec[1], data, pos)[0]
+                if raw != spec[2]:
+                    name, _, _, scale, offset = spec
+                    values[name] = raw if name == 'timestamp' else raw / scale - offset
+            pos += size
+        pos += dev_size
+
+        if 'timestamp' in values:
+            last_timestamp = values['timestamp']
+        elif compressed is not None:
+            values['timestamp'] = last_timestamp = compressed
+        if global_num != FIT_RECORD or 'latitude' not in values or 'longitude' not in values:
+            continue
+
+        columns['latitude'].append(values['latitude'])
+        columns['longitude'].append(values['longitude'])
+        columns['timestamp'].append(values['timestamp'] + FIT_EPOCH if 'timestamp' in values else nan)
+        columns['altitude'].append(values.get('enhanced_altitude', values.get('altitude', nan)))
+        columns['speed'].append(values.get('enhanced_speed', values.get('speed', nan)))
+    return _columns_to_track(columns)
+
+
+def read_track_file(filename, data):
+    """
+    Parse a track file given its name and raw bytes (gzip is unwrapped). Returns
+    (track, meta) where meta may carry a 'name'. Raises ValueError for unsupported or
+    unreadable files.
+    """
+    fmt = track_format(filename)
+    if fmt is None:
+        raise ValueError(f'Unsupported file type: {filename}')
+    if filename.lower().endswith('.gz'):
+        # Read at most one byte past the limit: a small .gz can inflate to gigabytes
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as gz:
+            data = gz.read(MAX_MEMBER_BYTES + 1)
+        if len(data) > MAX_MEMBER_BYTES:
+            raise ValueError(f'{filename} is too large')
+    meta = {}
+    try:
+        if fmt == 'fit':
+            track = read_fit_track(data)
+        elif fmt == 'tcx':
+            track = read_tcx_track(io.BytesIO(data.lstrip()))
+        else:
+            track = read_gpx_track(io.BytesIO(data.lstrip()), meta)
+    except (ET.ParseError, struct.error, IndexError) as e:
+        raise ValueError(f'Could not parse {filename}: {e}')
+    return track, meta
+
+
+# Decimal places of the de-duplication key: ~1 m positions, whole seconds
+HASH_DECIMALS = {'latitude': 5, 'longitude': 5, 'timestamp': 0}
+
+
+def track_hash(track):
+    """De-duplication key of a parsed track: its rounded positions and times only"""
+    digest = hashlib.sha256()
+    for column, decimals in HASH_DECIMALS.items():
+        # + 0.0 turns -0.0 into 0.0, which has different bytes
+        digest.update((np.round(track[column], decimals) + 0.0).astype('<f8').tobytes())
+    return digest.hexdigest()
+
+
+def prepare_ride(filename, track, meta):
+    """Stats, packed blob and row values for a parsed track; raises ValueError if too short"""
+    key = track_hash(track)
+    track, stats, rejected = clean_ride_track(track)
+    count = len(track['latitude'])
+    if count < 2:
+        raise ValueError(f'Not enough track points in {filename}')
+    first = track['timestamp'][0]
+    started = datetime.fromtimestamp(first) if first == first else datetime.now()
+    blob = encode_track(track)
+    stem = os.path.basename(filename).split('.')[0]
+    return {
+        'name': filename,
+        'title': meta.get('name') or stem or 'Imported Ride',
+        'date': started.isoformat(),
+        'stats': stats,
+        'point_count': count,
+        'rejected': rejected,
+        'data': blob,
+        'hash': key,
+    }
+
+
+def parse_archive_member(archive_path, member):
+    """
+    Worker-process entry point: parse one member of a zip archive. Returns
+    {'ride': prepared ride} or {'name': member, 'error': message}.
+    """
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            info = archive.getinfo(member)
+            if info.file_size > MAX_MEMBER_BYTES:
+                raise ValueError(f'{member} is too large')
+            data = archive.read(member)
+        track, meta = read_track_file(member, data)
+        return {'ride': prepare_ride(member, track, meta)}
+    except (ValueError, OSError, zipfile.BadZipFile, EOFError) as e:
+        return {'name': member, 'error': str(e)}
+
+
+def archive_members(archive_path):
+    """Names of the supported track files in a zip archive, in archive order"""
+    with zipfile.ZipFile(archive_path) as archive:
+        return [info.filename for info in archive.infolist()
+                if not info.is_dir() and track_format(info.filename)
+                and not os.path.basename(info.filename).startswith('.')]
+
+
+def save_imported_rides(conn, user_id, rides, bike_id=None, public=1, description=''):
+    """
+    Insert a batch of prepared rides (rides row, ride_tracks blob, ride_imports hash) in
+    a single transaction. Tracks the user already imported, or repeated within the
+    batch, are skipped. Returns two lists of (name, ride_id): the rides inserted and the
+    duplicates (with the id of the ride they duplicate).
+    """
+    if not rides:
+        return [], []
+    inserted, duplicates = [], []
+    with conn:
+        seen = dict(run_query(conn, sql.RIDE_IMPORTS_SEEN, (user_id, json.dumps([r['hash'] for r in rides]))))
+        for ride in rides:
+            if ride['hash'] in seen:
+                duplicates.append((ride['name'], seen[ride['hash']]))
+                continue
+            stats = ride['stats']
+            cur = execute_query(conn, sql.RIDE_INSERT_IMPORTED, (
+                user_id, bike_id, ride['title'], description, ride['date'], stats['distance'],
+                stats['time'], stats['avg_speed'], stats['top_speed'], 1 if public else 0,
+                ride['rejected']))
+            ride_id = cur.lastrowid
+            execute_query(conn, sql.RIDE_TRACK_INSERT_IMPORTED, (ride_id, ride['point_count'], ENCODING, ride['data']))
+            execute_query(conn, sql.RIDE_IMPORT_INSERT, (user_id, ride['hash'], ride_id, ride['name']))
+            seen[ride['hash']] = ride_id
+            inserted.append((ride['name'], ride_id))
+    return inserted, duplicates
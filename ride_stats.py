@@ -0,0 +1,230 @@
+"""
+Vectorized ride statistics.
+
+All per-segment work (haversine distance, duration, implied speed) is done in one
+NumPy pass over the whole track instead of a Python loop per GPS point.
+
+Distance uses the same haversine formula (R = 6371 km, atan2 form) as the old
+per-point loop that app.calculate_ride_stats used to run, in float64. The two agree to within
+1e-9 relative (well under 1 m per 1000 km), so the rounded 2-decimal km value
+stored on the ride is unchanged. See bench_ride_stats.py for the comparison.
+"""
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371 * 1000
+STOPPED_SPEED_KMH = 3.0  # segments slower than this count as stopped time
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Element-wise great-circle distance in meters between arrays of coordinates"""
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    delta_lat = np.radians(lat2 - lat1)
+    delta_lon = np.radians(lon2 - lon1)
+
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(delta_lon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_M * c
+
+
+def track_arrays(points):
+    """
+    Convert GPS point rows (sqlite3.Row or dicts with latitude, longitude, speed,
+    altitude, timestamp) into a dict of float64 arrays. Missing values become NaN.
+    """
+    columns = ('latitude', 'longitude', 'speed', 'altitude', 'timestamp')
+    n = len(points)
+    out = {c: np.full(n, np.nan) for c in columns}
+    if n == 0:
+        return out
+    first = points[0]
+    keys = list(first.keys())
+    # One conversion of the whole result set into an (n, k) matrix, then slice columns out of it
+    if isinstance(first, dict):
+        matrix = np.array([tuple(p.values()) for p in points], dtype=np.float64)
+    else:
+        matrix = np.array([tuple(p) for p in points], dtype=np.float64)
+    for c in columns:
+        if c in keys:
+            out[c] = matrix[:, keys.index(c)]
+    return out
+
+
+def compute_ride_stats(latitude, longitude, timestamp, speed=None, altitude=None):
+    """
+    Compute ride statistics from parallel arrays (timestamps in seconds, speed in km/h,
+    altitude in meters). Returns distance (km), time (s), moving/stopped time (s),
+    avg/top speed (km/h) and elevation gain/loss (m).
+
+    top_speed is the highest speed reported by the device, as before; a track without
+    reported speeds (e.g. most GPX files) has a top speed of 0, not one implied by positions.
+    """
+    lat = np.asarray(latitude, dtype=np.float64)
+    lon = np.asarray(longitude, dtype=np.float64)
+    ts = np.asarray(timestamp, dtype=np.float64)
+    n = len(lat)
+
+    if n >= 2:
+        seg_dist = haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        seg_dist = np.nan_to_num(seg_dist)
+        seg_time = np.nan_to_num(np.diff(ts))
+        total_distance = float(seg_dist.sum())
+        total_time = max(1, int(ts[-1] - ts[0])) if not np.isnan(ts[[0, -1]]).any() else 1
+    else:
+        seg_dist = np.zeros(0)
+        seg_time = np.zeros(0)
+        total_distance = 0.0
+        total_time = 1
+
+    # Implied speed per segment (km/h); zero-length time segments have no speed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        seg_speed = np.where(seg_time > 0, seg_dist / seg_time * 3.6, 0.0)
+
+    moving = seg_speed >= STOPPED_SPEED_KMH
+    moving_time = int(seg_time[moving & (seg_time > 0)].sum())
+    stopped_time = max(0, total_time - moving_time) if n >= 2 else 0
+
+    top_speed = 0.0
+    if speed is not None:
+        reported = np.nan_to_num(np.asarray(speed, dtype=np.float64))
+        if reported.size:
+            top_speed = max(0.0, float(reported.max()))
+
+    elevation_gain = 0.0
+    elevation_loss = 0.0
+    if altitude is not None:
+        alt = np.asarray(altitude, dtype=np.float64)
+        alt = alt[~np.isnan(alt)]
+        if alt.size >= 2:
+            climb = np.diff(alt)
+            elevation_gain = float(climb[climb > 0].sum())
+            elevation_loss = float(abs(climb[climb < 0].sum()))
+
+    distance_km = total_distance / 1000
+    time_hours = total_time / 3600
+    avg_speed = distance_km / time_hours if time_hours > 0 else 0
+    moving_hours = moving_time / 3600
+    moving_avg_speed = distance_km / moving_hours if moving_hours > 0 else 0
+
+    return {
+        'distance': round(distance_km, 2),
+        'time': total_time,
+        'moving_time': moving_time,
+        'stopped_time': stopped_time,
+        'top_speed': round(top_speed, 2),
+        'avg_speed': round(avg_speed, 2),
+        'moving_avg_speed': round(moving_avg_speed, 2),
+        'elevation_gain': round(elevation_gain, 1),
+        'elevation_loss': round(elevation_loss, 1),
+        'point_count': n,
+    }
+
+
+# ---- Running (incremental) stats, updated as points arrive ----
+
+def empty_progress():
+    return {
+        'point_count': 0,
+        'distance': 0.0,
+        'moving_time': 0,
+        'max_speed': 0.0,
+        'elevation_gain': 0.0,
+        'elevation_loss': 0.0,
+        'first_timestamp': None,
+        'last_timestamp': None,
+        'last_latitude': None,
+        'last_longitude': None,
+        'last_altitude': None,
+        'out_of_order': 0,
+    }
+
+
+def _nan(value):
+    return np.nan if value is None else value
+
+
+def accumulate_progress(progress, latitude, longitude, timestamp, speed=None, altitude=None):
+    """
+    Fold a batch of new points (in arrival order) into a running progress dict and
+    return the updated copy. Only the last known point is needed to continue the
+    track, so the cost depends on the batch size, not on the length of the ride.
+
+    If points arrive with timestamps earlier than ones already folded in, the
+    running totals no longer match a time-sorted track; out_of_order is set so
+    the caller can fall back to a full recompute.
+    """
+    p = empty_progress()
+    if progress:
+        p.update({k: progress[k] for k in p if k in progress})
+
+    lat = np.asarray(latitude, dtype=np.float64)
+    lon = np.asarray(longitude, dtype=np.float64)
+    ts = np.asarray(timestamp, dtype=np.float64)
+    n = len(lat)
+    if n == 0:
+        return p
+    spd = np.asarray(speed, dtype=np.float64) if speed is not None else np.zeros(n)
+    alt = np.asarray(altitude, dtype=np.float64) if altitude is not None else np.full(n, np.nan)
+
+    # Continue from the last folded-in point so the first new segment is counted
+    if p['point_count']:
+        lat = np.concatenate(([_nan(p['last_latitude'])], lat))
+        lon = np.concatenate(([_nan(p['last_longitude'])], lon))
+        ts = np.concatenate(([_nan(p['last_timestamp'])], ts))
+        alt = np.concatenate(([_nan(p['last_altitude'])], alt))
+
+    seg_time = np.diff(ts)
+    if (np.nan_to_num(seg_time) < 0).any():
+        p['out_of_order'] = 1
+
+    if len(lat) >= 2:
+        seg_dist = np.nan_to_num(haversine_m(lat[:-1], lon[:-1], lat[1:], lon[1:]))
+        seg_time = np.nan_to_num(seg_time)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            seg_speed = np.where(seg_time > 0, seg_dist / seg_time * 3.6, 0.0)
+        moving = (seg_speed >= STOPPED_SPEED_KMH) & (seg_time > 0)
+        p['distance'] += float(seg_dist.sum())
+        p['moving_time'] += int(seg_time[moving].sum())
+
+    valid_alt = alt[~np.isnan(alt)]
+    if valid_alt.size >= 2:
+        climb = np.diff(valid_alt)
+        p['elevation_gain'] += float(climb[climb > 0].sum())
+        p['elevation_loss'] += float(abs(climb[climb < 0].sum()))
+
+    p['max_speed'] = max(p['max_speed'], float(np.nan_to_num(spd).max()))
+    if p['first_timestamp'] is None and not np.isnan(ts[0]):
+        p['first_timestamp'] = int(ts[0])
+    p['point_count'] += n
+    p['last_latitude'] = float(lat[-1])
+    p['last_longitude'] = float(lon[-1])
+    p['last_timestamp'] = None if np.isnan(ts[-1]) else int(ts[-1])
+    if valid_alt.size:
+        p['last_altitude'] = float(valid_alt[-1])
+    return p
+
+
+def progress_stats(progress):
+    """Turn a running progress dict into the same stats dict compute_ride_stats returns"""
+    first = progress['first_timestamp']
+    last = progress['last_timestamp']
+    total_time = max(1, int(last - first)) if first is not None and last is not None else 1
+    moving_time = int(progress['moving_time'] or 0)
+    distance_km = (progress['distance'] or 0) / 1000
+    top_speed = progress['max_speed'] or 0.0
+    avg_speed = distance_km / (total_time / 3600)
+    moving_avg_speed = distance_km / (moving_time / 3600) if moving_time > 0 else 0
+
+    return {
+        'distance': round(distance_km, 2),
+        'time': total_time,
+        'moving_time': moving_time,
+        'stopped_time': max(0, total_time - moving_time),
+        'top_speed': round(top_speed, 2),
+        'avg_speed': round(avg_speed, 2),
+        'moving_avg_speed': round(moving_avg_speed, 2),
+        'elevation_gain': round(progress['elevation_gain'] or 0, 1),
+        'elevation_loss': round(progress['elevation_loss'] or 0, 1),
+        'point_count': progress['point_count'],
+    }
@@ -0,0 +1,22 @@
+// Decode a Google encoded polyline (as served by /api/ride/<id>/track) into [[lat, lng], ...]
+function decodePolyline(encoded, precision) {
+  const factor = Math.pow(10, precision || 5);
+  const coords = [];
+  let index = 0, lat = 0, lng = 0;
+  while (index < encoded.length) {
+    const deltas = [0, 0];
+    for (let k = 0; k < 2; k++) {
+      let result = 0, shift = 0, byte;
+      do {
+        byte = encoded.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+      deltas[k] = (result & 1) ? ~(result >> 1) : (result >> 1);
+    }
+    lat += deltas[0];
+    lng += deltas[1];
+    coords.push([lat / factor, lng / factor]);
+  }
+  return coords;
+}
@@ -3,6 +3,9 @@ const MAPTILER_KEY = 'MT4X5mlV3sOGZhylVirr';
 const SPEED_THRESHOLD_KMH = 9;  // 9 km/h to trigger motorcycle prompt
 const PROMPT_COOLDOWN = 5000;  // 5 seconds before showing prompt again
 const GPS_UPDATE_INTERVAL = 1000;  // Send GPS update every 1 second
+const GPS_BATCH_SIZE = 15;  // Flush buffered GPS points once this many are collected
+const GPS_FLUSH_INTERVAL = 5000;  // ...or every 5 seconds, whichever comes first
+const GPS_QUEUE_KEY = 'motoLog_gpsQueue';  // localStorage key for batches waiting to be sent
 
 let map;
 let currentRideId = null;
@@ -17,6 +20,9 @@ let startPoint = null;
 let totalDistance = 0;
 let avgSpeed = 0;
 let topSpeed = 0;
+let gpsBuffer = [];
+let gpsFlushTimer = null;
+let gpsQueueDrain = null;
 
 // Toast notification system (instead of alert)
 function showToast(message, type = 'info', duration = 3000) {
@@ -122,6 +128,101 @@ function clearState() {
   localStorage.removeItem('motoLog_rideState');
 }
 
+// ---- Batched GPS upload with offline queue ----
+// Points are buffered in memory, then moved as a batch into a localStorage queue
+// which is sent to /api/ride/add-gps-points. Batches that fail to send stay queued
+// and are replayed when the browser comes back online or the page is reloaded.
+
+function loadGPSQueue() {
+  try {
+    return JSON.parse(localStorage.getItem(GPS_QUEUE_KEY)) || [];
+  } catch (e) {
+    console.error('Failed to read GPS queue:', e);
+    return [];
+  }
+}
+
+function saveGPSQueue(queue) {
+  if (queue.length > 0) {
+    localStorage.setItem(GPS_QUEUE_KEY, JSON.stringify(queue));
+  } else {
+    localStorage.removeItem(GPS_QUEUE_KEY);
+  }
+}
+
+function queueGPSPoint(point) {
+  gpsBuffer.push(point);
+  if (gpsBuffer.length >= GPS_BATCH_SIZE) {
+    flushGPSBuffer();
+  }
+}
+
+// Move buffered points into the persistent queue and try to send them
+function flushGPSBuffer() {
+  if (gpsBuffer.length > 0 && currentRideId) {
+    const queue = loadGPSQueue();
+    queue.push({ ride_id: currentRideId, points: gpsBuffer });
+    saveGPSQueue(queue);
+    gpsBuffer = [];
+  }
+  return drainGPSQueue();
+}
+
+// Send queued batches oldest-first; stops at the first network/server failure
+function drainGPSQueue() {
+  if (gpsQueueDrain) return gpsQueueDrain;
+  if (!navigator.onLine) return Promise.resolve();
+
+  const sendNext = () => {
+    const queue = loadGPSQueue();
+    if (queue.length === 0) return Promise.resolve();
+
+    const batch = queue[0];
+    return fetch('/api/ride/add-gps-points', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(batch)
+    })
+    .then(r => {
+      if (r.ok || (r.status >= 400 && r.status < 500 && r.status !== 401)) {
+        // Sent, or rejected for good (e.g. ride deleted) - either way drop it from the queue
+        if (!r.ok) console.warn('⚠️ GPS batch rejected with status', r.status, '- dropping', batch.points.length, 'points');
+        const remaining = loadGPSQueue();
+        remaining.shift();
+        saveGPSQueue(remaining);
+        return sendNext();
+      }
+      console.warn('⚠️ GPS batch upload failed with status', r.status, '- will retry');
+    });
+  };
+
+  gpsQueueDrain = sendNext()
+    .catch(e => console.error('Error sending GPS batch (kept for retry):', e))
+    .finally(() => { gpsQueueDrain = null; });
+  return gpsQueueDrain;
+}
+
+function hasQueuedGPSPoints(rideId) {
+  return gpsBuffer.length > 0 || loadGPSQueue().some(b => String(b.ride_id) === String(rideId));
+}
+
+function startGPSFlushTimer() {
+  stopGPSFlushTimer();
+  gpsFlushTimer = setInterval(flushGPSBuffer, GPS_FLUSH_INTERVAL);
+}
+
+function stopGPSFlushTimer() {
+  if (gpsFlushTimer) {
+    clearInterval(gpsFlushTimer);
+    gpsFlushTimer = null;
+  }
+}
+
+window.addEventListener('online', () => {
+  console.log('🌐 Back online, replaying queued GPS points');
+  drainGPSQueue();
+});
+
 // Initialize map
 function initMap() {
   map = L.map('map').setView([42.6955, 23.3322], 13);
@@ -210,6 +311,8 @@ function startRide() {
       
       // Start GPS tracking
       console.log('🎯 Starting GPS tracking...');
+      gpsBuffer = [];
+      startGPSFlushTimer();
       startGPSTracking();
     } else if (data.success === false) {
       throw new Error('API error: ' + (data.error || 'Unknown error'));
@@ -296,20 +399,15 @@ function onGPSUpdate(position) {
     showMotorcyclePrompt();
   }
   
-  // Send GPS point to backend if recording
+  // Buffer GPS point for the next batch upload if recording
   if (isRecording && currentRideId) {
-    fetch('/api/ride/add-gps-point', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        ride_id: currentRideId,
-        latitude,
-        longitude,
-        speed: speedKMH,
-        altitude: position.coords.altitude,
-        timestamp
-      })
-    }).catch(e => console.error('Error adding GPS point:', e));
+    queueGPSPoint({
+      latitude,
+      longitude,
+      speed: speedKMH,
+      altitude: position.coords.altitude,
+      timestamp
+    });
   }
 }
 
@@ -414,6 +512,26 @@ function updateStats() {
   document.getElementById('time').textContent = `${minutes}:${seconds.toString().padStart(2, '0')}`;
 }
 
+// After a reload the in-memory points are gone; show the server's running totals instead
+function loadCurrentStats() {
+  fetch(`/api/ride/${currentRideId}/current-stats`)
+  .then(r => r.json())
+  .then(data => {
+    if (!data.success || !data.stats) return;
+    const stats = data.stats;
+    totalDistance = stats.distance;
+    topSpeed = stats.top_speed;
+    avgSpeed = stats.avg_speed;
+    document.getElementById('distance').textContent = stats.distance.toFixed(2) + ' km';
+    document.getElementById('topSpeed').textContent = stats.top_speed.toFixed(1) + ' km/h';
+    document.getElementById('avgSpeed').textContent = stats.avg_speed.toFixed(1) + ' km/h';
+    if (data.last_position && data.last_position.latitude != null) {
+      map.setView([data.last_position.latitude, data.last_position.longitude], 16);
+    }
+  })
+  .catch(e => console.error('Error loading current ride stats:', e));
+}
+
 // Stop ride
 function stopRide() {
   console.log('🛑 stopRide() called. State: currentRideId=', currentRideId, 'isRecording=', isRecording);
@@ -501,9 +619,17 @@ function submitStopForm(event) {
   
   console.log('📤 Sending stop request for ride:', currentRideId);
   
-  fetch('/api/ride/stop', {
-    method: 'POST',
-    body: formData
+  // Make sure every buffered/queued point reached the server before stats are calculated
+  const stoppingRideId = currentRideId;
+  flushGPSBuffer()
+  .then(() => {
+    if (hasQueuedGPSPoints(stoppingRideId)) {
+      throw new Error('Some GPS points are still waiting to upload. Check your connection and try again.');
+    }
+    return fetch('/api/ride/stop', {
+      method: 'POST',
+      body: formData
+    });
   })
   .then(r => r.json())
   .then(data => {
@@ -526,6 +652,7 @@ function submitStopForm(event) {
     document.getElementById('startBtn').textContent = 'Start Ride';
     
     // Clear state
+    stopGPSFlushTimer();
     currentRideId = null;
     isRecording = false;
     rideStartTime = null;
@@ -570,7 +697,8 @@ function cancelStopForm() {
   }
 }
 
-// Upload and parse GPX file
+// Import a GPX file as a finished ride; the server parses it, stores the track and
+// computes the stats in one pass, then we open the new ride
 function uploadGPX() {
   const fileInput = document.getElementById('gpxFile');
   const file = fileInput.files[0];
@@ -581,198 +709,40 @@ function uploadGPX() {
     return;
   }
   
-  uploadBtn.textContent = '📤 Uploading...';
+  uploadBtn.textContent = '📤 Importing...';
   uploadBtn.disabled = true;
   
   const formData = new FormData();
   formData.append('gpx_file', file);
+  const bikeId = document.getElementById('bikeSelect').value;
+  if (bikeId) formData.append('bike_id', bikeId);
   
-  console.log('🟡 uploadGPX() started. Current state:');
-  console.log('   currentRideId:', currentRideId);
-  console.log('   isRecording:', isRecording);
-  
-  // Restore state in case it was lost
-  if (!currentRideId) {
-    restoreState();
-    console.log('📂 Restored state from localStorage. currentRideId=', currentRideId);
-  }
-  
-  fetch('/api/ride/upload-gpx', {
+  fetch('/api/ride/import-gpx', {
     method: 'POST',
     body: formData
   })
   .then(r => r.json())
   .then(data => {
     if (data.success) {
-      console.log('✅ GPX file uploaded successfully with', data.count, 'points');
-      console.log('📊 Current state after upload - isRecording:', isRecording, 'currentRideId:', currentRideId);
-      
-      // If ride not started, start it now
-      if (!currentRideId) {
-        console.log('🟠 No active ride. Auto-starting new ride for GPX...');
-        
-        const bikeId = document.getElementById('bikeSelect').value;
-        
-        fetch('/api/ride/start', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ bike_id: bikeId || null })
-        })
-        .then(r => r.json())
-        .then(startData => {
-          console.log('📡 Start API response:', startData);
-          console.log('   success:', startData.success, 'ride_id:', startData.ride_id);
-          
-          if (startData.success && startData.ride_id && startData.ride_id > 0) {
-            // Set ALL state immediately and SAVE IT
-            currentRideId = startData.ride_id;
-            isRecording = true;
-            rideStartTime = Date.now();
-            ridePoints = [];
-            rideRoute = [];
-            saveState();
-            
-            console.log('✅✅ AUTO-START SUCCESS! New state:');
-            console.log('   currentRideId:', currentRideId);
-            console.log('   isRecording:', isRecording);
-            console.log('   rideStartTime:', rideStartTime);
-            console.log('💾 State saved to localStorage');
-            
-            // Update UI
-            document.getElementById('status').textContent = '🔴 Recording...';
-            document.getElementById('status').className = 'track-status status-recording';
-            document.getElementById('startBtn').disabled = true;
-            document.getElementById('stopBtn').disabled = false;
-            document.getElementById('bikeSelect').disabled = true;
-            
-            // Start GPS
-            startGPSTracking();
-            
-            // Proceed with GPX immediately
-            console.log('✅ State ready! Starting GPX simulation with', data.points.length, 'points');
-            simulateGPXRide(data.points);
-            
-            uploadBtn.textContent = '📤 Upload GPX';
-            uploadBtn.disabled = false;
-          } else {
-            console.error('❌ Failed to start ride:', startData.error);
-            showToast('Failed to start ride: ' + startData.error, 'error');
-            uploadBtn.textContent = '📤 Upload GPX';
-            uploadBtn.disabled = false;
-          }
-        })
-        .catch(e => {
-          console.error('❌ Error calling start API:', e);
-          showToast('Network error: ' + e.message, 'error');
-          uploadBtn.textContent = '📤 Upload GPX';
-          uploadBtn.disabled = false;
-        });
-      } else {
-        console.log('✅ Ride already active (ID: ' + currentRideId + '), proceeding with GPX immediately');
-        simulateGPXRide(data.points);
-        uploadBtn.textContent = '📤 Upload GPX';
-        uploadBtn.disabled = false;
-      }
-      
-      document.getElementById('gpxFile').value = '';
-      document.getElementById('fileName').textContent = '📄 Choose GPX File';
-      
-      setTimeout(() => {
-        showToast(`Loaded ${data.count} GPS points from GPX file`, 'success');
-      }, 500);
+      console.log('✅ GPX imported as ride', data.ride_id, data.stats);
+      showToast(`Imported ${data.stats.point_count} GPS points (${data.stats.distance} km)`, 'success');
+      setTimeout(() => { window.location.href = data.url; }, 800);
     } else {
       showToast('Error: ' + data.error, 'error');
-      uploadBtn.textContent = '📤 Upload GPX';
-      uploadBtn.disabled = false;
     }
   })
   .catch(e => {
-    console.error('Error uploading GPX:', e);
+    console.error('Error importing GPX:', e);
     showToast('Upload error: ' + e.message, 'error');
+  })
+  .finally(() => {
     uploadBtn.textContent = '📤 Upload GPX';
     uploadBtn.disabled = false;
+    document.getElementById('gpxFile').value = '';
+    document.getElementById('fileName').textContent = '📄 Choose GPX File';
   });
 }
 
-// Simulate ride from GPX points
-function simulateGPXRide(gpxPoints) {
-  console.log('🎯 simulateGPXRide() called');
-  console.log('   currentRideId:', currentRideId, '(type:', typeof currentRideId, ')');
-  console.log('   isRecording:', isRecording);
-  console.log('   gpxPoints:', gpxPoints.length);
-  
-  // Restore state if it was somehow lost
-  if (!currentRideId) {
-    console.log('⚠️ currentRideId is null! Attempting to restore from localStorage...');
-    restoreState();
-  }
-  
-  if (!currentRideId) {
-    console.error('❌ FATAL: No ride ID available even after restore!');
-    showToast('Error: No active ride ID. Please click Start again or refresh.', 'error');
-    return;
-  }
-  
-  if (!isRecording) {
-    console.warn('⚠️ WARNING: isRecording is false, but we have a ride ID. Proceeding with GPX simulation...');
-  }
-  
-  console.log('✅ GPX simulation starting with', gpxPoints.length, 'points');
-  console.log('💾 Current localStorage state:', localStorage.getItem('motoLog_rideState'));
-  
-  rideRoute = gpxPoints.map(p => [p.lat, p.lon]);
-  let pointIndex = 0;
-  
-  // Send all points to backend with delays
-  const sendNextPoint = () => {
-    if (pointIndex >= gpxPoints.length) {
-      console.log('GPX simulation complete');
-      showToast('GPX simulation complete! ' + gpxPoints.length + ' points added.', 'success');
-      return;
-    }
-    
-    const point = gpxPoints[pointIndex];
-    const timestamp = Math.floor(Date.now() / 1000) + pointIndex;
-    
-    fetch('/api/ride/add-gps-point', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        ride_id: currentRideId,
-        latitude: point.lat,
-        longitude: point.lon,
-        speed: 25 + Math.random() * 15,  // Simulate 25-40 km/h
-        altitude: point.ele || 0,
-        timestamp: timestamp
-      })
-    })
-    .then(r => r.json())
-    .then(data => {
-      if (data.success) {
-        // Add to local tracking
-        ridePoints.push({
-          latitude: point.lat,
-          longitude: point.lon,
-          speed: 30,
-          timestamp: timestamp
-        });
-        
-        updateMapRoute();
-        updateStats();
-        
-        pointIndex++;
-        // Send next point after 50ms
-        setTimeout(sendNextPoint, 50);
-      } else {
-        console.error('Error adding GPX point:', data.error);
-      }
-    })
-    .catch(e => console.error('Error sending GPX point:', e));
-  };
-  
-  sendNextPoint();
-}
-
 // Haversine distance formula (returns km)
 function haversine(lat1, lon1, lat2, lon2) {
   const R = 6371;
@@ -794,6 +764,9 @@ window.addEventListener('DOMContentLoaded', () => {
   restoreState();
   initMap();
   
+  // Replay any GPS batches that were queued while offline
+  drainGPSQueue();
+  
   // Update UI based on restored state - but only if there's actually a recording happening
   // Check if currentRideId is valid (> 0) and isRecording is true
   if (currentRideId && currentRideId > 0 && isRecording) {
@@ -803,6 +776,8 @@ window.addEventListener('DOMContentLoaded', () => {
     document.getElementById('startBtn').disabled = true;
     document.getElementById('stopBtn').disabled = false;
     document.getElementById('bikeSelect').disabled = true;
+    startGPSFlushTimer();
+    loadCurrentStats();
   } else {
     // Clear any stale state
     clearState();
@@ -0,0 +1,144 @@
+"""
+Douglas-Peucker simplification of ride tracks for map rendering.
+
+Maps only need enough points to draw the route at the zoom they show it at, so the
+ride page and the bike page thumbnails are drawn from a simplified copy of the track;
+the full-resolution track (track_store.load_ride_track) is untouched for stats and
+export. Tolerances are in meters: a point is dropped when the simplified line passes
+within that distance of it.
+
+Simplified tracks of finished rides are cached in ride_track_simplified, keyed by ride
+and tolerance. Tolerances are snapped to a fixed ladder so the cache holds at most a
+handful of rows per ride, and triggers on ride_tracks drop them when the track changes
+(see migrate_add_simplified_tracks.py). Rides still recording are simplified on the fly.
+"""
+
+import json
+
+import numpy as np
+
+import queries as sql
+from query_runner import execute_query, run_query
+from ride_stats import EARTH_RADIUS_M, track_arrays
+from track_store import COLUMNS, decode_track, encode_track, load_ride_track
+
+# Cacheable tolerances in meters; anything else is snapped down to the nearest step
+TOLERANCE_LADDER = (1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0)
+# Ground meters per screen pixel at zoom 0 on the equator (Web Mercator, 256 px tiles)
+METERS_PER_PIXEL_Z0 = 156543.03392
+
+
+def snap_tolerance(tolerance_m):
+    """Largest ladder step not above the requested tolerance (at least the finest step)"""
+    steps = [t for t in TOLERANCE_LADDER if t <= tolerance_m]
+    return steps[-1] if steps else TOLERANCE_LADDER[0]
+
+
+def tolerance_for_zoom(zoom, latitude=0.0, pixels=0.5):
+    """Tolerance that keeps the simplified line within `pixels` of the real one at `zoom`"""
+    return METERS_PER_PIXEL_Z0 * np.cos(np.radians(latitude)) / (2 ** zoom) * pixels
+
+
+def douglas_peucker(latitude, longitude, tolerance_m):
+    """
+    Indices of the points Douglas-Peucker keeps at `tolerance_m`. NaN coordinates are
+    skipped; the first and last valid points are always kept.
+    """
+    lat = np.asarray(latitude, dtype=np.float64)
+    lon = np.asarray(longitude, dtype=np.float64)
+    valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+    if len(valid) <= 2:
+        return valid
+
+    # Local equirectangular projection; plenty accurate at ride scale
+    lat0 = np.radians(np.mean(lat[valid]))
+    y = np.radians(lat[valid]) * EARTH_RADIUS_M
+    x = np.radians(lon[valid]) * EARTH_RADIUS_M * np.cos(lat0)
+
+    keep = np.zeros(len(valid), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(valid) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        # Distance of every interior point to the segment first-last, in one pass
+        px, py = x[first + 1:last], y[first + 1:last]
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        length_sq = dx * dx + dy * dy
+        if length_sq > 0:
+            t = np.clip(((px - x[first]) * dx + (py - y[first]) * dy) / length_sq, 0.0, 1.0)
+        else:
+            t = 0.0
+        dist = np.hypot(px - (x[first] + t * dx), py - (y[first] + t * dy))
+        worst = int(np.argmax(dist))
+        if dist[worst] > tolerance_m:
+            split = first + 1 + worst
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return valid[keep]
+
+
+def simplify_track(track, tolerance_m):
+    """The track (dict of arrays, as from track_store) reduced to its Douglas-Peucker points"""
+    kept = douglas_peucker(track['latitude'], track['longitude'], tolerance_m)
+    return {c: v[kept] for c, v in track.items()}
+
+
+def load_simplified_track(conn, ride_id, tolerance_m):
+    """
+    Simplified track of a ride at (the snapped) tolerance_m. Finished rides are served
+    from and stored into the ride_track_simplified cache; rides still recording are
+    simplified from gps_points on every call.
+    """
+    tolerance_m = snap_tolerance(tolerance_m)
+    row = run_query(conn, sql.SIMPLIFIED_TRACK_DATA, (ride_id, tolerance_m), one=True)
+    if row:
+        return decode_track(row[0])
+
+    packed = run_query(conn, sql.RIDE_TRACK_DATA, (ride_id,), one=True)
+    if not packed:
+        return simplify_track(load_ride_track(conn, ride_id), tolerance_m)
+
+    simplified = simplify_track(decode_track(packed[0]), tolerance_m)
+    with conn:
+        execute_query(conn, sql.SIMPLIFIED_TRACK_STORE,
+                      (ride_id, tolerance_m, len(simplified['latitude']), encode_track(simplified)))
+    return simplified
+
+
+
+def load_simplified_tracks(conn, ride_ids, tolerance_m):
+    """
+    Batched load_simplified_track for a page of rides: {ride_id: track}. Cache hits and
+    packed tracks are each read with one query; cache misses are simplified and stored
+    in a single transaction. Rides with no points are left out.
+    """
+    tolerance_m = snap_tolerance(tolerance_m)
+    ride_ids = list(dict.fromkeys(ride_ids))
+    if not ride_ids:
+        return {}
+    tracks = {ride_id: decode_track(data) for ride_id, data in
+              run_query(conn, sql.SIMPLIFIED_TRACKS_DATA, (tolerance_m, json.dumps(ride_ids)))}
+
+    missing = [ride_id for ride_id in ride_ids if ride_id not in tracks]
+    if not missing:
+        return tracks
+    fresh = []
+    for ride_id, data in run_query(conn, sql.RIDES_TRACK_DATA, (json.dumps(missing),)):
+        tracks[ride_id] = simplify_track(decode_track(data), tolerance_m)
+        fresh.append((ride_id, tolerance_m, len(tracks[ride_id]['latitude']), encode_track(tracks[ride_id])))
+    if fresh:
+        with conn:
+            execute_query(conn, sql.SIMPLIFIED_TRACK_STORE, fresh, many=True)
+
+    # Rides still recording (or never packed) come from gps_points, again in one query
+    missing = [ride_id for ride_id in missing if ride_id not in tracks]
+    if missing:
+        rows = {}
+        for ride_id, *point in run_query(conn, sql.RIDES_TRACK_POINTS, (json.dumps(missing),)):
+            rows.setdefault(ride_id, []).append(dict(zip(COLUMNS, point)))
+        for ride_id, points in rows.items():
+            tracks[ride_id] = simplify_track(track_arrays(points), tolerance_m)
+    return tracks
@@ -0,0 +1,242 @@
+"""
+Compact columnar storage for finished ride tracks.
+
+While a ride is being recorded its points land in gps_points, one row per fix. When
+the ride is stopped they are packed into a single ride_tracks BLOB and the rows are
+dropped; readers get the track back as the same dict of float64 arrays that
+ride_stats.track_arrays returns, so compute_ride_stats and the templates don't care
+where it came from.
+
+Blob layout (little-endian):
+    header   '<4sBI'  magic b'MLTK', format version, point count
+    per column in COLUMNS order:
+             '<BdI'   flags, scale, payload length
+             mask     ceil(n / 8) bytes, bit set = value present (only if FLAG_HAS_NULLS)
+             payload  varints of zigzag(delta(round(value * scale)))
+
+Each column is stored as fixed-point integers (1e-7 deg is ~1 cm, speed and altitude
+to the centimetre), delta-encoded against the previous point, zigzag-mapped so small
+negative steps stay small and written as LEB128 varints. A 1 Hz track typically packs
+into 7-9 bytes per point against ~60 for a gps_points row plus its index entries.
+Encoding and decoding are whole-array NumPy operations; see bench_track_store.py.
+"""
+
+import struct
+
+import numpy as np
+
+import queries as sql
+from query_runner import execute_query, run_query
+from ride_stats import track_arrays
+
+MAGIC = b'MLTK'
+VERSION = 1
+ENCODING = f'delta-zigzag-varint/v{VERSION}'
+
+COLUMNS = ('latitude', 'longitude', 'speed', 'altitude', 'timestamp')
+SCALES = {
+    'latitude': 1e7,
+    'longitude': 1e7,
+    'speed': 100.0,
+    'altitude': 100.0,
+    'timestamp': 1.0,
+}
+# Sub-second timestamps (GPX imports, high-rate loggers) are kept to the millisecond
+FRACTIONAL_TIMESTAMP_SCALE = 1000.0
+
+FLAG_HAS_NULLS = 1
+FLAG_ALL_NULL = 2
+
+_HEADER = struct.Struct('<4sBI')
+_COLUMN = struct.Struct('<BdI')
+
+
+def _split_groups(values, bits):
+    """
+    Split uint64 values into little-endian groups of `bits` bits, with the bit above
+    the group set on every group but a value's last one. Returns a uint64 array.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    limits = np.array([1 << (bits * k) for k in range(1, 64 // bits + 1)], dtype=np.uint64)
+    ngroups = 1 + (values[:, None] >= limits).sum(axis=1)
+    starts = np.cumsum(ngroups) - ngroups
+    owner = np.repeat(np.arange(len(values)), ngroups)
+    position = np.arange(int(ngroups.sum())) - starts[owner]
+    out = (values[owner] >> (bits * position).astype(np.uint64)) & np.uint64((1 << bits) - 1)
+    out[position < ngroups[owner] - 1] |= np.uint64(1 << bits)
+    return out
+
+
+def varint_encode(values):
+    """LEB128-encode an array of uint64 values into bytes"""
+    return _split_groups(values, 7).astype(np.uint8).tobytes()
+
+
+def varint_decode(data, count):
+    """Decode exactly `count` LEB128 varints from bytes into a uint64 array"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero((buf & 0x80) == 0)
+    if len(ends) != count or (count and ends[-1] != len(buf) - 1):
+        raise ValueError(f'Corrupt track column: expected {count} varints')
+    if count == 0:
+        return np.zeros(0, dtype=np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)
+    parts = (buf & 0x7F).astype(np.uint64) << (7 * position).astype(np.uint64)
+    # The 7-bit groups don't overlap, so summing them is the same as OR-ing them
+    return np.add.reduceat(parts, starts)
+
+
+def zigzag(values):
+    """Map signed int64 to uint64 so that small magnitudes get small codes"""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return ((values >> np.uint64(1)) ^ (np.uint64(0) - (values & np.uint64(1)))).view(np.int64)
+
+
+def encode_polyline(latitude, longitude, precision=5):
+    """
+    Google encoded polyline string for the coordinates (NaN points are skipped).
+    precision=5 is what Leaflet plugins and the Google Maps API expect by default.
+    """
+    lat = np.asarray(latitude, dtype=np.float64)
+    lon = np.asarray(longitude, dtype=np.float64)
+    present = ~(np.isnan(lat) | np.isnan(lon))
+    coords = np.round(np.column_stack((lat[present], lon[present])) * 10 ** precision).astype(np.int64)
+    # Interleaved lat/lon deltas; the format's "shift left, invert if negative" is zigzag
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    return (_split_groups(zigzag(deltas), 5) + np.uint64(63)).astype(np.uint8).tobytes().decode('ascii')
+
+
+def _column_scale(name, values):
+    if name == 'timestamp':
+        present = values[~np.isnan(values)]
+        if len(present) and not np.array_equal(present, np.round(present)):
+            return FRACTIONAL_TIMESTAMP_SCALE
+    return SCALES[name]
+
+
+def encode_track(track):
+    """
+    Pack a track (dict of equal-length arrays keyed by COLUMNS, NaN = missing) into a
+    blob. Columns absent from the dict are stored as all-null.
+    """
+    n = len(track['latitude'])
+    parts = [_HEADER.pack(MAGIC, VERSION, n)]
+    for name in COLUMNS:
+        values = np.asarray(track.get(name, np.full(n, np.nan)), dtype=np.float64)
+        scale = _column_scale(name, values)
+        present = ~np.isnan(values)
+        if not present.any():
+            parts.append(_COLUMN.pack(FLAG_ALL_NULL, scale, 0))
+            continue
+        fixed = np.zeros(n, dtype=np.int64)
+        fixed[present] = np.round(values[present] * scale).astype(np.int64)
+        # Carry the last value across gaps so a missing point costs a single zero byte
+        last_present = np.maximum.accumulate(np.where(present, np.arange(n), 0))
+        fixed = np.where(present, fixed, fixed[last_present])
+        payload = varint_encode(zigzag(np.diff(fixed, prepend=0)))
+        if present.all():
+            parts.append(_COLUMN.pack(0, scale, len(payload)))
+        else:
+            parts.append(_COLUMN.pack(FLAG_HAS_NULLS, scale, len(payload)))
+            parts.append(np.packbits(present).tobytes())
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_track(blob):
+    """Unpack a blob from encode_track into a dict of float64 arrays (NaN = missing)"""
+    blob = bytes(blob)
+    magic, version, n = _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'Unsupported track blob (magic={magic!r}, version={version})')
+    offset = _HEADER.size
+    track = {}
+    for name in COLUMNS:
+        flags, scale, length = _COLUMN.unpack_from(blob, offset)
+        offset += _COLUMN.size
+        if flags & FLAG_ALL_NULL:
+            track[name] = np.full(n, np.nan)
+            continue
+        present = None
+        if flags & FLAG_HAS_NULLS:
+            mask_len = (n + 7) // 8
+            present = np.unpackbits(np.frombuffer(blob, np.uint8, mask_len, offset), count=n).astype(bool)
+            offset += mask_len
+        deltas = unzigzag(varint_decode(blob[offset:offset + length], n))
+        offset += length
+        values = np.cumsum(deltas) / scale
+        if present is not None:
+            values[~present] = np.nan
+        track[name] = values
+    return track
+
+
+def track_points(track, columns=('latitude', 'longitude', 'timestamp')):
+    """Rows of plain Python values (missing -> None) for templates and JSON"""
+    cols = [track[c].tolist() for c in columns]
+    rows = []
+    for values in zip(*cols):
+        row = {}
+        for c, v in zip(columns, values):
+            if v != v:  # NaN
+                v = None
+            elif c == 'timestamp' and v == int(v):
+                v = int(v)
+            row[c] = v
+        rows.append(row)
+    return rows
+
+
+def load_ride_track(conn, ride_id):
+    """
+    Track of a ride as arrays: the packed ride_tracks blob once the ride is finished,
+    otherwise the gps_points rows recorded so far.
+    """
+    row = run_query(conn, sql.RIDE_TRACK_DATA, (ride_id,), one=True)
+    if row:
+        return decode_track(row[0])
+    rows = run_query(conn, sql.RIDE_TRACK_POINTS, (ride_id,))
+    return track_arrays([dict(zip(COLUMNS, r)) for r in rows])
+
+
+def pack_ride_points(conn, ride_id):
+    """
+    Move a ride's gps_points rows into its ride_tracks blob (merged with any blob it
+    already has) in one transaction. Returns the number of points in the blob, or 0
+    if the ride has no points to pack.
+    """
+    with conn:
+        rows = run_query(conn, sql.RIDE_TRACK_POINTS, (ride_id,))
+        if not rows:
+            existing = run_query(conn, sql.RIDE_TRACK_POINT_COUNT, (ride_id,), one=True)
+            return existing[0] if existing else 0
+
+        track = track_arrays([dict(zip(COLUMNS, r)) for r in rows])
+        existing = run_query(conn, sql.RIDE_TRACK_DATA, (ride_id,), one=True)
+        if existing:
+            packed = decode_track(existing[0])
+            track = {c: np.concatenate((packed[c], track[c])) for c in COLUMNS}
+            order = np.argsort(track['timestamp'], kind='stable')
+            track = {c: v[order] for c, v in track.items()}
+
+        return store_ride_track(conn, ride_id, track)
+
+
+def store_ride_track(conn, ride_id, track):
+    """
+    Write `track` as the ride's packed track and drop its gps_points rows, in one
+    transaction. Returns the number of points stored.
+    """
+    count = len(track['latitude'])
+    with conn:
+        execute_query(conn, sql.RIDE_TRACK_STORE, (ride_id, count, ENCODING, encode_track(track)))
+        execute_query(conn, sql.RIDE_GPS_POINTS_DELETE, (ride_id,))
+    return count